@@ -3,43 +3,37 @@ Context Management Utilities
 
 This module provides utilities for managing context in agent systems.
 
-Note: This module uses simplified estimation functions for demonstration.
-Production systems should use actual tokenizers (tiktoken for OpenAI,
-model-specific tokenizers for other providers) for accurate token counts.
+Token counts come from token_counter.py, which is shared with the
+context-optimization skill. It defaults to a ~4 chars/token estimate; call
+token_counter.set_tokenizer() with a real tokenizer for accurate budgets.
 """
 
 from typing import Dict, List
+from collections import OrderedDict
+import bisect
 import hashlib
+import itertools
+import mmap
+import os
+import re
+import zlib
+
+from token_counter import count_tokens, get_counter
 
 
 def estimate_token_count(text: str) -> int:
     """
-    Estimate token count for text.
-    
-    Uses approximation: ~4 characters per token for English.
-    
-    WARNING: This is a rough estimate for demonstration purposes.
-    Production systems should use actual tokenizers:
-    - OpenAI: tiktoken library
-    - Anthropic: Model-specific tokenizers
-    - Other: Provider-specific tokenization
+    Count tokens for text with the shared token counter.
     
-    Actual tokenization varies by:
-    - Model architecture
-    - Content type (code vs prose)
-    - Language (non-English typically has higher token/char ratio)
+    Counts are cached by content hash, so re-counting unchanged sections
+    and messages is a dictionary lookup.
     """
-    return len(text) // 4
+    return count_tokens(text)
 
 
 def estimate_message_tokens(messages: list) -> int:
-    """Estimate token count for message list."""
-    total = 0
-    for msg in messages:
-        content = msg.get("content", "")
-        total += estimate_token_count(content)
-        total += 10  # Overhead for role/formatting
-    return total
+    """Estimate token count for message list (+10 per message for role/formatting)."""
+    return get_counter().count_messages(messages, overhead=10)
 
 
 def count_tokens_by_type(context: Dict) -> Dict:
@@ -77,54 +71,402 @@ def count_tokens_by_type(context: Dict) -> Dict:
 # Context Builder
 
 class ContextBuilder:
-    """Build context with budget management."""
+    """
+    Build context with budget management.
     
-    def __init__(self, context_limit: int = 100000):
+    Token totals are kept up to date as sections are added or removed, and
+    sections are kept in build order (priority, then insertion) with bisect,
+    so a turn that changes one section does not re-sort or re-count the rest.
+    The last build is reused until a section changes.
+    
+    build() packs greedily by priority by default. build(mode="optimal")
+    instead maximizes total section value within the limit (see
+    _build_optimal), honouring required sections, dependencies and
+    summary variants. It is exact up to token bucketing while the DP stays
+    small (at most exact_section_limit dependency groups, exact_option_limit
+    options in total, exact_group_limit combinations per group), which keeps
+    a solve under a millisecond, and a value-density heuristic beyond that;
+    last_build["exact"] says which.
+    """
+    
+    def __init__(self, context_limit: int = 100000, summary_value: float = 0.5,
+                 exact_section_limit: int = 32, resolution: int = 1024,
+                 exact_group_limit: int = 81, exact_option_limit: int = 96):
         self.context_limit = context_limit
-        self.sections: Dict[str, str] = {}
+        self.summary_value = summary_value
+        self.exact_section_limit = exact_section_limit
+        self.exact_group_limit = exact_group_limit
+        self.exact_option_limit = exact_option_limit
+        self.resolution = resolution
+        self.sections: Dict[str, Dict] = {}
         self.order: List[str] = []
+        self.total_tokens = 0
+        self.last_build: Dict = {}
+        self._ranked: List[tuple] = []  # (-priority, seq, name), sorted
+        self._seq = itertools.count()
+        self._built = None  # (limit, mode, context) of the last build
     
     def add_section(self, name: str, content: str, 
-                    priority: int = 0, category: str = "other"):
-        """Add section to context."""
-        if name not in self.sections:
+                    priority: int = 0, category: str = "other",
+                    summary: str = None, required: bool = False,
+                    depends_on: List[str] = None, value: float = None):
+        """
+        Add section to context.
+        
+        Optimal builds also use:
+            summary: Shorter variant, worth summary_value of the full section
+            required: Always include, in full or as the summary
+            depends_on: Sections that must be included for this one to be
+            value: Packing value; defaults to priority + 1
+        """
+        depends_on = list(depends_on or [])
+        value = float(max(priority, 0) + 1 if value is None else value)
+        previous = self.sections.get(name)
+        if previous is None:
             self.order.append(name)
+            seq = next(self._seq)
+            bisect.insort(self._ranked, (-priority, seq, name))
+        else:
+            if (previous["content"] == content and previous["priority"] == priority
+                    and previous["category"] == category and previous["summary"] == summary
+                    and previous["required"] == required
+                    and previous["depends_on"] == depends_on and previous["value"] == value):
+                return
+            seq = previous["seq"]
+            self.total_tokens -= previous["tokens"]
+            if previous["priority"] != priority:
+                self._unrank(previous["priority"], seq, name)
+                bisect.insort(self._ranked, (-priority, seq, name))
         
+        tokens = estimate_token_count(content)
         self.sections[name] = {
             "content": content,
             "priority": priority,
             "category": category,
-            "tokens": estimate_token_count(content)
+            "tokens": tokens,
+            "summary": summary,
+            "summary_tokens": estimate_token_count(summary) if summary is not None else None,
+            "required": required,
+            "depends_on": depends_on,
+            "value": value,
+            "seq": seq
         }
+        self.total_tokens += tokens
+        self._built = None
+    
+    def remove_section(self, name: str) -> bool:
+        """Remove section from context. Returns whether it existed."""
+        section = self.sections.pop(name, None)
+        if section is None:
+            return False
+        self.order.remove(name)
+        self._unrank(section["priority"], section["seq"], name)
+        self.total_tokens -= section["tokens"]
+        self._built = None
+        return True
     
-    def build(self, max_tokens: int = None) -> str:
-        """Build context within token limit."""
+    def build(self, max_tokens: int = None, mode: str = "priority") -> str:
+        """
+        Build context within token limit.
+        
+        Args:
+            max_tokens: Token limit (defaults to context_limit)
+            mode: "priority" packs greedily by priority; "optimal" maximizes
+                total value (raises ValueError if required sections cannot fit)
+        """
         limit = max_tokens or self.context_limit
+        if self._built is not None and self._built[:2] == (limit, mode):
+            return self._built[2]
         
-        # Sort by priority (higher first)
-        sorted_sections = sorted(
-            self.order,
-            key=lambda n: self.sections[n]["priority"],
-            reverse=True
-        )
+        exact = None
+        if mode == "priority":
+            chosen = self._build_priority(limit)
+        elif mode == "optimal":
+            chosen, exact = self._build_optimal(limit)
+        else:
+            raise ValueError(f"Unknown build mode: {mode}")
         
-        # Build context
+        # Emit in rank order, using the chosen variant of each section
         context_parts = []
+        used = 0
+        value = 0.0
+        for _, _, name in self._ranked:
+            variant = chosen.get(name)
+            if variant is None:
+                continue
+            section = self.sections[name]
+            if variant == "full":
+                context_parts.append(section["content"])
+                used += section["tokens"]
+                value += section["value"]
+            else:
+                context_parts.append(section["summary"])
+                used += section["summary_tokens"]
+                value += section["value"] * self.summary_value
+        
+        self.last_build = {
+            "mode": mode,
+            "tokens": used,
+            "limit": limit,
+            "value": value,
+            "exact": exact,
+            "sections": chosen
+        }
+        context = "\n\n".join(context_parts)
+        self._built = (limit, mode, context)
+        return context
+    
+    def _build_priority(self, limit: int) -> Dict[str, str]:
+        """Greedy packing by priority (higher first), skipping what does not fit."""
+        chosen = {}
         current_tokens = 0
         
-        for name in sorted_sections:
-            section = self.sections[name]
-            section_tokens = section["tokens"]
+        for _, _, name in self._ranked:
+            section_tokens = self.sections[name]["tokens"]
             
             if current_tokens + section_tokens <= limit:
-                context_parts.append(section["content"])
+                chosen[name] = "full"
                 current_tokens += section_tokens
         
-        return "\n\n".join(context_parts)
+        return chosen
+    
+    def _build_optimal(self, limit: int):
+        """
+        Choose a variant (full, summary or none) per section to maximize value.
+        
+        Returns the chosen variants and whether the exact solver ran.
+        
+        Sections linked by depends_on form groups, and each group is one
+        item of a multiple-choice 0/1 knapsack whose options are its variant
+        combinations that respect the dependencies. Required sections and
+        everything they depend on are mandatory: they choose between full
+        and summary only, and their group has no empty option. The knapsack
+        is solved exactly by DP over token counts bucketed to `resolution`
+        steps (rounded up, so the result always fits), and any budget the
+        rounding leaves is refilled by value density.
+        
+        Without numpy, with more than exact_section_limit groups, a group of
+        more than exact_group_limit combinations, or more than
+        exact_option_limit options in all, this falls back to a heuristic: mandatory sections first (as summaries, largest
+        savings first, when they do not fit in full), then the rest by
+        value density.
+        """
+        sections = self.sections
+        
+        # Required sections and everything they depend on
+        mandatory = set()
+        stack = [name for name, s in sections.items() if s["required"]]
+        while stack:
+            name = stack.pop()
+            if name in sections and name not in mandatory:
+                mandatory.add(name)
+                stack.extend(sections[name]["depends_on"])
+        needed = sum(
+            min(self._variant_tokens(name, variant) for variant in self._variants(name))
+            for name in mandatory
+        )
+        if needed > limit:
+            raise ValueError(
+                f"Required sections need {needed} tokens, over the {limit} token limit"
+            )
+        
+        groups = self._dependency_groups()
+        if len(groups) <= self.exact_section_limit:
+            chosen = self._solve_knapsack(groups, mandatory, limit)
+            if chosen is not None:
+                used = sum(self._variant_tokens(name, variant) for name, variant in chosen.items())
+                candidates = [name for name in sections if name not in chosen]
+                chosen.update(self._pack_by_density(candidates, limit - used, chosen))
+                return chosen, True
+        
+        # Heuristic: mandatory sections in full, downgraded to summaries on overflow
+        chosen = {name: "full" for name in mandatory}
+        used = sum(sections[name]["tokens"] for name in mandatory)
+        savings = sorted(
+            (s["tokens"] - s["summary_tokens"], name)
+            for name in mandatory
+            for s in [sections[name]]
+            if s["summary_tokens"] is not None and s["summary_tokens"] < s["tokens"]
+        )
+        while used > limit and savings:
+            saved, name = savings.pop()
+            chosen[name] = "summary"
+            used -= saved
+        candidates = [name for name in sections if name not in chosen]
+        chosen.update(self._pack_by_density(candidates, limit - used, chosen))
+        return chosen, False
+    
+    def _dependency_groups(self) -> List[List[str]]:
+        """Sections connected through depends_on (either direction), in insertion order."""
+        parent = {name: name for name in self.sections}
+        
+        def find(name):
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+        
+        for name, section in self.sections.items():
+            for dep in section["depends_on"]:
+                if dep in parent:
+                    parent[find(name)] = find(dep)
+        groups: Dict[str, List[str]] = {}
+        for name in self.sections:
+            groups.setdefault(find(name), []).append(name)
+        return list(groups.values())
+    
+    def _group_options(self, names: List[str], mandatory: set,
+                       bucket: int, slots: int) -> List[tuple]:
+        """
+        Pareto-optimal (weight, gain, variants) options for one dependency
+        group, or None if the group has more than exact_group_limit
+        combinations. Mandatory members are never left out.
+        """
+        choices = [
+            self._variants(name) if name in mandatory else [None] + self._variants(name)
+            for name in names
+        ]
+        combinations = 1
+        for options in choices:
+            combinations *= len(options)
+        if combinations > self.exact_group_limit:
+            return None
+        
+        # Required sections are kept even if a dependency does not exist
+        deps = [
+            [dep for dep in self.sections[name]["depends_on"]
+             if name not in mandatory or dep in self.sections]
+            for name in names
+        ]
+        if len(names) == 1:
+            # Most groups are a lone section: nothing to cross-check
+            name = names[0]
+            allowed = all(dep == name for dep in deps[0])
+            picks = [{}] if name not in mandatory else []
+            picks += [{name: v} for v in choices[0] if v and (allowed or name in mandatory)]
+        else:
+            picks = []
+            for combo in itertools.product(*choices):
+                picked = {name: variant for name, variant in zip(names, combo) if variant}
+                if not any(name in picked and any(dep not in picked for dep in needs)
+                           for name, needs in zip(names, deps)):
+                    picks.append(picked)
+        
+        best: Dict[int, tuple] = {}
+        for picked in picks:
+            tokens = 0
+            gain = 0.0
+            for name, variant in picked.items():
+                tokens += self._variant_tokens(name, variant)
+                gain += self._variant_value(name, variant)
+            weight = -(-tokens // bucket)
+            if weight <= slots and (weight not in best or gain > best[weight][1]):
+                best[weight] = (weight, gain, picked)
+        
+        # Drop options that cost more without gaining more
+        frontier = []
+        for weight in sorted(best):
+            if not frontier or best[weight][1] > frontier[-1][1]:
+                frontier.append(best[weight])
+        return frontier
+    
+    def _solve_knapsack(self, groups: List[List[str]], mandatory: set,
+                        capacity: int) -> Dict[str, str]:
+        """
+        Exact multiple-choice knapsack over bucketed tokens. None without
+        numpy, when a group is too large to enumerate, when the DP would
+        exceed exact_option_limit vectorized passes, or when bucketing
+        leaves no room for the mandatory sections.
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return None
+        
+        bucket = max(1, -(-capacity // self.resolution))
+        slots = capacity // bucket
+        items = []
+        passes = 0
+        for names in groups:
+            options = self._group_options(names, mandatory, bucket, slots)
+            if options is None or not options:
+                return None
+            if len(options) > 1 or options[0][2]:
+                items.append(options)
+                passes += len(options)
+                if passes > self.exact_option_limit:
+                    return None
+        
+        # best[c]: max value using at most c buckets; every item takes one option
+        best = np.zeros(slots + 1)
+        choices = np.zeros((len(items), slots + 1), dtype=np.int32)
+        for g, options in enumerate(items):
+            updated = np.full(slots + 1, -np.inf)
+            for k, (weight, gain, _) in enumerate(options):
+                candidate = best[:slots + 1 - weight] + gain
+                window = updated[weight:]
+                better = candidate > window
+                np.copyto(choices[g, weight:], k, where=better)
+                np.maximum(window, candidate, out=window)
+            best = updated
+        if best[slots] == -np.inf:
+            return None
+        
+        picked = {}
+        c = slots
+        for g in range(len(items) - 1, -1, -1):
+            weight, _, variants = items[g][choices[g, c]]
+            picked.update(variants)
+            c -= weight
+        return picked
+    
+    def _pack_by_density(self, candidates: List[str], capacity: int,
+                         chosen: Dict[str, str]) -> Dict[str, str]:
+        """Greedy by value per token, only adding sections whose dependencies are chosen."""
+        options = []
+        for name in candidates:
+            for variant in ("full", "summary"):
+                tokens = self._variant_tokens(name, variant)
+                gain = self._variant_value(name, variant)
+                if tokens is not None and gain > 0:
+                    options.append((gain / max(tokens, 1), gain, name, variant))
+        options.sort(reverse=True)
+        
+        picked = {}
+        for _, _, name, variant in options:
+            if name in picked:
+                continue
+            tokens = self._variant_tokens(name, variant)
+            if tokens > capacity:
+                continue
+            deps = self.sections[name]["depends_on"]
+            if all(dep in chosen or dep in picked for dep in deps):
+                picked[name] = variant
+                capacity -= tokens
+        
+        # Upgrade summaries to full text where the leftover budget allows
+        for name in sorted(picked, key=lambda n: -self.sections[n]["value"]):
+            if picked[name] == "summary":
+                extra = self.sections[name]["tokens"] - self.sections[name]["summary_tokens"]
+                if extra <= capacity:
+                    picked[name] = "full"
+                    capacity -= extra
+        return picked
+    
+    def _variants(self, name: str) -> List[str]:
+        return ["full"] if self.sections[name]["summary"] is None else ["full", "summary"]
+    
+    def _variant_tokens(self, name: str, variant: str) -> int:
+        section = self.sections[name]
+        return section["tokens"] if variant == "full" else section["summary_tokens"]
+    
+    def _variant_value(self, name: str, variant: str) -> float:
+        value = self.sections[name]["value"]
+        return value if variant == "full" else value * self.summary_value
     
     def get_usage_report(self) -> Dict:
         """Get current context usage report."""
-        total = sum(s["tokens"] for s in self.sections.values())
+        total = self.total_tokens
         return {
             "total_tokens": total,
             "limit": self.context_limit,
@@ -145,6 +487,10 @@ class ContextBuilder:
             return "warning"
         else:
             return "healthy"
+    
+    def _unrank(self, priority: int, seq: int, name: str):
+        index = bisect.bisect_left(self._ranked, (-priority, seq, name))
+        del self._ranked[index]
 
 
 # Context Truncation
@@ -162,19 +508,23 @@ def truncate_context(context: str, max_tokens: int,
     Returns:
         Truncated context
     """
-    tokens = context.split()
-    current_tokens = len(tokens)
-    
-    if current_tokens <= max_tokens:
+    counter = get_counter()
+    if counter.count(context) <= max_tokens:
         return context
     
-    if preserve_start:
-        # Keep beginning, truncate end
-        kept = tokens[:max_tokens]
-    else:
-        # Keep end, truncate beginning
-        kept = tokens[-max_tokens:]
+    # Binary search for the longest run of whole words that fits
+    words = context.split()
+    tokenizer = counter.tokenizer
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        kept = words[:mid] if preserve_start else words[len(words) - mid:]
+        if tokenizer.count(" ".join(kept)) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
     
+    kept = words[:lo] if preserve_start else words[len(words) - lo:]
     return " ".join(kept)
 
 
@@ -199,26 +549,21 @@ def truncate_messages(messages: list, max_tokens: int) -> list:
         else:
             recent_messages.append(msg)
     
-    # Calculate token usage
-    tokens_for_system = estimate_token_count(system_prompt["content"]) if system_prompt else 0
-    tokens_for_recent = estimate_message_tokens(recent_messages)
-    tokens_for_summary = estimate_token_count(summary["content"]) if summary else 0
+    # Calculate token usage (one batched, cached count for all messages)
+    counter = get_counter()
+    tokens_for_system = counter.count(system_prompt["content"]) if system_prompt else 0
+    tokens_for_summary = counter.count(summary["content"]) if summary else 0
+    message_tokens = [
+        n + 10 for n in counter.count_many([msg.get("content", "") for msg in recent_messages])
+    ]
     
     available = max_tokens - tokens_for_system - tokens_for_summary
     
-    # Truncate recent if needed
-    if tokens_for_recent > available:
-        # Keep most recent messages
-        truncated_recent = []
-        current_tokens = 0
-        
-        for msg in reversed(recent_messages):
-            msg_tokens = estimate_token_count(msg.get("content", ""))
-            if current_tokens + msg_tokens <= available:
-                truncated_recent.insert(0, msg)
-                current_tokens += msg_tokens
-        
-        recent_messages = truncated_recent
+    # Keep the longest run of most recent messages that fits: suffix sums
+    # are non-decreasing going back in time, so bisect for the cut point
+    suffix_tokens = list(itertools.accumulate(reversed(message_tokens)))
+    keep = bisect.bisect_right(suffix_tokens, available)
+    recent_messages = recent_messages[len(recent_messages) - keep:]
     
     result = []
     if system_prompt:
@@ -230,13 +575,224 @@ def truncate_messages(messages: list, max_tokens: int) -> list:
     return result
 
 
+# Duplicate Detection
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t\r]*\n")
+
+
+class DuplicateDetector:
+    """
+    Find repeated paragraphs across context sections.
+    
+    Every paragraph is checked against a table of exact hashes
+    (whitespace-normalized blake2b). Paragraphs that are not exact repeats
+    get a MinHash signature over word shingles, and LSH banding proposes
+    near-duplicate candidates, so the whole context is checked in
+    near-linear time. Near-duplicate detection needs numpy; without it only
+    exact repeats are reported.
+    """
+    
+    def __init__(self, shingle_size: int = 3, num_perm: int = 32, bands: int = 8,
+                 threshold: float = 0.6, min_chars: int = 32, seed: int = 1):
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.min_chars = min_chars
+        self.seed = seed
+    
+    def find_duplicates(self, context: Dict) -> List[Dict]:
+        """
+        Report paragraphs repeating an earlier one, in context order.
+        
+        Each entry gives the location ("section" or "section[i]" for list
+        items), the paragraph number and character span, what it duplicates
+        and the (estimated) similarity.
+        """
+        paragraphs = []  # (location, paragraph number, start, end, text)
+        for location, text in self._texts(context):
+            number = 0
+            for start, end in self._paragraph_spans(text):
+                number += 1
+                if end - start >= self.min_chars:
+                    paragraphs.append((location, number, start, end, text[start:end]))
+        
+        duplicates = []
+        first_seen: Dict[bytes, int] = {}
+        unique = []
+        for i, (_, _, _, _, body) in enumerate(paragraphs):
+            key = hashlib.blake2b(" ".join(body.split()).encode("utf-8"), digest_size=16).digest()
+            original = first_seen.setdefault(key, i)
+            if original != i:
+                duplicates.append(self._report("exact", paragraphs, i, original, 1.0))
+            else:
+                unique.append(i)
+        
+        for i, original, similarity in self._near_duplicates(paragraphs, unique):
+            duplicates.append(self._report("near", paragraphs, i, original, similarity))
+        
+        duplicates.sort(key=lambda d: d["order"])
+        for d in duplicates:
+            del d["order"]
+        return duplicates
+    
+    def dedupe(self, context: Dict, include_near: bool = False) -> tuple:
+        """
+        Rewrite context with repeated paragraphs replaced by back-references.
+        
+        Returns (new_context, duplicates); the input is not modified.
+        """
+        duplicates = self.find_duplicates(context)
+        replacements: Dict[str, list] = {}
+        for d in duplicates:
+            if d["type"] == "exact" or include_near:
+                replacements.setdefault(d["location"], []).append(d)
+        
+        deduped = {}
+        for section, content in context.items():
+            if isinstance(content, str):
+                deduped[section] = self._rewrite(content, replacements.get(section, []))
+            elif isinstance(content, list):
+                deduped[section] = [
+                    self._rewrite(item, replacements.get(f"{section}[{i}]", []))
+                    if isinstance(item, str) else item
+                    for i, item in enumerate(content)
+                ]
+            else:
+                deduped[section] = content
+        return deduped, duplicates
+    
+    def _near_duplicates(self, paragraphs: list, candidates: List[int]):
+        try:
+            import numpy as np
+        except ImportError:
+            return []
+        
+        # Word hashes (crc32, stable across runs), computed once per distinct word
+        k = self.shingle_size
+        words = []
+        owners = []
+        counts = []
+        for i in candidates:
+            paragraph_words = paragraphs[i][4].lower().split()
+            if len(paragraph_words) >= k:
+                owners.append(i)
+                counts.append(len(paragraph_words) - k + 1)
+                words.extend(paragraph_words)
+                words.extend([""] * (k - 1))  # keep shingles inside one paragraph
+        if len(owners) < 2:
+            return []
+        table = {w: zlib.crc32(w.encode("utf-8")) for w in set(words)}
+        hashes = np.fromiter(map(table.__getitem__, words), dtype=np.uint64, count=len(words))
+        
+        # Shingle hashes for every window, then keep those inside a paragraph
+        combined = np.zeros(len(words) - k + 1, dtype=np.uint64)
+        for j in range(k):
+            combined = combined * np.uint64(1000003) + hashes[j:len(words) - k + 1 + j]
+        counts = np.array(counts)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        starts = offsets[:-1] + np.arange(len(owners)) * (2 * (k - 1))  # word offset of each paragraph
+        keep = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        shingles = combined[keep]
+        shingles = (shingles >> np.uint64(32)) ^ (shingles & np.uint64(0xFFFFFFFF))
+        
+        # MinHash: min over multiply-add-shift hashes ((a*x + b) mod 2**64) >> 32
+        # per permutation and paragraph, in chunks of whole paragraphs
+        rng = np.random.default_rng(self.seed)
+        a = rng.integers(0, 1 << 63, size=(self.num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        b = rng.integers(0, 1 << 63, size=(self.num_perm, 1), dtype=np.uint64)
+        shift = np.uint64(32)
+        signatures = np.empty((len(owners), self.num_perm), dtype=np.uint64)
+        first = 0
+        while first < len(owners):
+            last = int(np.searchsorted(offsets, offsets[first] + (1 << 16), side="right")) - 1
+            last = min(max(last, first + 1), len(owners))
+            values = np.multiply(a, shingles[offsets[first]:offsets[last]])
+            values += b
+            values >>= shift
+            signatures[first:last] = np.minimum.reduceat(
+                values, offsets[first:last] - offsets[first], axis=1
+            ).T
+            first = last
+        
+        # LSH banding: compare each paragraph with the first earlier one in
+        # each of its buckets, keeping the best verified match
+        rows = self.num_perm // self.bands
+        band_keys = signatures[:, :rows * self.bands].copy().view(f"V{rows * 8}").tolist()
+        buckets = [dict() for _ in range(self.bands)]
+        found = []
+        for row, keys in enumerate(band_keys):
+            best, best_similarity = None, self.threshold
+            for band, key in enumerate(keys):
+                first = buckets[band].setdefault(key, row)
+                if first != row:
+                    similarity = float(np.mean(signatures[row] == signatures[first]))
+                    if similarity >= best_similarity:
+                        best, best_similarity = first, similarity
+            if best is not None:
+                found.append((owners[row], owners[best], best_similarity))
+        return found
+    
+    @staticmethod
+    def _texts(context: Dict):
+        for section, content in context.items():
+            if isinstance(content, str):
+                yield section, content
+            elif isinstance(content, list):
+                for i, item in enumerate(content):
+                    if isinstance(item, str):
+                        yield f"{section}[{i}]", item
+    
+    @staticmethod
+    def _paragraph_spans(text: str):
+        start = 0
+        for match in itertools.chain(_PARAGRAPH_BREAK.finditer(text), [None]):
+            end = match.start() if match else len(text)
+            # Trim surrounding whitespace from the span
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end > start:
+                yield start, end
+            if match:
+                start = match.end()
+    
+    @staticmethod
+    def _report(kind: str, paragraphs: list, i: int, original: int, similarity: float) -> Dict:
+        location, number, start, end, body = paragraphs[i]
+        o_location, o_number, o_start, o_end, _ = paragraphs[original]
+        return {
+            "type": kind,
+            "location": location,
+            "paragraph": number,
+            "span": (start, end),
+            "duplicate_of": o_location,
+            "duplicate_paragraph": o_number,
+            "duplicate_span": (o_start, o_end),
+            "similarity": similarity,
+            "tokens": estimate_token_count(body),
+            "order": i
+        }
+    
+    @staticmethod
+    def _rewrite(text: str, duplicates: list) -> str:
+        for d in sorted(duplicates, key=lambda d: d["span"][0], reverse=True):
+            start, end = d["span"]
+            label = "Duplicate" if d["type"] == "exact" else "Near-duplicate"
+            reference = f"[{label} of {d['duplicate_of']} paragraph {d['duplicate_paragraph']}]"
+            text = text[:start] + reference + text[end:]
+        return text
+
+
 # Context Validation
 
-def validate_context_structure(context: Dict) -> Dict:
+def validate_context_structure(context: Dict, detector: DuplicateDetector = None) -> Dict:
     """
     Validate context structure for common issues.
     
-    Returns validation results with issues and recommendations.
+    Returns validation results with issues and recommendations; repeated
+    and near-repeated paragraphs are listed under "duplicates".
     """
     issues = []
     recommendations = []
@@ -260,69 +816,204 @@ def validate_context_structure(context: Dict) -> Dict:
             issues.append(f"Missing recommended section: {section}")
             recommendations.append(f"Add {section} section with relevant information")
     
-    # Check for duplicate information
-    # Using hashlib instead of hash() for cross-process consistency
-    seen_content = set()
-    for section, content in context.items():
-        content_str = str(content)[:1000]  # First 1000 chars
-        content_hash = hashlib.md5(content_str.encode()).hexdigest()
-        if content_hash in seen_content:
-            issues.append(f"Potential duplicate content in {section}")
-        seen_content.add(content_hash)
+    # Check for duplicate and near-duplicate paragraphs
+    duplicates = (detector or DuplicateDetector()).find_duplicates(context)
+    flagged = []
+    for d in duplicates:
+        if d["location"] not in flagged:
+            flagged.append(d["location"])
+            issues.append(f"Potential duplicate content in {d['location']}")
+    if duplicates:
+        wasted = sum(d["tokens"] for d in duplicates)
+        recommendations.append(
+            f"Deduplicate repeated content (~{wasted} tokens), e.g. with DuplicateDetector.dedupe"
+        )
     
     return {
         "valid": len(issues) == 0,
         "issues": issues,
-        "recommendations": recommendations
+        "recommendations": recommendations,
+        "duplicates": duplicates
     }
 
 
 # Progressive Disclosure
 
+_SLICE_END_PATTERN = re.compile(rb"<!--\s*/?slice\b[^>]*-->")
+
+# Fence lines and ATX headings; everything else is skipped by the scan
+_BLOCK_LINE_PATTERN = re.compile(
+    rb"^(?: {0,3}(`{3,}|~{3,})|(#{1,6})[ \t]+(.*?)(?:[ \t]+#*)?[ \t]*\r?$)",
+    re.MULTILINE
+)
+
+
+def _markdown_headings(view):
+    """Yield (level, start, title) for each heading outside fenced code."""
+    fence = None
+    for match in _BLOCK_LINE_PATTERN.finditer(view):
+        marker = match.group(1)
+        if marker is not None:
+            if fence is None:
+                fence = marker
+            elif marker[:1] == fence[:1] and len(marker) >= len(fence):
+                fence = None
+        elif fence is None:
+            yield len(match.group(2)), match.start(), match.group(3)
+
+
 class ProgressiveDisclosureManager:
-    """Manage progressive disclosure of context."""
+    """
+    Manage progressive disclosure of context.
+    
+    Loaded files and sections are cached in an LRU bounded by max_bytes and
+    revalidated against the file's mtime and size on every access. Sections
+    are sliced out by markdown heading or slice marker
+    (<!-- slice: name --> ... <!-- /slice -->); files of mmap_threshold
+    bytes or more are memory-mapped, so only the pages up to the end of the
+    requested section are read.
+    """
     
-    def __init__(self, base_dir: str = "."):
+    def __init__(self, base_dir: str = ".", max_bytes: int = 4 * 1024 * 1024,
+                 mmap_threshold: int = 64 * 1024):
         self.base_dir = base_dir
-        self.loaded_files: Dict[str, str] = {}
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        self.loaded_files: "OrderedDict[str, str]" = OrderedDict()
+        self.loaded_bytes = 0
+        self._entries: Dict[str, tuple] = {}  # key -> (path, (mtime_ns, size), bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
     
     def load_summary(self, summary_path: str) -> str:
         """Load summary without loading full content."""
-        if summary_path in self.loaded_files:
-            return self.loaded_files[summary_path]
+        return self._load(summary_path, summary_path, None)
+    
+    def load_detail(self, detail_path: str, force: bool = False) -> str:
+        """Load detailed content on demand."""
+        return self._load(detail_path, detail_path, None, force)
+    
+    def load_section(self, path: str, heading: str = None, slice_name: str = None,
+                     force: bool = False) -> str:
+        """
+        Load one section of a file by heading or slice marker.
         
+        A heading section runs to the next heading of the same or higher
+        level. Returns "" if the file or section does not exist.
+        """
+        if heading is not None:
+            key, selector = f"{path}#{heading}", ("heading", heading)
+        elif slice_name is not None:
+            key, selector = f"{path}@{slice_name}", ("slice", slice_name)
+        else:
+            return self.load_detail(path, force)
+        return self._load(key, path, selector, force)
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.loaded_files),
+            "loaded_bytes": self.loaded_bytes
+        }
+    
+    def _load(self, key: str, path: str, selector, force: bool = False) -> str:
+        full_path = os.path.join(self.base_dir, path)
         try:
-            with open(summary_path, 'r') as f:
-                content = f.read()
-            self.loaded_files[summary_path] = content
-            return content
+            st = os.stat(full_path)
         except FileNotFoundError:
+            self._evict(key)
             return ""
-    
-    def load_detail(self, detail_path: str, force: bool = False) -> str:
-        """Load detailed content on demand."""
-        if not force and detail_path in self.loaded_files:
-            return self.loaded_files[detail_path]
+        stamp = (st.st_mtime_ns, st.st_size)
+        
+        entry = self._entries.get(key)
+        if not force and entry is not None and entry[1] == stamp:
+            self.loaded_files.move_to_end(key)
+            self.hits += 1
+            return self.loaded_files[key]
+        self.misses += 1
         
         try:
-            with open(detail_path, 'r') as f:
-                content = f.read()
-            self.loaded_files[detail_path] = content
-            return content
+            with open(full_path, "rb") as f:
+                if st.st_size >= self.mmap_threshold:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                        data = self._select(view, selector)
+                else:
+                    data = self._select(f.read(), selector)
         except FileNotFoundError:
+            self._evict(key)
             return ""
+        
+        content = data.decode("utf-8", errors="replace")
+        self._evict(key)
+        self.loaded_files[key] = content
+        self._entries[key] = (path, stamp, len(data))
+        self.loaded_bytes += len(data)
+        
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self.loaded_bytes > self.max_bytes and len(self.loaded_files) > 1:
+            oldest = next(iter(self.loaded_files))
+            self._evict(oldest)
+            self.evictions += 1
+        return content
+    
+    def _select(self, view, selector) -> bytes:
+        """Slice the selected section out of a bytes-like view of the file."""
+        if selector is None:
+            return bytes(view)
+        kind, name = selector
+        end = len(view)
+        if kind == "heading":
+            # Runs to the next heading of the same or higher level; lines
+            # inside fenced code (``` or ~~~) are not headings
+            title = name.encode("utf-8")
+            start = level = None
+            for depth, line_start, text in _markdown_headings(view):
+                if level is None:
+                    if text == title:
+                        start, level = line_start, depth
+                elif depth <= level:
+                    end = line_start
+                    break
+            if start is None:
+                return b""
+        else:
+            match = re.compile(
+                rb"<!--\s*slice:\s*" + re.escape(name.encode("utf-8")) + rb"\s*-->"
+            ).search(view)
+            if match is None:
+                return b""
+            start = match.end()
+            close = _SLICE_END_PATTERN.search(view, start)
+            if close:
+                end = close.start()
+        return bytes(view[start:end]).strip()
+    
+    def _evict(self, key: str):
+        if key in self._entries:
+            self.loaded_bytes -= self._entries.pop(key)[2]
+            del self.loaded_files[key]
     
     def get_contextual_info(self, reference: Dict) -> str:
         """
         Get information following progressive disclosure.
         
-        Returns summary if available, loads detail if needed.
+        Returns summary if available, loads detail if needed. A "section"
+        (heading) or "slice" in the reference loads only that part of the
+        detail file.
         """
         summary_path = reference.get("summary_path")
         detail_path = reference.get("detail_path")
         need_detail = reference.get("need_detail", False)
         
         if need_detail and detail_path:
+            if reference.get("section") or reference.get("slice"):
+                return self.load_section(detail_path, reference.get("section"),
+                                         reference.get("slice"))
             return self.load_detail(detail_path)
         elif summary_path:
             return self.load_summary(summary_path)
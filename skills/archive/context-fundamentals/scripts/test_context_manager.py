@@ -0,0 +1,115 @@
+import itertools
+import random
+import unittest
+
+from context_manager import ContextBuilder
+
+
+def _words(tokens):
+    # estimate_token_count is ~4 characters per token by default
+    return "x" * (4 * tokens)
+
+
+def _mandatory(builder):
+    names = set()
+    stack = [name for name, s in builder.sections.items() if s["required"]]
+    while stack:
+        name = stack.pop()
+        if name in builder.sections and name not in names:
+            names.add(name)
+            stack.extend(builder.sections[name]["depends_on"])
+    return names
+
+
+def _brute_force(builder, limit):
+    """Best value over every variant assignment, or None if nothing is feasible."""
+    names = list(builder.sections)
+    mandatory = _mandatory(builder)
+    choices = [([] if name in mandatory else [None]) + builder._variants(name) for name in names]
+    best = None
+    for combo in itertools.product(*choices):
+        picked = {name: variant for name, variant in zip(names, combo) if variant}
+        if any(dep not in picked
+               for name in picked for dep in builder.sections[name]["depends_on"]
+               if dep in builder.sections or name not in mandatory):
+            continue
+        if sum(builder._variant_tokens(n, v) for n, v in picked.items()) > limit:
+            continue
+        value = sum(builder._variant_value(n, v) for n, v in picked.items())
+        best = value if best is None else max(best, value)
+    return best
+
+
+class TestContextBuilder(unittest.TestCase):
+    def assertValid(self, builder, limit):
+        chosen = builder.last_build["sections"]
+        self.assertLessEqual(builder.last_build["tokens"], limit)
+        self.assertTrue(_mandatory(builder) <= set(chosen))
+        for name in chosen:
+            for dep in builder.sections[name]["depends_on"]:
+                if dep in builder.sections:
+                    self.assertIn(dep, chosen, (name, dep))
+    
+    def test_optimal_build_matches_brute_force(self) -> None:
+        rng = random.Random(0)
+        checked = 0
+        for _ in range(300):
+            builder = ContextBuilder(exact_group_limit=10 ** 6, exact_option_limit=10 ** 6)
+            for i in range(rng.randint(1, 6)):
+                tokens = rng.randint(1, 300)
+                summary = _words(rng.randint(1, tokens)) if rng.random() < 0.6 else None
+                deps = [f"s{j}" for j in range(i) if rng.random() < 0.25]
+                if rng.random() < 0.05:
+                    deps.append("missing")
+                builder.add_section(f"s{i}", _words(tokens), summary=summary,
+                                    required=rng.random() < 0.25, depends_on=deps,
+                                    value=rng.uniform(0, 10))
+            limit = rng.randint(20, 1200)
+            expected = _brute_force(builder, limit)
+            if expected is None:
+                with self.assertRaises(ValueError):
+                    builder.build(limit, mode="optimal")
+                continue
+            builder.build(limit, mode="optimal")
+            self.assertTrue(builder.last_build["exact"])
+            self.assertValid(builder, limit)
+            self.assertAlmostEqual(builder.last_build["value"], expected)
+            checked += 1
+        self.assertGreater(checked, 200)
+    
+    def test_required_sections_trade_full_text_for_summaries(self) -> None:
+        builder = ContextBuilder()
+        builder.add_section("rules", _words(100), summary=_words(10), required=True, value=1)
+        builder.add_section("docs", _words(90), value=10)
+        builder.build(110, mode="optimal")
+        # Summarizing the required section makes room for the valuable one
+        self.assertEqual(builder.last_build["sections"], {"rules": "summary", "docs": "full"})
+        
+        with self.assertRaises(ValueError):
+            builder.build(5, mode="optimal")
+    
+    def test_dependencies_are_chosen_together(self) -> None:
+        builder = ContextBuilder()
+        builder.add_section("base", _words(60), value=1)
+        builder.add_section("detail", _words(30), depends_on=["base"], value=10)
+        builder.add_section("other", _words(50), value=5)
+        builder.add_section("orphan", _words(5), depends_on=["missing"], value=100)
+        builder.add_section("core", _words(10), required=True, depends_on=["base"], value=1)
+        builder.build(110, mode="optimal")
+        self.assertValid(builder, 110)
+        self.assertEqual(set(builder.last_build["sections"]), {"base", "detail", "core"})
+    
+    def test_large_inputs_fall_back_to_the_heuristic(self) -> None:
+        rng = random.Random(1)
+        builder = ContextBuilder(exact_section_limit=8)
+        for i in range(40):
+            deps = [f"s{rng.randrange(i)}"] if i and rng.random() < 0.3 else []
+            builder.add_section(f"s{i}", _words(rng.randint(10, 200)), summary=_words(5),
+                                required=i % 10 == 0, depends_on=deps)
+        builder.build(1500, mode="optimal")
+        self.assertFalse(builder.last_build["exact"])
+        self.assertValid(builder, 1500)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+"""
+Token Counting
+
+This module provides the token counting shared by the context skills
+(context_manager.py here, compaction.py in context-optimization).
+
+A TokenCounter wraps a local tokenizer and caches counts in an LRU keyed by
+content hash, so repeated sections, messages and tool outputs are tokenized
+once. Tokenizers are pluggable:
+- BPETokenizer: byte-level BPE from a tiktoken-format rank file
+  (one "<base64 token> <rank>" per line), loaded once per path
+- TiktokenTokenizer: tiktoken encodings (requires `tiktoken`)
+- HuggingFaceTokenizer: tokenizer.json files (requires `tokenizers`)
+- HeuristicTokenizer: ~4 characters per token, used when nothing else is set
+
+Configure the shared counter once at startup, e.g.:
+    set_tokenizer(BPETokenizer.from_file("cl100k_base.tiktoken"))
+"""
+
+from typing import Dict, List
+from collections import OrderedDict
+import base64
+import hashlib
+import os
+import re
+import threading
+
+
+# Tokenizers
+
+class HeuristicTokenizer:
+    """Fallback estimate: ~4 characters per token for English."""
+    
+    name = "heuristic"
+    
+    def count(self, text: str) -> int:
+        return len(text) // 4
+
+
+# Approximates the cl100k pre-tokenizer with stdlib `re` (no \p{L} classes)
+_PRETOKENIZE = re.compile(
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)"
+    r"|[^\r\n\w]?[^\W\d_]+"
+    r"|\d{1,3}"
+    r"| ?[^\s\w]+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+(?!\S)"
+    r"|\s+"
+)
+
+_RANK_FILES: Dict[str, Dict[bytes, int]] = {}
+_RANK_FILES_LOCK = threading.Lock()
+
+
+def load_bpe_ranks(path: str) -> Dict[bytes, int]:
+    """Load a tiktoken-format rank file, reusing it if already loaded."""
+    key = os.path.abspath(path)
+    with _RANK_FILES_LOCK:
+        ranks = _RANK_FILES.get(key)
+        if ranks is None:
+            ranks = {}
+            with open(key, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        token, rank = line.split()
+                        ranks[base64.b64decode(token)] = int(rank)
+            _RANK_FILES[key] = ranks
+        return ranks
+
+
+class BPETokenizer:
+    """
+    Byte-level BPE over a rank table (lower rank merges first).
+    
+    Counts are memoized per pre-tokenized piece, since natural text
+    repeats a small working set of words.
+    """
+    
+    def __init__(self, ranks: Dict[bytes, int], name: str = "bpe",
+                 piece_cache_size: int = 100000):
+        self.ranks = ranks
+        self.name = name
+        self.piece_cache_size = piece_cache_size
+        self._pieces: Dict[str, int] = {}
+    
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "BPETokenizer":
+        name = kwargs.pop("name", os.path.splitext(os.path.basename(path))[0])
+        return cls(load_bpe_ranks(path), name=name, **kwargs)
+    
+    def count(self, text: str) -> int:
+        pieces = self._pieces
+        total = 0
+        for piece in _PRETOKENIZE.findall(text):
+            n = pieces.get(piece)
+            if n is None:
+                n = self._count_piece(piece.encode("utf-8"))
+                if len(pieces) >= self.piece_cache_size:
+                    pieces.clear()
+                pieces[piece] = n
+            total += n
+        return total
+    
+    def _count_piece(self, data: bytes) -> int:
+        if data in self.ranks:
+            return 1
+        parts = [data[i:i + 1] for i in range(len(data))]
+        ranks = self.ranks
+        while len(parts) > 1:
+            best_rank = None
+            best_index = -1
+            for i in range(len(parts) - 1):
+                rank = ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_rank = rank
+                    best_index = i
+            if best_rank is None:
+                break
+            parts[best_index:best_index + 2] = [parts[best_index] + parts[best_index + 1]]
+        return len(parts)
+
+
+class TiktokenTokenizer:
+    """Adapter for tiktoken encodings (requires `tiktoken`)."""
+    
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken/{encoding_name}"
+    
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+    
+    def count_many(self, texts: List[str]) -> List[int]:
+        return [len(ids) for ids in self.encoding.encode_ordinary_batch(texts)]
+
+
+class HuggingFaceTokenizer:
+    """Adapter for a local tokenizer.json (requires `tokenizers`)."""
+    
+    def __init__(self, path: str):
+        from tokenizers import Tokenizer
+        self.tokenizer = Tokenizer.from_file(path)
+        self.name = f"hf/{os.path.basename(os.path.dirname(os.path.abspath(path)))}"
+    
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+    
+    def count_many(self, texts: List[str]) -> List[int]:
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [len(e.ids) for e in encodings]
+
+
+# Token Counter
+
+class TokenCounter:
+    """Token counts through a tokenizer, with an LRU cache keyed by blake2b(content)."""
+    
+    def __init__(self, tokenizer=None, cache_size: int = 10000):
+        self.tokenizer = tokenizer or HeuristicTokenizer()
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    
+    def count(self, text: str) -> int:
+        """Count tokens in text."""
+        if not text:
+            return 0
+        key = self.key(text)
+        with self._lock:
+            n = self._cache.get(key)
+            if n is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return n
+            self.misses += 1
+        n = self.tokenizer.count(text)
+        self._remember(key, n)
+        return n
+    
+    def count_many(self, texts: List[str]) -> List[int]:
+        """Count tokens for a batch, tokenizing only the cache misses."""
+        counts = [0] * len(texts)
+        pending: Dict[bytes, List[int]] = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                if not text:
+                    continue
+                key = self.key(text)
+                n = self._cache.get(key)
+                if n is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    counts[i] = n
+                else:
+                    self.misses += 1
+                    pending.setdefault(key, []).append(i)
+        if pending:
+            keys = list(pending)
+            batch = [texts[pending[k][0]] for k in keys]
+            if hasattr(self.tokenizer, "count_many"):
+                results = self.tokenizer.count_many(batch)
+            else:
+                results = [self.tokenizer.count(text) for text in batch]
+            for key, n in zip(keys, results):
+                self._remember(key, n)
+                for i in pending[key]:
+                    counts[i] = n
+        return counts
+    
+    def count_messages(self, messages: list, overhead: int = 10) -> int:
+        """Count tokens for a message list, adding per-message role/formatting overhead."""
+        counts = self.count_many([msg.get("content", "") for msg in messages])
+        return sum(counts) + overhead * len(messages)
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "tokenizer": self.tokenizer.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cached": len(self._cache)
+        }
+    
+    def _remember(self, key: bytes, n: int):
+        with self._lock:
+            self._cache[key] = n
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+# Shared Counter
+
+_default_counter = TokenCounter()
+
+
+def get_counter() -> TokenCounter:
+    """Get the counter used for all budget decisions."""
+    return _default_counter
+
+
+def set_tokenizer(tokenizer, cache_size: int = 10000) -> TokenCounter:
+    """Replace the shared counter with one backed by tokenizer."""
+    global _default_counter
+    _default_counter = TokenCounter(tokenizer, cache_size=cache_size)
+    return _default_counter
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text with the shared counter."""
+    return _default_counter.count(text)
+
+
+def count_tokens_many(texts: List[str]) -> List[int]:
+    """Count tokens for a batch of texts with the shared counter."""
+    return _default_counter.count_many(texts)
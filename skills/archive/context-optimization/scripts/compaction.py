@@ -4,62 +4,101 @@ Context Optimization Utilities
 This module provides utilities for context compaction, observation masking, and budget management.
 
 PRODUCTION NOTES:
-- Token estimation uses simplified heuristics (~4 chars/token for English).
-  Production systems should use model-specific tokenizers:
-  - OpenAI: tiktoken library
-  - Anthropic: anthropic tokenizer
-  - Local models: HuggingFace tokenizers
-  
+- Token counts come from token_counter.py in the context-fundamentals skill
+  only when it is importable; otherwise they fall back to ~4 chars/token and
+  will not match context_manager.py. To count exactly as ContextBuilder
+  does, either put context-fundamentals/scripts on the path or pass its
+  counter explicitly: ContextBudget(limit, counter=token_counter.get_counter()).
+  Configure a real tokenizer once with token_counter.set_tokenizer():
+  - OpenAI: TiktokenTokenizer
+  - Local models: HuggingFaceTokenizer or BPETokenizer over a rank file
+
 - Summarization functions use simple heuristics for demonstration.
   Production systems should use:
   - LLM-based summarization for high-quality compression
   - Domain-specific summarization models
   - Schema-based summarization for structured outputs
-  
-- Cache metrics are illustrative. Production systems should integrate
-  with actual inference infrastructure metrics.
+
+- Cache metrics come from an offline prefix-cache simulation
+  (PrefixCacheSimulator). Provider block sizes, TTLs and eviction differ;
+  confirm against the cached-token counts your provider reports.
 """
 
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Tuple
+from collections import OrderedDict, deque
 import hashlib
+import json
+import os
+import re
+import tempfile
 import time
+import zlib
+
+try:
+    from token_counter import count_tokens, count_tokens_many
+except ImportError:
+    # Deployed without context-fundamentals/scripts/token_counter.py:
+    # fall back to ~4 characters per token
+    def count_tokens(text: str) -> int:
+        return len(text) // 4
+    
+    def count_tokens_many(texts: List[str]) -> List[int]:
+        return [len(text) // 4 for text in texts]
+
+
+# Patterns are compiled once; summarizers run for every compacted message
+_METRIC_PATTERN = re.compile(r'\b(\w+):\s*([\d.,]+)')
+_FINDING_PATTERN = re.compile(r'^.*(?:result|found|total|success|error|value).*$', re.IGNORECASE | re.MULTILINE)
+_DECISION_PATTERN = re.compile(r'(?i)(?:decided|decision|chose|chosen)[:\s]+([^.]+)')
+_QUESTION_PATTERN = re.compile(r'(?:\?|question)[:\s]+([^.]+)')
+_DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+_SESSION_PATTERN = re.compile(r'Session \d+')
+_COUNTER_PATTERN = re.compile(r'\d+/\d+')
+
+_SUMMARY_CACHE: "OrderedDict[bytes, str]" = OrderedDict()
+_SUMMARY_CACHE_SIZE = 4096
 
 
 def estimate_token_count(text: str) -> int:
     """
-    Estimate token count for text.
-    
-    Uses approximation: ~4 characters per token for English.
-    
-    WARNING: This is a rough estimate. Actual tokenization varies by:
-    - Model (GPT-5.2, Claude 4.5, Gemini 3 have different tokenizers)
-    - Content type (code typically has higher token density)
-    - Language (non-English may have 2-3x higher token/char ratio)
+    Count tokens for text with the shared token counter.
     
-    Production usage:
-        import tiktoken
-        enc = tiktoken.encoding_for_model("gpt-4")  # Use appropriate model
-        token_count = len(enc.encode(text))
+    Counts are cached by content hash, so repeated observations and
+    messages are only tokenized once.
     """
-    return len(text) // 4
+    return count_tokens(text)
 
 
-def estimate_message_tokens(messages: list) -> int:
-    """Estimate token count for message list."""
-    total = 0
-    for msg in messages:
-        # Count content
-        content = msg.get("content", "")
-        total += estimate_token_count(content)
-        
-        # Add overhead for role/formatting
-        total += 10
+def estimate_message_tokens(messages: list, counter=None) -> int:
+    """
+    Estimate token count for message list (+10 per message for role/formatting).
     
-    return total
+    counter: Object with count_many() (e.g. a token_counter.TokenCounter);
+        defaults to the module's counter
+    """
+    contents = [msg.get("content", "") for msg in messages]
+    counts = counter.count_many(contents) if counter is not None else count_tokens_many(contents)
+    return sum(counts) + 10 * len(messages)
 
 
 # Compaction Functions
 
+def categorize_message(msg: dict) -> str:
+    """Get the compaction category of a message without copying it."""
+    role = msg.get("role", "user")
+    
+    if role == "system":
+        return "system_prompt"
+    elif "tool_use" in msg.get("type", ""):
+        return "tool_output"
+    elif role == "user":
+        return "conversation"
+    elif "retrieved" in msg.get("tags", []):
+        return "retrieved_document"
+    else:
+        return "other"
+
+
 def categorize_messages(messages: list) -> dict:
     """
     Categorize messages for selective compaction.
@@ -76,19 +115,8 @@ def categorize_messages(messages: list) -> dict:
     }
     
     for msg in messages:
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        
-        if role == "system":
-            categories["system_prompt"].append({**msg, "category": "system_prompt"})
-        elif "tool_use" in msg.get("type", ""):
-            categories["tool_output"].append({**msg, "category": "tool_output"})
-        elif role == "user":
-            categories["conversation"].append({**msg, "category": "conversation"})
-        elif "retrieved" in msg.get("tags", []):
-            categories["retrieved_document"].append({**msg, "category": "retrieved_document"})
-        else:
-            categories["other"].append({**msg, "category": "other"})
+        category = categorize_message(msg)
+        categories[category].append({**msg, "category": category})
     
     return categories
 
@@ -97,38 +125,50 @@ def summarize_content(content: str, category: str, max_length: int = 500) -> str
     """
     Summarize content for compaction.
     
-    Different summarization for different categories.
+    Different summarization for different categories. Summaries are
+    memoized by content hash, so repeated outputs are summarized once.
     """
+    key = hashlib.blake2b(
+        f"{category}\0{max_length}\0{content}".encode("utf-8"), digest_size=16
+    ).digest()
+    summary = _SUMMARY_CACHE.get(key)
+    if summary is not None:
+        _SUMMARY_CACHE.move_to_end(key)
+        return summary
+    
     if category == "tool_output":
-        return summarize_tool_output(content, max_length)
+        summary = summarize_tool_output(content, max_length)
     elif category == "conversation":
-        return summarize_conversation(content, max_length)
+        summary = summarize_conversation(content, max_length)
     elif category == "retrieved_document":
-        return summarize_document(content, max_length)
+        summary = summarize_document(content, max_length)
     else:
-        return summarize_general(content, max_length)
+        summary = summarize_general(content, max_length)
+    
+    _SUMMARY_CACHE[key] = summary
+    if len(_SUMMARY_CACHE) > _SUMMARY_CACHE_SIZE:
+        _SUMMARY_CACHE.popitem(last=False)
+    return summary
 
 
 def summarize_tool_output(content: str, max_length: int = 500) -> str:
     """Summarize tool output."""
     # Extract key metrics and findings
-    import re
-    
     # Look for metrics (numbers with context)
-    metrics = re.findall(r'(\w+):\s*([\d.,]+)', content)
+    metrics = _METRIC_PATTERN.findall(content)
     
-    # Look for key findings (lines with important keywords)
-    keywords = ["result", "found", "total", "success", "error", "value"]
+    # Look for key findings (lines with important keywords); only three are kept
     findings = []
-    for line in content.split('\n'):
-        if any(kw in line.lower() for kw in keywords):
-            findings.append(line.strip())
+    for match in _FINDING_PATTERN.finditer(content):
+        findings.append(match.group(0).strip())
+        if len(findings) == 3:
+            break
     
     summary_parts = []
     if metrics:
         summary_parts.append(f"Metrics: {', '.join([f'{k}={v}' for k, v in metrics])}")
     if findings:
-        summary_parts.append("Key findings: " + "; ".join(findings[:3]))
+        summary_parts.append("Key findings: " + "; ".join(findings))
     
     result = " | ".join(summary_parts) if summary_parts else "[Tool output summarized]"
     return result[:max_length]
@@ -137,16 +177,14 @@ def summarize_tool_output(content: str, max_length: int = 500) -> str:
 def summarize_conversation(content: str, max_length: int = 500) -> str:
     """Summarize conversational content."""
     # Identify key decisions and questions
-    import re
-    
-    decisions = re.findall(r'(?i)(?:decided|decision|chose|chosen)[:\s]+([^.]+)', content)
-    questions = re.findall(r'(?:\?|question)[:\s]+([^.]+)', content)
+    decisions = sum(1 for _ in _DECISION_PATTERN.finditer(content))
+    questions = sum(1 for _ in _QUESTION_PATTERN.finditer(content))
     
     summary_parts = []
     if decisions:
-        summary_parts.append(f"Decisions: {len(decisions)} made")
+        summary_parts.append(f"Decisions: {decisions} made")
     if questions:
-        summary_parts.append(f"Questions: {len(questions)} raised")
+        summary_parts.append(f"Questions: {questions} raised")
     
     result = " | ".join(summary_parts) if summary_parts else "[Conversation summarized]"
     return result[:max_length]
@@ -154,16 +192,14 @@ def summarize_conversation(content: str, max_length: int = 500) -> str:
 
 def summarize_document(content: str, max_length: int = 500) -> str:
     """Summarize document content."""
-    # Extract first paragraph as summary
-    paragraphs = content.split('\n\n')
-    if paragraphs:
-        first_para = paragraphs[0].strip()
-        # Truncate to first few sentences
-        sentences = first_para.split('. ')
-        if len(sentences) > 2:
-            first_para = '. '.join(sentences[:2]) + '.'
-        return first_para[:max_length]
-    return "[Document summarized]"
+    # Extract first paragraph as summary (without splitting the rest)
+    end = content.find('\n\n')
+    first_para = (content if end < 0 else content[:end]).strip()
+    # Truncate to first few sentences
+    sentences = first_para.split('. ', 2)
+    if len(sentences) > 2:
+        first_para = '. '.join(sentences[:2]) + '.'
+    return first_para[:max_length]
 
 
 def summarize_general(content: str, max_length: int = 500) -> str:
@@ -174,36 +210,150 @@ def summarize_general(content: str, max_length: int = 500) -> str:
 # Observation Masking
 
 class ObservationStore:
-    def __init__(self, max_size=1000):
-        self.observations = {}
-        self.order = []
+    """
+    LRU store for masked observations, bounded by total content bytes.
+    
+    Recently used observations stay in memory. When the in-memory total
+    exceeds max_bytes (or max_size entries, if given), the least recently
+    used ones are zlib-compressed and appended to a spill segment on disk;
+    an offset index keeps them retrievable, and a retrieve promotes them
+    back into memory.
+    """
+    
+    def __init__(self, max_size: int = None, max_bytes: int = 8 * 1024 * 1024,
+                 spill_path: str = None):
+        self.observations = OrderedDict()
         self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.memory_bytes = 0
+        self.spill_path = spill_path
+        self.spill_index = {}
+        self._spill_file = None
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.spill_hits = 0
+        self.deduplicated = 0
     
     def store(self, content: str, metadata: dict = None) -> str:
         """Store observation and return reference ID."""
         ref_id = self._generate_ref_id(content)
         
-        self.observations[ref_id] = {
+        # Identical content maps to the same id, so it is stored only once
+        if ref_id in self.observations:
+            self.observations.move_to_end(ref_id)
+            self.observations[ref_id]["last_accessed"] = time.time()
+            self.deduplicated += 1
+            return ref_id
+        if ref_id in self.spill_index:
+            self.deduplicated += 1
+            return ref_id
+        
+        now = time.time()
+        self._admit(ref_id, {
             "content": content,
             "metadata": metadata or {},
-            "stored_at": time.time(),
-            "last_accessed": time.time()
-        }
-        self.order.append(ref_id)
-        
-        # Evict oldest if over limit
-        if len(self.order) > self.max_size:
-            oldest = self.order.pop(0)
-            del self.observations[oldest]
-        
+            "stored_at": now,
+            "last_accessed": now,
+            "size": len(content.encode("utf-8"))
+        })
         return ref_id
     
     def retrieve(self, ref_id: str) -> str:
-        """Retrieve observation by reference ID."""
-        if ref_id in self.observations:
-            self.observations[ref_id]["last_accessed"] = time.time()
-            return self.observations[ref_id]["content"]
-        return None
+        """Retrieve observation by reference ID, from memory or the spill segment."""
+        entry = self.observations.get(ref_id)
+        if entry is not None:
+            self.observations.move_to_end(ref_id)
+            self.hits += 1
+        elif ref_id in self.spill_index:
+            entry = self._read_spilled(ref_id)
+            self._admit(ref_id, entry)
+            self.hits += 1
+            self.spill_hits += 1
+        else:
+            self.misses += 1
+            return None
+        entry["last_accessed"] = time.time()
+        return entry["content"]
+    
+    def stats(self) -> dict:
+        """Get hit/miss/spill counters and current footprint."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "spills": self.spills,
+            "spill_hits": self.spill_hits,
+            "deduplicated": self.deduplicated,
+            "in_memory": len(self.observations),
+            "memory_bytes": self.memory_bytes,
+            "spilled": len(self.spill_index)
+        }
+    
+    def close(self):
+        """Close the spill segment file."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+    
+    def __contains__(self, ref_id: str) -> bool:
+        return ref_id in self.observations or ref_id in self.spill_index
+    
+    def __len__(self) -> int:
+        return len(self.observations) + sum(
+            1 for ref_id in self.spill_index if ref_id not in self.observations
+        )
+    
+    def _admit(self, ref_id: str, entry: dict):
+        """Insert entry as most recently used and evict down to budget."""
+        previous = self.observations.pop(ref_id, None)
+        if previous is not None:
+            self.memory_bytes -= previous["size"]
+        self.observations[ref_id] = entry
+        self.memory_bytes += entry["size"]
+        
+        # Always keep the newest entry resident, even if it alone exceeds budget
+        while len(self.observations) > 1 and (
+            self.memory_bytes > self.max_bytes
+            or (self.max_size is not None and len(self.observations) > self.max_size)
+        ):
+            oldest, evicted = self.observations.popitem(last=False)
+            self.memory_bytes -= evicted["size"]
+            self._spill(oldest, evicted)
+    
+    def _spill(self, ref_id: str, entry: dict):
+        """Append evicted entry to the spill segment (once per ref id)."""
+        if ref_id in self.spill_index:
+            return
+        record = zlib.compress(json.dumps({
+            "content": entry["content"],
+            "metadata": entry["metadata"],
+            "stored_at": entry["stored_at"]
+        }).encode("utf-8"))
+        segment = self._segment()
+        segment.seek(0, os.SEEK_END)
+        self.spill_index[ref_id] = (segment.tell(), len(record), entry["size"])
+        segment.write(record)
+        self.spills += 1
+    
+    def _read_spilled(self, ref_id: str) -> dict:
+        offset, length, size = self.spill_index[ref_id]
+        segment = self._segment()
+        segment.flush()
+        segment.seek(offset)
+        entry = json.loads(zlib.decompress(segment.read(length)).decode("utf-8"))
+        entry["size"] = size
+        return entry
+    
+    def _segment(self):
+        """Open the spill segment lazily; a temporary file if no path was given."""
+        if self._spill_file is None:
+            if self.spill_path is None:
+                self._spill_file = tempfile.TemporaryFile(prefix="observations-", suffix=".seg")
+            else:
+                self._spill_file = open(self.spill_path, "w+b")
+        return self._spill_file
     
     def mask(self, content: str, max_length: int = 200) -> tuple:
         """
@@ -223,9 +373,13 @@ class ObservationStore:
         return masked, ref_id
     
     def _generate_ref_id(self, content: str) -> str:
-        """Generate unique reference ID."""
-        hash_input = f"{content[:100]}{time.time()}"
-        return hashlib.md5(hash_input.encode()).hexdigest()[:8]
+        """
+        Generate content-addressed reference ID.
+        
+        Hashes the full content, so the same observation always masks to
+        the same reference across runs and the masked prefix stays cacheable.
+        """
+        return hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
     
     def _extract_key_point(self, content: str) -> str:
         """Extract key point from observation."""
@@ -239,11 +393,126 @@ class ObservationStore:
         return content[:50] + "..."
 
 
+# Compaction Pipeline
+
+def categorize_stream(messages: Iterable[dict]) -> Iterator[Tuple[str, dict]]:
+    """Pair each message with its category, without copying it."""
+    for msg in messages:
+        yield categorize_message(msg), msg
+
+
+def mask_stage(stream: Iterable[Tuple[str, dict]], store: ObservationStore,
+               max_length: int = 200,
+               categories: tuple = ("tool_output",)) -> Iterator[Tuple[str, dict]]:
+    """Replace long observations with references into store."""
+    for category, msg in stream:
+        content = msg.get("content", "")
+        if category in categories and isinstance(content, str) and len(content) > max_length:
+            masked, ref_id = store.mask(content, max_length)
+            msg = {**msg, "content": masked, "observation_ref": ref_id}
+        yield category, msg
+
+
+def summarize_stage(stream: Iterable[Tuple[str, dict]], max_length: int = 500,
+                    categories: tuple = ("tool_output", "retrieved_document"),
+                    store: ObservationStore = None) -> Iterator[Tuple[str, dict]]:
+    """
+    Replace long content in the given categories with its summary.
+    
+    With a store, the original is kept there and referenced from the
+    summary (and observation_ref), so nothing summarized is lost.
+    """
+    for category, msg in stream:
+        content = msg.get("content", "")
+        if category in categories and isinstance(content, str) and len(content) > max_length:
+            summary = summarize_content(content, category, max_length)
+            if store is None:
+                msg = {**msg, "content": summary, "compacted": True}
+            else:
+                ref_id = store.store(content)
+                msg = {**msg, "content": f"{summary}\n[Obs:{ref_id} full text retrievable.]",
+                       "compacted": True, "observation_ref": ref_id}
+        yield category, msg
+
+
+def compact_messages(messages: Iterable[dict], store: ObservationStore = None,
+                     mask_length: int = 200, summary_length: int = 500,
+                     mask_categories: tuple = ("tool_output",),
+                     summarize_categories: tuple = ("tool_output", "retrieved_document")) -> Iterator[dict]:
+    """
+    Stream messages through categorize -> mask -> summarize.
+    
+    Messages are yielded lazily and only copied when their content is
+    replaced, so per-message overhead stays constant over long transcripts.
+    With a store, long tool outputs are masked and summarized originals are
+    kept, so everything stays retrievable; without one, tool outputs are
+    summarized like other long content and the originals are dropped.
+    """
+    stream = categorize_stream(messages)
+    if store is not None:
+        stream = mask_stage(stream, store, mask_length, mask_categories)
+    stream = summarize_stage(stream, summary_length, summarize_categories, store)
+    for _, msg in stream:
+        yield msg
+
+
 # Context Budget Management
 
+def mask_tool_outputs(messages: List[dict], store: ObservationStore) -> List[dict]:
+    """Compaction action: mask long tool outputs behind references into store."""
+    if store is None:
+        raise ValueError("mask_tool_outputs needs an ObservationStore to keep the originals")
+    return list(compact_messages(messages, store, summarize_categories=()))
+
+
+def summarize_history(messages: List[dict], store: ObservationStore = None,
+                      keep_recent: int = 4) -> List[dict]:
+    """
+    Compaction action: summarize long messages older than the last keep_recent.
+    
+    With a store, the originals are kept there and each summary carries an
+    observation_ref; without one they are discarded.
+    """
+    split = max(len(messages) - keep_recent, 0)
+    older = compact_messages(
+        messages[:split],
+        store,
+        mask_categories=(),
+        summarize_categories=("tool_output", "conversation", "retrieved_document", "other")
+    )
+    return list(older) + messages[split:]
+
+
+# Cheapest first: (name, action, budget categories it shrinks)
+COMPACTION_ACTIONS = [
+    ("mask_tool_outputs", mask_tool_outputs, ("tool_outputs",)),
+    ("summarize_history", summarize_history, ("tool_outputs", "message_history", "retrieved_docs", "other")),
+]
+
+
 class ContextBudget:
-    def __init__(self, total_limit: int):
+    """
+    Token budget per context category, with usage telemetry.
+    
+    record_turn() snapshots per-category usage into a ring buffer of the
+    last history_size turns; forecast() fits the trend to estimate how many
+    turns remain before the limit; auto_compact() runs COMPACTION_ACTIONS
+    cheapest first once the limit is within lead_turns, until projected
+    usage is back under target_ratio of the limit. Masked tool outputs go
+    to self.store, which lives as long as the budget, so their references
+    stay retrievable across compactions.
+    
+    Tokens are counted with `counter` (anything with count() and
+    count_many(), e.g. token_counter.get_counter(), which ContextBuilder
+    uses) or, by default, with this module's counter.
+    """
+    
+    def __init__(self, total_limit: int, history_size: int = 32,
+                 lead_turns: int = 3, target_ratio: float = 0.7,
+                 store: ObservationStore = None, counter=None):
         self.total_limit = total_limit
+        self.store = store if store is not None else ObservationStore()
+        self.counter = counter
         self.allocated = {
             "system_prompt": 0,
             "tool_definitions": 0,
@@ -254,6 +523,14 @@ class ContextBudget:
         }
         self.reserved = 5000  # Reserved buffer
         self.reservation_limit = total_limit - self.reserved
+        self.released = dict.fromkeys(self.allocated, 0)  # cumulative, keeps trends gross of compaction
+        self.history = deque(maxlen=history_size)  # ring buffer of per-turn usage
+        self.lead_turns = lead_turns
+        self.target_ratio = target_ratio
+        self.action_metrics = {
+            name: {"runs": 0, "tokens_saved": 0, "seconds": 0.0}
+            for name, _, _ in COMPACTION_ACTIONS
+        }
     
     def allocate(self, category: str, amount: int) -> bool:
         """Allocate budget to category. Returns success status."""
@@ -269,6 +546,119 @@ class ContextBudget:
         self.allocated[category] += amount
         return True
     
+    def allocate_content(self, category: str, content: str) -> bool:
+        """Allocate budget for content, counted with the budget's token counter."""
+        tokens = self.counter.count(content) if self.counter is not None else count_tokens(content)
+        return self.allocate(category, tokens)
+    
+    def release(self, category: str, amount: int):
+        """Return budget from category (e.g. after compaction)."""
+        if category not in self.allocated:
+            category = "other"
+        released = min(amount, self.allocated[category])
+        self.allocated[category] -= released
+        self.released[category] += released
+    
+    def record_turn(self) -> dict:
+        """Record current per-category usage as one turn of telemetry."""
+        entry = {
+            "time": time.time(),
+            "total": sum(self.allocated.values()),
+            "by_category": dict(self.allocated),
+            "released": dict(self.released)
+        }
+        self.history.append(entry)
+        return entry
+    
+    def forecast(self) -> dict:
+        """
+        Forecast usage from the recorded turns (least-squares trend).
+        
+        Returns tokens per turn overall and by category, and the turns left
+        before reservation_limit (None if usage is not growing).
+        """
+        n = len(self.history)
+        current = sum(self.allocated.values())
+        if n < 2:
+            return {"tokens_per_turn": 0.0, "by_category": {}, "turns_to_limit": None}
+        
+        mean_x = (n - 1) / 2
+        denominator = sum((x - mean_x) ** 2 for x in range(n))
+        
+        def slope(values):
+            mean_y = sum(values) / n
+            return sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values)) / denominator
+        
+        # Trend on gross usage (current plus released), so compaction drops
+        # do not read as negative growth
+        rate = slope([entry["total"] + sum(entry["released"].values()) for entry in self.history])
+        by_category = {
+            category: slope([
+                entry["by_category"].get(category, 0) + entry["released"].get(category, 0)
+                for entry in self.history
+            ])
+            for category in self.allocated
+        }
+        turns_to_limit = None
+        if rate > 0:
+            turns_to_limit = max(self.reservation_limit - current, 0) / rate
+        return {
+            "tokens_per_turn": rate,
+            "by_category": by_category,
+            "turns_to_limit": turns_to_limit
+        }
+    
+    def auto_compact(self, messages: List[dict], store: ObservationStore = None) -> tuple:
+        """
+        Compact messages ahead of the limit, cheapest action first.
+        
+        Returns (messages, applied actions). Tokens saved are released from
+        the categories each action shrinks, and recorded in action_metrics.
+        Masked originals are kept in store (self.store by default).
+        """
+        if store is None:
+            store = self.store
+        current = sum(self.allocated.values())
+        should_optimize, _ = self.should_optimize(current)
+        if not should_optimize:
+            return messages, []
+        
+        rate = max(self.forecast()["tokens_per_turn"], 0.0)
+        target = self.total_limit * self.target_ratio
+        applied = []
+        for name, action, categories in COMPACTION_ACTIONS:
+            if current + rate * self.lead_turns <= target:
+                break
+            before = estimate_message_tokens(messages, self.counter)
+            started = time.perf_counter()
+            messages = action(messages, store)
+            elapsed = time.perf_counter() - started
+            saved = before - estimate_message_tokens(messages, self.counter)
+            
+            # Release savings from the categories the action shrinks, in order
+            remaining_saved = saved
+            for category in categories:
+                released = min(remaining_saved, self.allocated[category])
+                self.release(category, released)
+                remaining_saved -= released
+            current = sum(self.allocated.values())
+            
+            metrics = self.action_metrics[name]
+            metrics["runs"] += 1
+            metrics["tokens_saved"] += saved
+            metrics["seconds"] += elapsed
+            applied.append({"action": name, "tokens_saved": saved, "seconds": elapsed})
+        return messages, applied
+    
+    def get_metrics(self) -> dict:
+        """Get telemetry: forecast, recorded turns and per-action savings and latency."""
+        return {
+            "turns_recorded": len(self.history),
+            "forecast": self.forecast(),
+            "store": self.store.stats(),
+            "actions": {name: dict(m) for name, m in self.action_metrics.items()}
+        }
+    
     def remaining(self) -> int:
         """Get remaining unallocated budget."""
         current = sum(self.allocated.values())
@@ -298,6 +688,11 @@ class ContextBudget:
         if utilization > 0.8:
             reasons.append(("high_utilization", utilization))
         
+        # Check forecast: limit reached within lead_turns at the current trend
+        turns_to_limit = self.forecast()["turns_to_limit"]
+        if turns_to_limit is not None and turns_to_limit <= self.lead_turns:
+            reasons.append(("forecast_limit", turns_to_limit))
+        
         # Check degradation metrics if provided
         if metrics:
             if metrics.get("attention_degradation", 0) > 0.3:
@@ -321,25 +716,172 @@ def design_stable_prompt(template: str, dynamic_values: dict) -> str:
     result = template
     
     # Replace timestamps
-    import re
-    date_pattern = r'\d{4}-\d{2}-\d{2}'
-    result = re.sub(date_pattern, '[DATE_STABLE]', result)
+    result = _DATE_PATTERN.sub('[DATE_STABLE]', result)
     
     # Replace session IDs
-    session_pattern = r'Session \d+'
-    result = re.sub(session_pattern, 'Session [STABLE]', result)
+    result = _SESSION_PATTERN.sub('Session [STABLE]', result)
     
     # Replace counters
-    counter_pattern = r'\d+/\d+'
-    result = re.sub(counter_pattern, '[COUNTER_STABLE]', result)
+    result = _COUNTER_PATTERN.sub('[COUNTER_STABLE]', result)
     
     return result
 
 
-def calculate_cache_metrics(requests: list, cache: dict) -> dict:
+class PrefixCacheSimulator:
+    """
+    Offline model of a provider prefix (KV) cache.
+    
+    Prompts are split into blocks of block_size units: tokens when a
+    tokenize callable is given (e.g. a tiktoken encoding's encode), else
+    characters. Each block is keyed by a rolling hash chained over all
+    earlier blocks, so a key stands for the entire prefix up to it, as in
+    paged prefix caches. Only full blocks are cached; entries expire ttl
+    seconds after their last use and the least recently used are evicted
+    beyond capacity blocks.
+    """
+    
+    def __init__(self, block_size: int = 128, capacity: int = 100000,
+                 ttl: float = 300.0, tokenize=None, min_prefix: int = 0):
+        self.block_size = block_size
+        self.capacity = capacity
+        self.ttl = ttl
+        self.tokenize = tokenize
+        self.min_prefix = min_prefix
+        self.blocks: "OrderedDict[bytes, float]" = OrderedDict()  # key -> expires at
+        self.clock = 0.0
+        self.evictions = 0
+    
+    def block_keys(self, prompt: str) -> Tuple[list, int]:
+        """Get rolling hashes of the prompt's full blocks and its length in units."""
+        units = self.tokenize(prompt) if self.tokenize is not None else prompt
+        size = self.block_size
+        keys = []
+        digest = b""
+        for start in range(0, len(units) - size + 1, size):
+            block = units[start:start + size]
+            if isinstance(block, str):
+                data = block.encode("utf-8")
+            else:
+                data = ",".join(map(str, block)).encode("ascii")
+            digest = hashlib.blake2b(digest + data, digest_size=16).digest()
+            keys.append(digest)
+        return keys, len(units)
+    
+    def process(self, prompt: str, timestamp: float = None) -> dict:
+        """
+        Run one request through the cache.
+        
+        Returns the exact cached prefix length (in units and tokens) and the
+        request's hit rate.
+        """
+        now = self.clock + 1.0 if timestamp is None else timestamp
+        self.clock = now
+        keys, length = self.block_keys(prompt)
+        
+        # Longest cached prefix: blocks hit until the first miss or expiry
+        cached_blocks = 0
+        for key in keys:
+            expires = self.blocks.get(key)
+            if expires is None or expires < now:
+                break
+            cached_blocks += 1
+        
+        # Hits refresh their TTL; the new suffix is written behind them
+        if length >= self.min_prefix:
+            for key in keys:
+                self.blocks[key] = now + self.ttl
+                self.blocks.move_to_end(key)
+            while len(self.blocks) > self.capacity:
+                self.blocks.popitem(last=False)
+                self.evictions += 1
+        
+        cached_units = cached_blocks * self.block_size if length >= self.min_prefix else 0
+        if self.tokenize is not None:
+            prompt_tokens, cached_tokens = length, cached_units
+        else:
+            prompt_tokens = estimate_token_count(prompt)
+            cached_tokens = estimate_token_count(prompt[:cached_units])
+        return {
+            "prompt_units": length,
+            "cached_units": cached_units,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        }
+    
+    def expire(self, now: float = None):
+        """Drop expired blocks."""
+        now = self.clock if now is None else now
+        for key in [k for k, expires in self.blocks.items() if expires < now]:
+            del self.blocks[key]
+
+
+def calculate_cache_metrics(requests: list, cache: PrefixCacheSimulator = None) -> dict:
     """
     Calculate KV-cache hit metrics for request sequence.
+    
+    Args:
+        requests: Rendered prompts, as strings or {"prompt", "timestamp"} dicts
+        cache: Simulator to replay through (a fresh one by default), so
+            successive calls can share cache state
+    
+    Returns totals, per-request cached-prefix lengths and recommendations.
+    
+    The earlier form, {"prefix_hash", "token_count"} requests with a dict
+    cache of {prefix_hash: {"hit_ratio"}}, is still accepted and scored
+    as before.
     """
+    if isinstance(cache, dict):
+        return _legacy_cache_metrics(requests, cache)
+    cache = cache or PrefixCacheSimulator()
+    hits = 0
+    misses = 0
+    per_request = []
+    volatile_breaks = 0
+    
+    for req in requests:
+        if isinstance(req, str):
+            prompt, timestamp = req, None
+        elif isinstance(req, dict) and "prompt" in req:
+            prompt, timestamp = req["prompt"], req.get("timestamp")
+        else:
+            raise TypeError(
+                "calculate_cache_metrics needs prompts (str or {'prompt', 'timestamp'} dicts); "
+                "pass a dict cache to score {'prefix_hash', 'token_count'} requests"
+            )
+        result = cache.process(prompt, timestamp)
+        hits += result["cached_tokens"]
+        misses += result["prompt_tokens"] - result["cached_tokens"]
+        per_request.append(result)
+        
+        # A timestamp, session id or counter right where caching stopped
+        # is the likely reason the prefix diverged
+        if cache.tokenize is None and result["cached_units"] < result["prompt_units"]:
+            start = result["cached_units"]
+            window = prompt[start:start + cache.block_size]
+            if any(p.search(window) for p in (_DATE_PATTERN, _SESSION_PATTERN, _COUNTER_PATTERN)):
+                volatile_breaks += 1
+    
+    total = hits + misses
+    recommendations = generate_cache_recommendations(hits, misses)
+    if volatile_breaks:
+        recommendations.insert(0, (
+            f"{volatile_breaks} request(s) lose the cache at a date, session id or counter; "
+            "move dynamic values after stable content or use design_stable_prompt"
+        ))
+    
+    return {
+        "hit_rate": hits / total if total > 0 else 0,
+        "cache_hits": hits,
+        "cache_misses": misses,
+        "requests": per_request,
+        "evictions": cache.evictions,
+        "recommendations": recommendations
+    }
+
+
+def _legacy_cache_metrics(requests: list, cache: dict) -> dict:
+    """Hit metrics from precomputed prefix hashes and per-prefix hit ratios."""
     hits = 0
     misses = 0
     
@@ -5,70 +5,1046 @@ This module provides utilities for implementing memory systems.
 """
 
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import json
 import hashlib
-from datetime import datetime
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from types import MappingProxyType
+from datetime import datetime, timedelta, timezone
+
+
+# Approximate Nearest-Neighbour Indexes
+#
+# Indexes share a small duck-typed interface over unit-normalized float32 rows,
+# with ids assigned sequentially in insertion order (matching VectorStore):
+#   add(vectors) / search(query, k) -> (ids, scores) / save(path) / load(path) / len()
+# Exact search in VectorStore remains the reference mode.
+
+def _grow_rows(array: np.ndarray, count: int, needed: int) -> np.ndarray:
+    """Return `array` with room for `needed` rows, doubling capacity when full."""
+    if needed <= array.shape[0]:
+        return array
+    capacity = max(needed, array.shape[0] * 2, 16)
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:count] = array[:count]
+    return grown
+
+
+class IVFIndex:
+    """Pure-NumPy inverted-file index (IVF-Flat) with spherical k-means.
+    
+    Vectors are buffered and searched exactly until `train_size` have arrived,
+    then clustered into `nlist` lists. Queries scan the `nprobe` closest lists;
+    raising `nprobe` trades latency for recall.
+    """
+    
+    def __init__(self, dimension: int, nlist: int = 256, nprobe: int = 8,
+                 train_size: Optional[int] = None, seed: int = 0):
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size or nlist * 16
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._pending = np.zeros((0, dimension), dtype=np.float32)
+        self._pending_count = 0
+        self._list_vecs: List[np.ndarray] = []
+        self._list_ids: List[np.ndarray] = []
+        self._list_counts: List[int] = []
+        self._count = 0
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+    
+    def empty_like(self) -> "IVFIndex":
+        """New empty index with the same parameters (used when compacting)."""
+        return IVFIndex(self.dimension, self.nlist, self.nprobe, self.train_size, self.seed)
+    
+    def add(self, vectors: np.ndarray):
+        """Append unit vectors; ids continue from the current count."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        ids = np.arange(self._count, self._count + len(vectors), dtype=np.int64)
+        self._count += len(vectors)
+        
+        if not self.is_trained:
+            n = self._pending_count
+            self._pending = _grow_rows(self._pending, n, n + len(vectors))
+            self._pending[n:n + len(vectors)] = vectors
+            self._pending_count += len(vectors)
+            if self._pending_count >= self.train_size:
+                self.train()
+            return
+        
+        self._assign(vectors, ids)
+    
+    def train(self, iterations: int = 10):
+        """Cluster buffered vectors into inverted lists."""
+        data = self._pending[:self._pending_count]
+        if len(data) == 0:
+            return
+        nlist = min(self.nlist, len(data))
+        rng = np.random.default_rng(self.seed)
+        sample = data
+        if len(data) > nlist * 256:
+            sample = data[rng.choice(len(data), nlist * 256, replace=False)]
+        
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._nearest(sample, centroids, 1)[:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = sums / np.maximum(norms, 1e-12)[:, None]
+        
+        self.centroids = centroids.astype(np.float32)
+        self._list_vecs = [np.zeros((0, self.dimension), dtype=np.float32) for _ in range(nlist)]
+        self._list_ids = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self._list_counts = [0] * nlist
+        self._assign(data, np.arange(len(data), dtype=np.int64))
+        self._pending = np.zeros((0, self.dimension), dtype=np.float32)
+        self._pending_count = 0
+    
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of the best `k` matches, best first."""
+        query = np.asarray(query, dtype=np.float32)
+        if not self.is_trained:
+            scores = self._pending[:self._pending_count] @ query
+            ids = np.arange(self._pending_count, dtype=np.int64)
+        else:
+            probes = self._nearest(query[None, :], self.centroids, self.nprobe)[0]
+            ids = np.concatenate([self._list_ids[c][:self._list_counts[c]] for c in probes])
+            vecs = [self._list_vecs[c][:self._list_counts[c]] for c in probes]
+            scores = np.concatenate([v @ query for v in vecs]) if len(ids) else np.zeros(0, np.float32)
+        top = VectorStore._top_k(scores, min(k, len(scores)))
+        return ids[top], scores[top]
+    
+    def save(self, path: str):
+        """Persist index to a `.npz` file."""
+        if self.is_trained:
+            counts = np.asarray(self._list_counts, dtype=np.int64)
+            vecs = np.concatenate([v[:n] for v, n in zip(self._list_vecs, self._list_counts)])
+            ids = np.concatenate([i[:n] for i, n in zip(self._list_ids, self._list_counts)])
+        else:
+            counts = np.zeros(0, dtype=np.int64)
+            vecs = np.zeros((0, self.dimension), dtype=np.float32)
+            ids = np.zeros(0, dtype=np.int64)
+        np.savez(
+            path,
+            params=np.asarray([self.dimension, self.nlist, self.nprobe, self.train_size, self.seed, self._count]),
+            centroids=self.centroids if self.is_trained else np.zeros((0, self.dimension), np.float32),
+            pending=self._pending[:self._pending_count],
+            list_counts=counts, list_vecs=vecs, list_ids=ids,
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        """Load an index written by `save`."""
+        data = np.load(path)
+        dimension, nlist, nprobe, train_size, seed, count = (int(x) for x in data["params"])
+        index = cls(dimension, nlist=nlist, nprobe=nprobe, train_size=train_size, seed=seed)
+        index._count = count
+        pending = data["pending"]
+        index._pending = pending.copy()
+        index._pending_count = len(pending)
+        if len(data["centroids"]):
+            index.centroids = data["centroids"]
+            offsets = np.concatenate([[0], np.cumsum(data["list_counts"])])
+            index._list_vecs = [data["list_vecs"][a:b].copy() for a, b in zip(offsets[:-1], offsets[1:])]
+            index._list_ids = [data["list_ids"][a:b].copy() for a, b in zip(offsets[:-1], offsets[1:])]
+            index._list_counts = [int(n) for n in data["list_counts"]]
+        return index
+    
+    def _assign(self, vectors: np.ndarray, ids: np.ndarray):
+        """Append vectors to their nearest inverted list."""
+        lists = self._nearest(vectors, self.centroids, 1)[:, 0]
+        for c in np.unique(lists):
+            sel = lists == c
+            n = self._list_counts[c]
+            m = int(sel.sum())
+            self._list_vecs[c] = _grow_rows(self._list_vecs[c], n, n + m)
+            self._list_ids[c] = _grow_rows(self._list_ids[c], n, n + m)
+            self._list_vecs[c][n:n + m] = vectors[sel]
+            self._list_ids[c][n:n + m] = ids[sel]
+            self._list_counts[c] = n + m
+    
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray, k: int,
+                 chunk: int = 8192) -> np.ndarray:
+        """Indices of the `k` most similar centroids per row (chunked)."""
+        k = min(k, len(centroids))
+        out = np.empty((len(vectors), k), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            sims = vectors[start:start + chunk] @ centroids.T
+            if k == 1:
+                out[start:start + chunk, 0] = sims.argmax(axis=1)
+            else:
+                part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                order = np.argsort(-np.take_along_axis(sims, part, axis=1), axis=1)
+                out[start:start + chunk] = np.take_along_axis(part, order, axis=1)
+        return out
+
+
+class HnswlibIndex:
+    """Adapter for hnswlib (optional dependency) using inner-product space."""
+    
+    def __init__(self, dimension: int, m: int = 16, ef_construction: int = 200,
+                 ef: int = 64, initial_capacity: int = 1024):
+        import hnswlib
+        self.dimension = dimension
+        self.ef = ef
+        self._params = {"m": m, "ef_construction": ef_construction, "ef": ef,
+                        "initial_capacity": initial_capacity}
+        self._index = hnswlib.Index(space="ip", dim=dimension)
+        self._index.init_index(max_elements=initial_capacity, M=m, ef_construction=ef_construction)
+        self._index.set_ef(ef)
+    
+    def __len__(self) -> int:
+        return self._index.get_current_count()
+    
+    def empty_like(self) -> "HnswlibIndex":
+        return HnswlibIndex(self.dimension, **self._params)
+    
+    def add(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        start = len(self)
+        needed = start + len(vectors)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, self._index.get_max_elements() * 2))
+        self._index.add_items(vectors, np.arange(start, needed))
+    
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        self._index.set_ef(max(self.ef, k))
+        labels, distances = self._index.knn_query(np.asarray(query, dtype=np.float32), k=k)
+        # hnswlib "ip" distance is 1 - dot
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+    
+    def save(self, path: str):
+        self._index.save_index(path)
+    
+    @classmethod
+    def load(cls, path: str, dimension: int, ef: int = 64) -> "HnswlibIndex":
+        import hnswlib
+        index = cls.__new__(cls)
+        index.dimension = dimension
+        index.ef = ef
+        index._index = hnswlib.Index(space="ip", dim=dimension)
+        index._index.load_index(path)
+        index._index.set_ef(ef)
+        index._params = {"ef": ef, "initial_capacity": index._index.get_max_elements()}
+        return index
+
+
+class FaissIndex:
+    """Adapter for faiss (optional dependency) using an HNSW inner-product index."""
+    
+    def __init__(self, dimension: int, m: int = 32, ef_search: int = 64):
+        import faiss
+        self.dimension = dimension
+        self._params = {"m": m, "ef_search": ef_search}
+        self._index = faiss.IndexHNSWFlat(dimension, m, faiss.METRIC_INNER_PRODUCT)
+        self._index.hnsw.efSearch = ef_search
+    
+    def __len__(self) -> int:
+        return self._index.ntotal
+    
+    def empty_like(self) -> "FaissIndex":
+        return FaissIndex(self.dimension, **self._params)
+    
+    def add(self, vectors: np.ndarray):
+        self._index.add(np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dimension))
+    
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores, ids = self._index.search(np.asarray(query, dtype=np.float32).reshape(1, -1), k)
+        keep = ids[0] >= 0
+        return ids[0][keep].astype(np.int64), scores[0][keep]
+    
+    def save(self, path: str):
+        import faiss
+        faiss.write_index(self._index, path)
+    
+    @classmethod
+    def load(cls, path: str) -> "FaissIndex":
+        import faiss
+        index = cls.__new__(cls)
+        index._index = faiss.read_index(path)
+        index.dimension = index._index.d
+        index._params = {"m": index._index.hnsw.nb_neighbors(1), "ef_search": index._index.hnsw.efSearch}
+        return index
+
+
+def make_index(kind: str, dimension: int, **params) -> Any:
+    """Create an ANN index: "ivf", "hnswlib", "faiss", or "auto".
+    
+    "auto" prefers hnswlib, then faiss, then the pure-NumPy IVF index.
+    """
+    if kind == "auto":
+        for candidate in ("hnswlib", "faiss"):
+            try:
+                __import__(candidate)
+            except ImportError:
+                continue
+            return make_index(candidate, dimension, **params)
+        return IVFIndex(dimension, **params)
+    if kind == "ivf":
+        return IVFIndex(dimension, **params)
+    if kind == "hnswlib":
+        return HnswlibIndex(dimension, **params)
+    if kind == "faiss":
+        return FaissIndex(dimension, **params)
+    raise ValueError(f"Unknown index kind: {kind}")
+
+
+# Embedding Providers
+#
+# Providers expose `model_id`, `dimension` and `embed(texts) -> (n, dimension)`.
+# CachedEmbedder puts an EmbeddingCache in front of any provider, keyed by a
+# stable hash of (model_id, text), so known text never reaches the model twice.
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """Deterministic local embedder: signed feature hashing of words and char trigrams.
+    
+    Stable across processes (blake2b, not the salted built-in hash), needs no
+    model download, and texts sharing words score higher than unrelated ones.
+    """
+    
+    def __init__(self, dimension: int = 768, seed: int = 0):
+        self.dimension = dimension
+        self.model_id = f"hashing-v1-{dimension}-{seed}"
+        self._key = seed.to_bytes(8, "little")
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                bucket, sign = self._bucket(feature)
+                out[row, bucket] += sign
+        return out
+    
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        features = []
+        for token in _TOKEN_RE.findall(text.lower()):
+            features.append(token)
+            if len(token) > 1:
+                padded = f"#{token}#"
+                features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+    
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        cached = self._buckets.get(feature)
+        if cached is None:
+            h = int.from_bytes(
+                hashlib.blake2b(feature.encode("utf-8"), digest_size=8, key=self._key).digest(),
+                "little"
+            )
+            cached = (h % self.dimension, 1.0 if h >> 63 else -1.0)
+            if len(self._buckets) < 1_000_000:
+                self._buckets[feature] = cached
+        return cached
+
+
+class SentenceTransformerEmbedder:
+    """Adapter for local sentence-transformers models (requires `sentence-transformers`)."""
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", batch_size: int = 64,
+                 device: Optional[str] = None):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device)
+        self.model_id = f"sentence-transformers/{model_name}"
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True),
+            dtype=np.float32
+        )
+
+
+class CallableEmbedder:
+    """Adapter for any local model exposed as fn(texts) -> array of shape (n, dimension)."""
+    
+    def __init__(self, fn: Any, model_id: str, dimension: int):
+        self.fn = fn
+        self.model_id = model_id
+        self.dimension = dimension
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.fn(texts), dtype=np.float32)
+
+
+class EmbeddingCache:
+    """LRU embedding cache keyed by blake2b(model_id, text).
+    
+    Holds up to `capacity` vectors; with `path`, entries also persist in a
+    SQLite file (evicted there by least-recent use) so restarts skip the model.
+    The disk row count is tracked in memory; once it passes `capacity`, the
+    least recently used rows are evicted down to `capacity - evict_batch`
+    in one statement. Recency updates from disk hits are buffered and
+    written with the next insert (or on close), so each put_many is a
+    single transaction.
+    """
+    
+    def __init__(self, path: Optional[str] = None, capacity: int = 100_000,
+                 memory_capacity: int = 10_000, evict_batch: Optional[int] = None):
+        self.path = path
+        self.capacity = capacity
+        self.memory_capacity = min(memory_capacity, capacity)
+        self.evict_batch = max(1, capacity // 10) if evict_batch is None else evict_batch
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = itertools.count(int(time.time() * 1e6))
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._disk_count = 0
+        self._touched: Dict[bytes, int] = {}  # key -> last use, not yet written
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, used INTEGER NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+            self._db.commit()
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    @staticmethod
+    def key(model_id: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model_id}\0{text}".encode("utf-8"), digest_size=16).digest()
+    
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Cached vectors in key order (None for misses)."""
+        with self._lock:
+            found: List[Optional[np.ndarray]] = []
+            disk_lookups = []
+            for i, key in enumerate(keys):
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                elif self._db is not None:
+                    disk_lookups.append(i)
+                found.append(vec)
+            if disk_lookups:
+                self._load_from_disk(keys, disk_lookups, found)
+            hits = sum(v is not None for v in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return found
+    
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        with self._lock:
+            for key, vec in zip(keys, vectors):
+                self._remember(key, np.asarray(vec, dtype=np.float32))
+            if self._db is not None:
+                self._write_touched()
+                # Keys only reach put_many after missing on disk, so they are new rows
+                rows = {key: (key, np.asarray(vec, dtype=np.float32).tobytes(), next(self._clock))
+                        for key, vec in zip(keys, vectors)}
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, used) VALUES (?, ?, ?)",
+                    list(rows.values())
+                )
+                self._disk_count += len(rows)
+                if self._disk_count > self.capacity:
+                    self._evict_disk()
+                self._db.commit()
+    
+    def __len__(self) -> int:
+        if self._db is not None:
+            return self._disk_count
+        return len(self._memory)
+    
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._write_touched()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+    
+    def _remember(self, key: bytes, vec: np.ndarray):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_capacity:
+            self._memory.popitem(last=False)
+    
+    def _load_from_disk(self, keys: List[bytes], positions: List[int],
+                        found: List[Optional[np.ndarray]]):
+        wanted = {keys[i]: i for i in positions}
+        rows = []
+        for chunk_start in range(0, len(positions), 500):
+            chunk = [keys[i] for i in positions[chunk_start:chunk_start + 500]]
+            rows.extend(self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall())
+        for key, blob in rows:
+            vec = np.frombuffer(blob, dtype=np.float32).copy()
+            found[wanted[key]] = vec
+            self._remember(key, vec)
+        for key, _ in rows:
+            self._touched[key] = next(self._clock)
+        if len(self._touched) >= 1024:
+            self._write_touched()
+            self._db.commit()
+        # Duplicate keys within one request resolve to the same row
+        for i in positions:
+            if found[i] is None and keys[i] in self._memory:
+                found[i] = self._memory[keys[i]]
+    
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embeddings SET used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+    
+    def _evict_disk(self):
+        """Drop least recently used rows down to capacity - evict_batch."""
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._disk_count - max(self.capacity - self.evict_batch, 0)
+        if self._disk_count > self.capacity and excess > 0:
+            self._db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY used LIMIT ?)", (excess,)
+            )
+            self._disk_count -= excess
+
+
+class CachedEmbedder:
+    """Provider wrapper that only runs the model on texts missing from the cache."""
+    
+    def __init__(self, provider: Any, cache: Optional[EmbeddingCache] = None):
+        self.provider = provider
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.model_id = provider.model_id
+        self.dimension = provider.dimension
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        keys = [EmbeddingCache.key(self.model_id, text) for text in texts]
+        found = self.cache.get_many(keys)
+        
+        # Run the model once per distinct missing text
+        missing: Dict[bytes, str] = {}
+        for key, text, vec in zip(keys, texts, found):
+            if vec is None:
+                missing.setdefault(key, text)
+        if missing:
+            computed = np.asarray(self.provider.embed(list(missing.values())), dtype=np.float32)
+            self.cache.put_many(list(missing), computed)
+            fresh = dict(zip(missing, computed))
+            found = [vec if vec is not None else fresh[key] for key, vec in zip(keys, found)]
+        
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.stack(found)
+
+
+# Persistent Storage
+#
+# A persistent VectorStore is a directory holding:
+#   vectors.f32     64-byte header (magic, version, dimension, count) followed by
+#                   float32 rows; memory-mapped, so opening is O(1) and pages load lazily
+#   metadata.jsonl  append-only JSON line per row
+#   metadata.idx    uint64 byte offset of each metadata line (memory-mapped)
+#   tombstones.u64  uint64 ids of removed rows (until the next compaction)
+#   model.json      model_id of the embedder the rows came from; opening the
+#                   store with a different embedder raises ValueError
+# Rows are written before the header count is bumped, so readers never see a
+# partial row. Any number of read-only processes can map the same files;
+# compaction swaps in new files, which readers notice on refresh().
+
+_VECTOR_MAGIC = int.from_bytes(b"ZKVECTR1", "little")
+_VECTOR_VERSION = 1
+_HEADER_BYTES = 64
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Mapping):
+        return dict(value)
+    return str(value)
+
+
+class MetadataLog:
+    """Append-only JSONL metadata with O(1) random access via an offset index."""
+    
+    def __init__(self, directory: str, read_only: bool = False, cache_size: int = 4096):
+        self.data_path = os.path.join(directory, "metadata.jsonl")
+        self.index_path = os.path.join(directory, "metadata.idx")
+        self.read_only = read_only
+        self.cache_size = cache_size
+        self._cache: Dict[int, Dict] = {}
+        if not read_only:
+            for path in (self.data_path, self.index_path):
+                open(path, "ab").close()
+        self._data = open(self.data_path, "rb" if read_only else "a+b")
+        self._offsets: Any = np.zeros(0, dtype=np.uint64)
+        self.refresh()
+        if not read_only:
+            # The writer owns the index, so it keeps offsets in memory
+            self._offsets = [int(o) for o in self._offsets]
+    
+    def refresh(self):
+        """Re-map the offset index (picks up rows appended by a writer)."""
+        if not self.read_only and isinstance(self._offsets, list):
+            return
+        size = os.path.getsize(self.index_path) // 8
+        if size != len(self._offsets):
+            self._offsets = (np.memmap(self.index_path, dtype=np.uint64, mode="r", shape=(size,))
+                             if size else np.zeros(0, dtype=np.uint64))
+    
+    def __len__(self) -> int:
+        return len(self._offsets)
+    
+    def __getitem__(self, i: int) -> Dict:
+        if i < 0:
+            i += len(self)
+        cached = self._cache.get(i)
+        if cached is not None:
+            return cached
+        self._data.seek(int(self._offsets[i]))
+        record = json.loads(self._data.readline())
+        if len(self._cache) >= self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[i] = record
+        return record
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def append(self, record: Dict):
+        self.extend([record])
+    
+    def extend(self, records: List[Dict]):
+        if self.read_only:
+            raise PermissionError("MetadataLog opened read-only")
+        self._data.seek(0, os.SEEK_END)
+        offset = self._data.tell()
+        offsets = []
+        chunks = []
+        for record in records:
+            line = (json.dumps(record, default=_json_default) + "\n").encode("utf-8")
+            offsets.append(offset)
+            offset += len(line)
+            chunks.append(line)
+        self._data.write(b"".join(chunks))
+        self._data.flush()
+        with open(self.index_path, "ab") as f:
+            f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        self._offsets.extend(offsets)
+    
+    def close(self):
+        self._data.close()
 
 
 class VectorStore:
-    """Simple vector store with metadata indexing."""
+    """Vector store with metadata indexing.
+    
+    Embeddings live in one contiguous, pre-normalized float32 matrix that
+    grows geometrically, so search is a single matrix-vector product.
+    With `path`, the matrix and metadata are persisted (see Persistent Storage).
+    Embeddings come from `embedder` (see Embedding Providers); the default is
+    a cached HashingEmbedder. The ANN index is fed lazily, on the first search
+    after rows arrive, so opening a persistent store does not rebuild it.
+    """
     
-    def __init__(self, dimension: int = 768):
+    def __init__(self, dimension: int = 768, initial_capacity: int = 1024,
+                 index: Any = None, path: Optional[str] = None,
+                 read_only: bool = False, embedder: Any = None):
         self.dimension = dimension
-        self.vectors: List[np.ndarray] = []
-        self.metadata: List[Dict] = []
-        self.entity_index: Dict[str, List[int]] = {}
-        self.time_index: Dict[str, List[int]] = {}
+        if embedder is None:
+            embedder = CachedEmbedder(HashingEmbedder(dimension))
+        if embedder.dimension != dimension:
+            raise ValueError(
+                f"Embedder dimension {embedder.dimension} does not match store dimension {dimension}"
+            )
+        self.embedder = embedder
+        self.path = path
+        self.read_only = read_only
+        self._count = 0
+        self._header: Optional[np.ndarray] = None
+        self._deleted: set = set()  # Removed rows, dropped by compact()
+        self._deleted_mask: Optional[np.ndarray] = None
+        self._entity_index: Optional[Dict[str, List[int]]] = {}
+        self._time_index: Optional[Dict[str, List[int]]] = {}
+        # Posting lists for filter keys, built lazily on first use: key -> value -> indices
+        self._filter_index: Dict[str, Dict[Any, List[int]]] = {}
+        if path is None:
+            self._matrix = np.zeros((initial_capacity, dimension), dtype=np.float32)
+            self.metadata: Any = []
+        else:
+            self._open_files(initial_capacity)
+        
+        # Optional ANN index (see make_index); None means exact search only
+        self.index = make_index(index, self.dimension) if isinstance(index, str) else index
+    
+    @classmethod
+    def open(cls, path: str, read_only: bool = True, **kwargs) -> "VectorStore":
+        """Open an existing persistent store; dimension comes from its header."""
+        with open(os.path.join(path, "vectors.f32"), "rb") as f:
+            header = np.frombuffer(f.read(_HEADER_BYTES), dtype=np.uint64)
+        return cls(dimension=int(header[2]), path=path, read_only=read_only, **kwargs)
+    
+    @property
+    def vectors(self) -> np.ndarray:
+        """Normalized embeddings, one row per document (view, no copy)."""
+        return self._matrix[:self._count]
+    
+    @property
+    def entity_index(self) -> Dict[str, List[int]]:
+        if self._entity_index is None:
+            self._rebuild_metadata_indexes()
+        return self._entity_index
+    
+    @property
+    def time_index(self) -> Dict[str, List[int]]:
+        if self._time_index is None:
+            self._rebuild_metadata_indexes()
+        return self._time_index
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def deleted_count(self) -> int:
+        return len(self._deleted)
+    
+    def is_deleted(self, index: int) -> bool:
+        return index in self._deleted
+    
+    def remove(self, indices: List[int]):
+        """Tombstone rows; they vanish from results now and from storage on compact()."""
+        if self.read_only:
+            raise PermissionError("VectorStore opened read-only")
+        fresh = [int(i) for i in indices if 0 <= i < self._count and i not in self._deleted]
+        if not fresh:
+            return
+        self._deleted.update(fresh)
+        self._deleted_mask = None
+        if self._header is not None:
+            with open(os.path.join(self.path, "tombstones.u64"), "ab") as f:
+                f.write(np.asarray(fresh, dtype=np.uint64).tobytes())
+    
+    def compact(self) -> np.ndarray:
+        """Drop removed rows, renumbering the rest; returns old -> new ids (-1 if dropped)."""
+        if self.read_only:
+            raise PermissionError("VectorStore opened read-only")
+        remap = np.full(self._count, -1, dtype=np.int64)
+        keep = np.flatnonzero(self._live_mask())
+        remap[keep] = np.arange(len(keep))
+        if len(keep) == self._count:
+            return remap
+        
+        if self._header is None:
+            self._matrix[:len(keep)] = self._matrix[keep]
+            self.metadata = [self.metadata[i] for i in keep]
+            self._count = len(keep)
+        else:
+            self._rewrite_files(keep)
+        self._deleted = set()
+        self._deleted_mask = None
+        self._entity_index = None
+        self._time_index = None
+        self._filter_index = {}
+        if self.index is not None:
+            self.index = self.index.empty_like()
+        return remap
+    
+    def _live_mask(self) -> np.ndarray:
+        """Boolean mask of rows that have not been removed."""
+        if self._deleted_mask is None or len(self._deleted_mask) != self._count:
+            mask = np.ones(self._count, dtype=bool)
+            if self._deleted:
+                mask[np.fromiter(self._deleted, dtype=np.int64)] = False
+            self._deleted_mask = mask
+        return self._deleted_mask
+    
+    def _rewrite_files(self, keep: np.ndarray):
+        """Write compacted files next to the live ones, then swap them in."""
+        vector_path = os.path.join(self.path, "vectors.f32")
+        header = np.zeros(_HEADER_BYTES // 8, dtype=np.uint64)
+        header[:4] = [_VECTOR_MAGIC, _VECTOR_VERSION, self.dimension, len(keep)]
+        with open(vector_path + ".tmp", "wb") as f:
+            f.write(header.tobytes())
+            for start in range(0, len(keep), 4096):
+                f.write(np.ascontiguousarray(self._matrix[keep[start:start + 4096]]).tobytes())
+        
+        log = self.metadata
+        with open(log.data_path + ".tmp", "wb") as data, open(log.index_path + ".tmp", "wb") as idx:
+            offset = 0
+            offsets = []
+            for i in keep:
+                log._data.seek(int(log._offsets[i]))
+                line = log._data.readline()
+                data.write(line)
+                offsets.append(offset)
+                offset += len(line)
+            idx.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        
+        log.close()
+        self._matrix = self._header = None
+        for path in (vector_path, log.data_path, log.index_path):
+            os.replace(path + ".tmp", path)
+        tombstones = os.path.join(self.path, "tombstones.u64")
+        if os.path.exists(tombstones):
+            os.remove(tombstones)
+        self._open_files(max(len(keep), 16))
     
     def add(self, text: str, metadata: Dict[str, Any] = None) -> int:
         """Add document to store."""
-        embedding = self._embed(text)
-        index = len(self.vectors)
+        if self.read_only:
+            raise PermissionError("VectorStore opened read-only")
+        metadata = metadata or {}
+        embedding = self._normalize(self._embed(text))
+        index = self._count
+        
+        self._reserve(index + 1)
+        self._matrix[index] = embedding
+        self.metadata.append(metadata)
+        self._set_count(index + 1)
         
-        self.vectors.append(embedding)
-        self.metadata.append(metadata or {})
+        self._index_metadata(index, metadata)
         
+        return index
+    
+    def add_batch(self, texts: List[str],
+                  metadatas: Optional[List[Dict[str, Any]]] = None) -> List[int]:
+        """Add many documents with one embedding call and one matrix write."""
+        if self.read_only:
+            raise PermissionError("VectorStore opened read-only")
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        if len(metadatas) != len(texts):
+            raise ValueError("texts and metadatas must have the same length")
+        if not texts:
+            return []
+        metadatas = [m or {} for m in metadatas]
+        embeddings = np.asarray(self._embed_batch(texts), dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms > 0, norms, 1.0)
+        
+        start = self._count
+        end = start + len(texts)
+        self._reserve(end)
+        self._matrix[start:end] = embeddings
+        self.metadata.extend(metadatas)
+        self._set_count(end)
+        
+        for index, metadata in enumerate(metadatas, start):
+            self._index_metadata(index, metadata)
+        
+        return list(range(start, end))
+    
+    def refresh(self):
+        """Pick up rows appended by another process (persistent stores only)."""
+        if self._header is None:
+            return
+        if os.stat(os.path.join(self.path, "vectors.f32")).st_ino != self._inode:
+            # The writer compacted the store: re-map the new files from scratch
+            self.metadata.close()
+            self._deleted = set()
+            self._deleted_mask = None
+            self._filter_index = {}
+            self._open_files(16)
+            if self.index is not None:
+                self.index = self.index.empty_like()
+            return
+        self._load_tombstones()
+        count = int(self._header[3])
+        if count > self._matrix.shape[0]:
+            self._map_matrix()
+        self.metadata.refresh()
+        count = min(count, len(self.metadata))
+        if count != self._count:
+            self._count = count
+            self._entity_index = None
+            self._time_index = None
+            self._filter_index = {}
+    
+    def flush(self):
+        """Flush mapped pages to disk."""
+        if self._header is not None and not self.read_only:
+            self._matrix.flush()
+            self._header.flush()
+    
+    def _index_metadata(self, index: int, metadata: Dict[str, Any]):
+        """Add one row to the entity, time and filter indexes that are built."""
         # Index by entity
-        if "entity" in metadata:
+        if self._entity_index is not None and "entity" in metadata:
             entity = metadata["entity"]
-            if entity not in self.entity_index:
-                self.entity_index[entity] = []
-            self.entity_index[entity].append(index)
+            if entity not in self._entity_index:
+                self._entity_index[entity] = []
+            self._entity_index[entity].append(index)
         
         # Index by time
-        if "valid_from" in metadata:
+        if self._time_index is not None and "valid_from" in metadata:
             time_key = self._time_key(metadata["valid_from"])
-            if time_key not in self.time_index:
-                self.time_index[time_key] = []
-            self.time_index[time_key].append(index)
+            if time_key not in self._time_index:
+                self._time_index[time_key] = []
+            self._time_index[time_key].append(index)
         
-        return index
+        # Keep any filter posting lists current
+        for key, postings in self._filter_index.items():
+            value = metadata.get(key)
+            if key in metadata and self._is_indexable(value):
+                postings.setdefault(value, []).append(index)
     
-    def search(self, query: str, limit: int = 5, 
-               filters: Dict[str, Any] = None) -> List[Dict]:
-        """Search for similar documents."""
-        query_embedding = self._embed(query)
-        
-        scores = []
-        for i, vec in enumerate(self.vectors):
-            score = np.dot(query_embedding, vec) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(vec) + 1e-8
+    def _rebuild_metadata_indexes(self):
+        """Build entity/time indexes from metadata (deferred after open)."""
+        self._entity_index = {}
+        self._time_index = {}
+        filter_index, self._filter_index = self._filter_index, {}
+        for i in range(self._count):
+            self._index_metadata(i, self.metadata[i])
+        self._filter_index = filter_index
+    
+    def _open_files(self, initial_capacity: int):
+        """Create or map the on-disk vector file and metadata log."""
+        if not self.read_only:
+            os.makedirs(self.path, exist_ok=True)
+        vector_path = os.path.join(self.path, "vectors.f32")
+        if not os.path.exists(vector_path):
+            if self.read_only:
+                raise FileNotFoundError(vector_path)
+            header = np.zeros(_HEADER_BYTES // 8, dtype=np.uint64)
+            header[:4] = [_VECTOR_MAGIC, _VECTOR_VERSION, self.dimension, 0]
+            with open(vector_path, "wb") as f:
+                f.write(header.tobytes())
+                f.truncate(_HEADER_BYTES + initial_capacity * self.dimension * 4)
+        
+        mode = "r" if self.read_only else "r+"
+        self._header = np.memmap(vector_path, dtype=np.uint64, mode=mode, shape=(_HEADER_BYTES // 8,))
+        if int(self._header[0]) != _VECTOR_MAGIC:
+            raise ValueError(f"Not a vector store file: {vector_path}")
+        if int(self._header[2]) != self.dimension:
+            raise ValueError(
+                f"Dimension mismatch: store has {int(self._header[2])}, requested {self.dimension}"
             )
+        self._inode = os.stat(vector_path).st_ino
+        self._check_model()
+        self._map_matrix()
+        self.metadata = MetadataLog(self.path, read_only=self.read_only)
+        self._count = min(int(self._header[3]), len(self.metadata))
+        self._load_tombstones()
+        if self._count:
+            # Defer index construction until first use so open stays O(1)
+            self._entity_index = None
+            self._time_index = None
+    
+    def _check_model(self):
+        """Record the embedder's model_id on first open; refuse a different one later."""
+        model_path = os.path.join(self.path, "model.json")
+        if os.path.exists(model_path):
+            with open(model_path, encoding="utf-8") as f:
+                recorded = json.load(f)["model_id"]
+            if recorded != self.embedder.model_id:
+                raise ValueError(
+                    f"Store was embedded with {recorded!r}; open it with that embedder, "
+                    f"not {self.embedder.model_id!r}"
+                )
+        elif not self.read_only:
+            with open(model_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"model_id": self.embedder.model_id, "dimension": self.dimension}, f)
+            os.replace(model_path + ".tmp", model_path)
+    
+    def _load_tombstones(self):
+        tombstones = os.path.join(self.path, "tombstones.u64")
+        if os.path.exists(tombstones):
+            removed = np.fromfile(tombstones, dtype=np.uint64)
+            if len(removed) != len(self._deleted):
+                self._deleted = set(removed.astype(np.int64).tolist())
+                self._deleted_mask = None
+    
+    def _map_matrix(self):
+        vector_path = os.path.join(self.path, "vectors.f32")
+        rows = (os.path.getsize(vector_path) - _HEADER_BYTES) // (self.dimension * 4)
+        self._matrix = np.memmap(vector_path, dtype=np.float32, mode="r" if self.read_only else "r+",
+                                 offset=_HEADER_BYTES, shape=(rows, self.dimension))
+    
+    def _set_count(self, count: int):
+        self._count = count
+        if self._header is not None:
+            self._header[3] = count
+    
+    def search(self, query: str, limit: int = 5, 
+               filters: Dict[str, Any] = None,
+               exact: bool = False) -> List[Dict]:
+        """Search for similar documents.
+        
+        Uses the ANN index when configured, unless `exact` is set. Filtered
+        ANN searches over-fetch and fall back to exact search when too few
+        candidates survive the filter.
+        """
+        if self._count == 0 or limit <= 0:
+            return []
+        
+        query_embedding = self._normalize(self._embed(query))
+        mask = self._filter_mask(filters) if filters else None
+        if self._deleted:
+            mask = self._live_mask() if mask is None else mask & self._live_mask()
+        
+        hits = None
+        if self.index is not None and not exact:
+            if self._count > len(self.index):
+                self.index.add(self.vectors[len(self.index):])
+            fetch = limit if mask is None else limit * 4
+            ids, ann_scores = self.index.search(query_embedding, fetch)
+            if mask is not None:
+                keep = mask[ids]
+                ids, ann_scores = ids[keep], ann_scores[keep]
+            if len(ids) >= min(limit, self._count if mask is None else int(mask.sum())):
+                hits = list(zip(ids[:limit], ann_scores[:limit]))
+        
+        if hits is None:
+            scores = self.vectors @ query_embedding
             
             # Apply filters
-            if filters and not self._matches_filters(self.metadata[i], filters):
-                score = -1
+            if mask is not None:
+                scores = np.where(mask, scores, np.float32(-1))
             
-            scores.append((i, score))
-        
-        scores.sort(key=lambda x: x[1], reverse=True)
+            hits = [(idx, scores[idx]) for idx in self._top_k(scores, limit)]
         
         results = []
-        for idx, score in scores[:limit]:
+        for idx, score in hits:
+            score = float(score)
             if score > 0:
                 results.append({
-                    "index": idx,
+                    "index": int(idx),
                     "score": score,
                     "text": self.metadata[idx].get("text", ""),
                     "metadata": self.metadata[idx]
@@ -80,35 +1056,112 @@ class VectorStore:
                          limit: int = 5) -> List[Dict]:
         """Search within specific entity."""
         indices = self.entity_index.get(entity, [])
+        if self._deleted:
+            indices = [i for i in indices if i not in self._deleted]
         
         if not indices:
             return []
         
         if query:
-            query_embedding = self._embed(query)
-            scored = []
-            for i in indices:
-                vec = self.vectors[i]
-                score = np.dot(query_embedding, vec) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(vec) + 1e-8
-                )
-                scored.append((i, score, self.metadata[i]))
-            
-            scored.sort(key=lambda x: x[1], reverse=True)
-            return [{"index": i, "score": s, "metadata": m} 
-                    for i, s, m in scored[:limit]]
+            query_embedding = self._normalize(self._embed(query))
+            rows = np.asarray(indices, dtype=np.int64)
+            scores = self._matrix[rows] @ query_embedding
+            top = self._top_k(scores, limit)
+            return [{"index": int(rows[t]), "score": float(scores[t]),
+                     "metadata": self.metadata[rows[t]]}
+                    for t in top]
         else:
             return [{"index": i, "score": 1.0, "metadata": self.metadata[i]} 
                     for i in indices[:limit]]
     
+    def _reserve(self, capacity: int):
+        """Grow the embedding matrix geometrically (amortized O(1) appends)."""
+        if capacity <= self._matrix.shape[0]:
+            return
+        new_capacity = max(capacity, self._matrix.shape[0] * 2, 16)
+        if self._header is not None:
+            # Extend the file (sparse on most filesystems) and re-map it
+            self._matrix.flush()
+            vector_path = os.path.join(self.path, "vectors.f32")
+            with open(vector_path, "r+b") as f:
+                f.truncate(_HEADER_BYTES + new_capacity * self.dimension * 4)
+            self._map_matrix()
+            return
+        grown = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        grown[:self._count] = self._matrix[:self._count]
+        self._matrix = grown
+    
+    @staticmethod
+    def _normalize(vec: np.ndarray) -> np.ndarray:
+        """Return float32 unit vector (zero vectors stay zero)."""
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+    
+    @staticmethod
+    def _top_k(scores: np.ndarray, limit: int) -> np.ndarray:
+        """Indices of the `limit` highest scores, best first."""
+        if limit < len(scores):
+            candidates = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+    
+    @staticmethod
+    def _is_indexable(value: Any) -> bool:
+        try:
+            hash(value)
+        except TypeError:
+            return False
+        return True
+    
+    def _postings(self, key: str) -> Dict[Any, List[int]]:
+        """Posting lists for a metadata key, built on first use."""
+        if key not in self._filter_index:
+            postings: Dict[Any, List[int]] = {}
+            for i, meta in enumerate(self.metadata):
+                if key in meta and self._is_indexable(meta[key]):
+                    postings.setdefault(meta[key], []).append(i)
+            self._filter_index[key] = postings
+        return self._filter_index[key]
+    
+    def _filter_mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask of documents matching every filter."""
+        mask = np.ones(self._count, dtype=bool)
+        for key, value in filters.items():
+            values = value if isinstance(value, list) else [value]
+            if not all(self._is_indexable(v) for v in values):
+                # Unhashable filter values fall back to a metadata scan
+                mask &= np.fromiter(
+                    (self._matches_filters(m, {key: value}) for m in self.metadata),
+                    dtype=bool, count=self._count
+                )
+                continue
+            postings = self._postings(key)
+            key_mask = np.zeros(self._count, dtype=bool)
+            for v in values:
+                hits = postings.get(v)
+                if hits:
+                    key_mask[hits] = True
+            mask &= key_mask
+        return mask
+    
     def _embed(self, text: str) -> np.ndarray:
         """Generate embedding for text."""
-        # In production, use actual embedding model
-        np.random.seed(hash(text) % (2**32))
-        return np.random.randn(self.dimension)
+        return self.embedder.embed([text])[0]
+    
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed many texts at once (real models amortize per-call overhead)."""
+        return self.embedder.embed(texts)
     
     def _time_key(self, timestamp: Any) -> str:
         """Create time key for indexing."""
+        if isinstance(timestamp, str):
+            # Persisted metadata stores datetimes as ISO strings
+            try:
+                timestamp = datetime.fromisoformat(timestamp)
+            except ValueError:
+                pass
         if isinstance(timestamp, datetime):
             return timestamp.strftime("%Y-%m")
         return str(timestamp)
@@ -126,45 +1179,531 @@ class VectorStore:
         return True
 
 
-class PropertyGraph:
-    """Simple property graph storage."""
+# Graph Storage
+#
+# Nodes and edges are stored column-wise under dense integer ids: typed arrays
+# for endpoints, interned label/type codes, timestamps and flags, plus a
+# property list that holds None for the (common) empty case. String ids live
+# only in a node id table; generated edge ids are derived from the integer id
+# ("e<hex>"), so edges need no id table at all. `graph.nodes` / `graph.edges`
+# are read-only mapping views that build a fresh record on each access;
+# assigning into one raises TypeError. Properties change through
+# set_node_properties / set_edge_properties, which also log the update.
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_OPEN_END = 2**63 - 1  # valid_until of facts that are still valid
+
+# Edge flag bits
+_HAS_FROM = 1
+_HAS_UNTIL = 2
+_FROM_AWARE = 4
+_UNTIL_AWARE = 8
+_TEMPORAL = 16  # valid_from/valid_until were set on this edge
+_DEAD = 32
+
+
+def _epoch_us(value: Any) -> int:
+    """Microseconds since the Unix epoch (naive datetimes are taken as UTC)."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _iso_from_us(us: int, aware: bool) -> str:
+    value = _EPOCH + timedelta(microseconds=us)
+    return value.isoformat() if aware else value.replace(tzinfo=None).isoformat()
+
+
+class _Interner:
+    """Bidirectional table between strings (labels, edge types) and small int codes."""
+    
+    __slots__ = ("names", "codes")
     
     def __init__(self):
-        self.nodes: Dict[str, Dict] = {}
-        self.edges: Dict[str, Dict] = {}
-        self.node_index: Dict[str, List[str]] = {}  # label -> node_ids
-        self.edge_index: Dict[str, List[str]] = {}  # type -> edge_ids
+        self.names: List[str] = []
+        self.codes: Dict[str, int] = {}
+    
+    def code(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.names.append(sys.intern(name))
+            self.codes[self.names[code]] = code
+        return code
+
+
+class _Postings:
+    """Append-only int list with lazy deletion (compacted when half dead)."""
+    
+    __slots__ = ("items", "live")
+    
+    def __init__(self):
+        self.items = array("q")
+        self.live = 0
+    
+    def add(self, item: int):
+        self.items.append(item)
+        self.live += 1
+    
+    def discard(self, is_dead: Any):
+        self.live -= 1
+        if self.live * 2 < len(self.items):
+            self.items = array("q", (i for i in self.items if not is_dead(i)))
+
+
+class _GraphView(Mapping):
+    """Read-only id -> record view over a graph's node or edge columns.
+    
+    Records (and their properties) are returned as mapping proxies, so code
+    written against the old mutable dicts fails loudly instead of editing a
+    throwaway copy.
+    """
+    
+    def __init__(self, resolve: Any, materialize: Any, ids: Any, count: Any):
+        self._resolve = resolve
+        self._materialize = materialize
+        self._ids = ids
+        self._count = count
+    
+    def __getitem__(self, key: str) -> Dict:
+        i = self._resolve(key)
+        if i is None:
+            raise KeyError(key)
+        record = self._materialize(i)
+        record["properties"] = MappingProxyType(record["properties"])
+        return MappingProxyType(record)
+    
+    def __contains__(self, key: Any) -> bool:
+        return isinstance(key, str) and self._resolve(key) is not None
+    
+    def __iter__(self):
+        return self._ids()
+    
+    def __len__(self) -> int:
+        return self._count()
+
+
+class PropertyGraph:
+    """Simple property graph storage.
+    
+    Records are columnar under integer ids (see Graph Storage). Label, type and
+    adjacency indexes are int postings, so lookups are O(degree) and removal
+    is lazy. With `path`, every mutation is appended to a JSONL log that is
+    replayed on open; compact_log() rewrites it as one record per live node
+    and edge so open time tracks the graph, not its history.
+    """
     
-    def create_node(self, label: str, properties: Dict = None) -> str:
+    def __init__(self, path: Optional[str] = None, read_only: bool = False):
+        self._reset()
+        
+        self.nodes = _GraphView(self._node_int, self._node_dict, self._iter_node_ids,
+                                lambda: self._node_count)
+        self.edges = _GraphView(self._edge_int, self._edge_dict, self._iter_edge_ids,
+                                lambda: self._edge_count)
+        
+        self.path = path
+        self.read_only = read_only
+        self._log_file = None
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+        self._pending: Optional[List[bytes]] = None
+        self._seq = itertools.count()
+        if path is not None:
+            self.refresh()
+            if not read_only:
+                self._log_file = open(path, "ab")
+    
+    def _reset(self):
+        """Empty every column and index (before replaying a log from the start)."""
+        self.log_garbage = 0  # Removals logged since the last compact_log()
+        self._labels = _Interner()
+        self._types = _Interner()
+        
+        # Node columns
+        self._node_ids: List[Optional[str]] = []
+        self._node_lookup: Dict[str, int] = {}
+        self._node_label = array("i")
+        self._node_created = array("d")
+        self._node_props: List[Optional[Dict]] = []
+        self._node_count = 0
+        
+        # Edge columns
+        self._src = array("q")
+        self._dst = array("q")
+        self._type = array("i")
+        self._edge_created = array("d")
+        self._valid_from = array("q")
+        self._valid_until = array("q")
+        self._flags = array("B")
+        self._edge_props: List[Optional[Dict]] = []
+        self._edge_extra: Dict[int, Dict] = {}  # Rare extra top-level fields
+        self._edge_alias: Dict[str, int] = {}  # Non-generated edge ids
+        self._edge_names: Dict[int, str] = {}
+        self._edge_count = 0
+        
+        # Indexes
+        self._label_index: List[_Postings] = []  # label code -> node ids
+        self._type_index: List[_Postings] = []  # type code -> edge ids
+        self._out: List[Optional[array]] = []  # node -> outgoing edge ids
+        self._in: List[Optional[array]] = []  # node -> incoming edge ids
+    
+    def refresh(self):
+        """Replay log records appended since the last read."""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._log_inode:
+                if self._log_inode is not None:
+                    # The writer compacted the log: replay the new file from scratch
+                    self._reset()
+                    self._log_offset = 0
+                self._log_inode = inode
+            f.seek(self._log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial trailing record from an interrupted writer
+                self._replay(json.loads(line))
+                self._log_offset += len(line)
+    
+    def close(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+    
+    def compact_log(self):
+        """Rewrite the log as the current graph, dropping removals and overwritten updates.
+        
+        Edge ids are kept: runs of removed edges become "gap" records, so the
+        compacted log replays to the same ids. The new file is swapped in
+        atomically; readers notice on refresh() and replay it.
+        """
+        if self.read_only:
+            raise PermissionError("PropertyGraph opened read-only")
+        if self.path is None:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            def write(record: Dict):
+                f.write((json.dumps(record, default=_json_default) + "\n").encode("utf-8"))
+            
+            for i, node_id in enumerate(self._node_ids):
+                if node_id is not None:
+                    write({"op": "node", **self._node_dict(i)})
+            gap = 0
+            for i in range(len(self._flags)):
+                if self._flags[i] & _DEAD:
+                    gap += 1
+                    continue
+                if gap:
+                    write({"op": "gap", "edges": gap})
+                    gap = 0
+                edge = self._edge_dict(i)
+                write({"op": "edge", **{k: edge[k] for k in
+                                       ("id", "source", "target", "type", "properties", "created_at")}})
+                fields = dict(self._edge_extra.get(i) or {})
+                if self._flags[i] & _TEMPORAL:
+                    fields["valid_from"] = edge["valid_from"]
+                    fields["valid_until"] = edge["valid_until"]
+                if fields:
+                    write({"op": "set", "edge": edge["id"], "fields": fields})
+            if gap:
+                write({"op": "gap", "edges": gap})
+        
+        self.close()
+        os.replace(tmp, self.path)
+        if self._pending is not None:
+            self._pending.clear()  # Already part of the rewritten log
+        self._log_file = open(self.path, "ab")
+        self._log_offset = self._log_file.tell()
+        self._log_inode = os.fstat(self._log_file.fileno()).st_ino
+        self.log_garbage = 0
+    
+    @contextmanager
+    def batch(self):
+        """Buffer log records and write them in one append on exit."""
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = []
+        try:
+            yield self
+        finally:
+            pending, self._pending = self._pending, None
+            self._write_log(b"".join(pending))
+    
+    def _append_log(self, record: Dict):
+        if self.read_only:
+            raise PermissionError("PropertyGraph opened read-only")
+        if self._log_file is not None:
+            line = (json.dumps(record, default=_json_default) + "\n").encode("utf-8")
+            if self._pending is not None:
+                self._pending.append(line)
+            else:
+                self._write_log(line)
+    
+    def _write_log(self, data: bytes):
+        if data and self._log_file is not None:
+            self._log_file.write(data)
+            self._log_file.flush()
+            self._log_offset += len(data)
+    
+    def _replay(self, record: Dict):
+        op = record.pop("op")
+        if op == "node":
+            self._insert_node(record)
+        elif op == "edge":
+            self._insert_edge(record)
+        elif op == "set":
+            self._apply_edge_fields(self._edge_int(record["edge"]), record["fields"])
+        elif op == "remove_edge":
+            self._discard_edge(self._edge_int(record["edge"]))
+        elif op == "remove_node":
+            self._discard_node(self._node_lookup[record["node"]])
+        elif op == "gap":
+            self._insert_gap(record["edges"])
+        elif op == "node_props":
+            self._update_props(self._node_props, self._node_lookup[record["node"]],
+                               record["properties"])
+        elif op == "edge_props":
+            self._update_props(self._edge_props, self._edge_int(record["edge"]),
+                               record["properties"])
+    
+    # Id resolution and materialization
+    
+    def _node_int(self, node_id: str) -> Optional[int]:
+        return self._node_lookup.get(node_id)
+    
+    def _edge_int(self, edge_id: str) -> Optional[int]:
+        i = self._edge_alias.get(edge_id)
+        if i is None and edge_id[:1] == "e":
+            try:
+                i = int(edge_id[1:], 16)
+            except ValueError:
+                return None
+            # Only the canonical spelling resolves: "e-1", "eA", "e01" and
+            # "e_1" all parse but must not alias a real edge.
+            if (i < 0 or i >= len(self._flags) or edge_id != f"e{i:x}"
+                    or i in self._edge_names):
+                return None
+        if i is None or self._flags[i] & _DEAD:
+            return None
+        return i
+    
+    def _edge_name(self, i: int) -> str:
+        name = self._edge_names.get(i)
+        return name if name is not None else f"e{i:x}"
+    
+    def _iter_node_ids(self):
+        return (node_id for node_id in self._node_ids if node_id is not None)
+    
+    def _iter_edge_ids(self):
+        return (self._edge_name(i) for i in range(len(self._flags)) if not self._flags[i] & _DEAD)
+    
+    def _node_dict(self, i: int) -> Dict:
+        props = self._node_props[i]
+        return {
+            "id": self._node_ids[i],
+            "label": self._labels.names[self._node_label[i]],
+            "properties": dict(props) if props is not None else {},
+            "created_at": self._node_created[i]
+        }
+    
+    def _edge_dict(self, i: int) -> Dict:
+        props = self._edge_props[i]
+        edge = {
+            "id": self._edge_name(i),
+            "source": self._node_ids[self._src[i]],
+            "target": self._node_ids[self._dst[i]],
+            "type": self._types.names[self._type[i]],
+            "properties": dict(props) if props is not None else {},
+            "created_at": self._edge_created[i]
+        }
+        flags = self._flags[i]
+        if flags & _TEMPORAL:
+            edge["valid_from"] = (_iso_from_us(self._valid_from[i], bool(flags & _FROM_AWARE))
+                                  if flags & _HAS_FROM else None)
+            edge["valid_until"] = (_iso_from_us(self._valid_until[i], bool(flags & _UNTIL_AWARE))
+                                   if flags & _HAS_UNTIL else None)
+            edge["valid_from_ts"] = self._valid_from[i]
+            edge["valid_until_ts"] = self._valid_until[i] if flags & _HAS_UNTIL else None
+        extra = self._edge_extra.get(i)
+        if extra:
+            edge.update(extra)
+        return edge
+    
+    # Mutation primitives (ints in, ints out)
+    
+    def _insert_node(self, node: Dict) -> int:
+        i = len(self._node_ids)
+        label = self._labels.code(node["label"])
+        self._node_ids.append(node["id"])
+        self._node_lookup[node["id"]] = i
+        self._node_label.append(label)
+        self._node_created.append(node["created_at"])
+        self._node_props.append(node["properties"] or None)
+        self._out.append(None)
+        self._in.append(None)
+        if label == len(self._label_index):
+            self._label_index.append(_Postings())
+        self._label_index[label].add(i)
+        self._node_count += 1
+        return i
+    
+    def _insert_edge(self, edge: Dict) -> int:
+        i = len(self._flags)
+        if edge["id"] != f"e{i:x}":
+            self._edge_alias[edge["id"]] = i
+            self._edge_names[i] = edge["id"]
+        src = self._node_lookup[edge["source"]]
+        dst = self._node_lookup[edge["target"]]
+        rel_type = self._types.code(edge["type"])
+        self._src.append(src)
+        self._dst.append(dst)
+        self._type.append(rel_type)
+        self._edge_created.append(edge["created_at"])
+        self._valid_from.append(0)
+        self._valid_until.append(_OPEN_END)
+        self._flags.append(0)
+        self._edge_props.append(edge["properties"] or None)
+        for adjacency, node in ((self._out, src), (self._in, dst)):
+            if adjacency[node] is None:
+                adjacency[node] = array("q")
+            adjacency[node].append(i)
+        if rel_type == len(self._type_index):
+            self._type_index.append(_Postings())
+        self._type_index[rel_type].add(i)
+        self._edge_count += 1
+        return i
+    
+    def _insert_gap(self, count: int):
+        """Reserve `count` dead edge slots so later generated ids stay stable."""
+        self._src.extend([-1] * count)
+        self._dst.extend([-1] * count)
+        self._type.extend([-1] * count)
+        self._edge_created.extend([0.0] * count)
+        self._valid_from.extend([0] * count)
+        self._valid_until.extend([_OPEN_END] * count)
+        self._flags.extend([_DEAD] * count)
+        self._edge_props.extend([None] * count)
+    
+    def _discard_edge(self, i: int):
+        self._flags[i] |= _DEAD
+        self._out[self._src[i]].remove(i)
+        self._in[self._dst[i]].remove(i)
+        self._type_index[self._type[i]].discard(lambda e: self._flags[e] & _DEAD)
+        self._edge_props[i] = None
+        self._edge_extra.pop(i, None)
+        self._edge_count -= 1
+        self.log_garbage += 1
+    
+    def _discard_node(self, i: int):
+        for e in list(self._out[i] or ()) + list(self._in[i] or ()):
+            if not self._flags[e] & _DEAD:  # Self-loops appear in both lists
+                self._discard_edge(e)
+        del self._node_lookup[self._node_ids[i]]
+        self._node_ids[i] = None
+        self._node_props[i] = None
+        self._out[i] = self._in[i] = None
+        self._label_index[self._node_label[i]].discard(lambda n: self._node_ids[n] is None)
+        self._node_count -= 1
+        self.log_garbage += 1
+    
+    def _apply_edge_fields(self, i: int, fields: Dict):
+        flags = self._flags[i]
+        for key, value in fields.items():
+            if key in ("valid_from", "valid_until"):
+                has, aware = ((_HAS_FROM, _FROM_AWARE) if key == "valid_from"
+                              else (_HAS_UNTIL, _UNTIL_AWARE))
+                column = self._valid_from if key == "valid_from" else self._valid_until
+                flags = (flags | _TEMPORAL) & ~(has | aware)
+                if value is None:
+                    column[i] = 0 if key == "valid_from" else _OPEN_END
+                else:
+                    parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+                    column[i] = _epoch_us(parsed)
+                    flags |= has | (aware if parsed.tzinfo is not None else 0)
+            else:
+                self._edge_extra.setdefault(i, {})[key] = value
+        self._flags[i] = flags
+    
+    def remove_edge(self, edge_id: str):
+        """Remove a relationship."""
+        i = self._edge_int(edge_id)
+        if i is None:
+            raise ValueError(f"Unknown edge: {edge_id}")
+        self._append_log({"op": "remove_edge", "edge": edge_id})
+        self._discard_edge(i)
+    
+    def remove_node(self, node_id: str):
+        """Remove a node and every relationship touching it."""
+        if node_id not in self._node_lookup:
+            raise ValueError(f"Unknown node: {node_id}")
+        self._append_log({"op": "remove_node", "node": node_id})
+        self._discard_node(self._node_lookup[node_id])
+    
+    @staticmethod
+    def _update_props(column: List[Optional[Dict]], i: int, properties: Dict):
+        if column[i] is None:
+            column[i] = {}
+        column[i].update(properties)
+    
+    def set_node_properties(self, node_id: str, properties: Dict):
+        """Merge `properties` into a node's properties and log the change."""
+        i = self._node_lookup.get(node_id)
+        if i is None:
+            raise ValueError(f"Unknown node: {node_id}")
+        self._append_log({"op": "node_props", "node": node_id, "properties": properties})
+        self._update_props(self._node_props, i, properties)
+    
+    def set_edge_properties(self, edge_id: str, properties: Dict):
+        """Merge `properties` into an edge's properties and log the change."""
+        i = self._edge_int(edge_id)
+        if i is None:
+            raise ValueError(f"Unknown edge: {edge_id}")
+        self._append_log({"op": "edge_props", "edge": edge_id, "properties": properties})
+        self._update_props(self._edge_props, i, properties)
+    
+    def _set_edge_fields(self, edge_id: str, **fields):
+        """Update top-level edge fields and log the change."""
+        i = self._edge_int(edge_id)
+        if i is None:
+            raise ValueError(f"Unknown edge: {edge_id}")
+        self._append_log({"op": "set", "edge": edge_id, "fields": fields})
+        self._apply_edge_fields(i, fields)
+    
+    def create_node(self, label: str, properties: Dict = None,
+                    node_id: Optional[str] = None) -> str:
         """Create node with label and properties."""
-        import time
-        node_id = hashlib.md5(f"{label}{time.time()}".encode()).hexdigest()[:16]
+        if node_id is None:
+            node_id = hashlib.md5(f"{label}{time.time()}{next(self._seq)}".encode()).hexdigest()[:16]
+        if node_id in self._node_lookup:
+            raise ValueError(f"Node already exists: {node_id}")
         
-        self.nodes[node_id] = {
+        node = {
             "id": node_id,
             "label": label,
             "properties": properties or {},
             "created_at": time.time()
         }
-        
-        if label not in self.node_index:
-            self.node_index[label] = []
-        self.node_index[label].append(node_id)
+        self._append_log({"op": "node", **node})
+        self._insert_node(node)
         
         return node_id
     
-    def create_relationship(self, source_id: str, rel_type: str, 
+    def create_relationship(self, source_id: str, rel_type: str,
                            target_id: str, properties: Dict = None) -> str:
         """Create directed relationship between nodes."""
-        import time
-        if source_id not in self.nodes:
+        if source_id not in self._node_lookup:
             raise ValueError(f"Unknown source node: {source_id}")
-        if target_id not in self.nodes:
+        if target_id not in self._node_lookup:
             raise ValueError(f"Unknown target node: {target_id}")
         
-        edge_id = hashlib.md5(f"{source_id}{rel_type}{target_id}{time.time()}".encode()).hexdigest()[:16]
+        edge_id = f"e{len(self._flags):x}"
         
-        self.edges[edge_id] = {
+        edge = {
             "id": edge_id,
             "source": source_id,
             "target": target_id,
@@ -172,76 +1711,585 @@ class PropertyGraph:
             "properties": properties or {},
             "created_at": time.time()
         }
-        
-        if rel_type not in self.edge_index:
-            self.edge_index[rel_type] = []
-        self.edge_index[rel_type].append(edge_id)
+        self._append_log({"op": "edge", **edge})
+        self._insert_edge(edge)
         
         return edge_id
     
     def query(self, pattern: Dict) -> List[Dict]:
-        """Query graph with simple pattern matching."""
-        results = []
+        """Query graph with simple pattern matching.
         
-        # Match by edge type
-        if "type" in pattern:
-            edge_ids = self.edge_index.get(pattern["type"], [])
-            for eid in edge_ids:
-                edge = self.edges[eid]
-                source = self.nodes.get(edge["source"], {})
-                target = self.nodes.get(edge["target"], {})
-                
-                # Match source label
-                if "source_label" in pattern:
-                    if source.get("label") != pattern["source_label"]:
-                        continue
-                
-                # Match target label
-                if "target_label" in pattern:
-                    if target.get("label") != pattern["target_label"]:
-                        continue
-                
-                results.append({
-                    "source": source,
-                    "edge": edge,
-                    "target": target
-                })
+        {"type", "source_label", "target_label"} matches single edges as
+        {"source", "edge", "target"}; {"path": [...], "limit": n} runs a
+        multi-hop pattern through `match`.
+        """
+        if "path" in pattern:
+            return list(self.match(pattern["path"], pattern.get("limit")))
         
-        return results
+        # Match by edge type
+        if "type" not in pattern:
+            return []
+        source_step = {"label": pattern["source_label"]} if "source_label" in pattern else {}
+        target_step = {"label": pattern["target_label"]} if "target_label" in pattern else {}
+        return [
+            {"source": m["nodes"][0], "edge": m["edges"][0], "target": m["nodes"][1]}
+            for m in self.match([source_step, {"type": pattern["type"]}, target_step])
+        ]
     
     def get_node(self, node_id: str) -> Optional[Dict]:
         """Get node by ID."""
-        return self.nodes.get(node_id)
+        i = self._node_lookup.get(node_id)
+        return self._node_dict(i) if i is not None else None
     
-    def get_relationships(self, node_id: str, 
+    def get_relationships(self, node_id: str,
                           direction: str = "both") -> List[Dict]:
-        """Get relationships for a node."""
+        """Get relationships for a node (O(degree) via adjacency indexes)."""
         relationships = []
+        i = self._node_lookup.get(node_id)
+        if i is None:
+            return relationships
         
-        for edge in self.edges.values():
-            if direction in ["outgoing", "both"] and edge["source"] == node_id:
+        if direction in ["outgoing", "both"]:
+            for e in self._out[i] or ():
                 relationships.append({
-                    "edge": edge,
-                    "target": self.nodes.get(edge["target"]),
+                    "edge": self._edge_dict(e),
+                    "target": self._node_dict(self._dst[e]),
                     "direction": "outgoing"
                 })
-            if direction in ["incoming", "both"] and edge["target"] == node_id:
+        if direction in ["incoming", "both"]:
+            for e in self._in[i] or ():
                 relationships.append({
-                    "edge": edge,
-                    "source": self.nodes.get(edge["source"]),
+                    "edge": self._edge_dict(e),
+                    "source": self._node_dict(self._src[e]),
                     "direction": "incoming"
                 })
         
         return relationships
+    
+    @property
+    def node_index(self) -> Dict[str, List[str]]:
+        """Snapshot of label -> node ids (kept for callers of the old dict attribute)."""
+        index = {label: list(self.nodes_with_label(label)) for label in self._labels.names}
+        return {label: ids for label, ids in index.items() if ids}
+    
+    @property
+    def edge_index(self) -> Dict[str, List[str]]:
+        """Snapshot of type -> edge ids (kept for callers of the old dict attribute)."""
+        index = {rel_type: list(self.edges_of_type(rel_type)) for rel_type in self._types.names}
+        return {rel_type: ids for rel_type, ids in index.items() if ids}
+    
+    def nodes_with_label(self, label: str) -> Iterator[str]:
+        """Ids of nodes carrying `label`."""
+        code = self._labels.codes.get(label)
+        if code is not None:
+            for i in self._label_index[code].items:
+                if self._node_ids[i] is not None:
+                    yield self._node_ids[i]
+    
+    def edges_of_type(self, rel_type: str) -> Iterator[str]:
+        """Ids of edges of `rel_type`."""
+        for i in self._edge_ints_of_type(rel_type):
+            yield self._edge_name(i)
+    
+    def _edge_ints_of_type(self, rel_type: str) -> Iterator[int]:
+        code = self._types.codes.get(rel_type)
+        if code is not None:
+            for i in self._type_index[code].items:
+                if not self._flags[i] & _DEAD:
+                    yield i
+    
+    # Pattern queries
+    #
+    # A path alternates node and edge steps: [node, edge, node, edge, node, ...]
+    #   node step: {"id": ..., "label": ..., "where": {...}, "as": name}
+    #   edge step: {"type": str | [str], "direction": "out" | "in" | "both",
+    #               "where": {...}, "as": name}
+    # "where" values match property (or top-level field) values by equality,
+    # list membership, or a callable predicate. The planner anchors the match
+    # at the most selective step (node id, node label or edge type) and
+    # extends outwards along adjacency indexes; edges are not reused in a path.
+    
+    def match(self, path: List[Dict], limit: Optional[int] = None) -> Iterator[Dict]:
+        """Stream matches of a path pattern as {"nodes", "edges", <aliases>}."""
+        if len(path) % 2 == 0:
+            raise ValueError("Path must alternate node and edge steps, starting and ending with a node")
+        for i, step in enumerate(path):
+            if i % 2 and step.get("direction", "out") not in ("out", "in", "both"):
+                raise ValueError(f"Unknown direction: {step['direction']}")
+        steps = [self._compile_step(step, i % 2 == 1) for i, step in enumerate(path)]
+        matches = self._match_anchor(path, steps, self._plan(steps))
+        return itertools.islice(matches, limit) if limit is not None else matches
+    
+    def explain(self, path: List[Dict]) -> Dict[str, Any]:
+        """Report the anchor step the planner picks and its estimated cardinality."""
+        steps = [self._compile_step(step, i % 2 == 1) for i, step in enumerate(path)]
+        anchor = self._plan(steps)
+        return {"anchor": anchor, "estimate": self._estimate(steps[anchor])}
+    
+    def neighbourhood(self, node_id: str, hops: int = 2, types: Optional[List[str]] = None,
+                      direction: str = "both", limit: Optional[int] = None) -> Iterator[Dict]:
+        """Breadth-first nodes within `hops` of a node as {"node", "depth", "edge"}."""
+        start = self._node_lookup.get(node_id)
+        if start is None:
+            return
+        codes = None if types is None else {self._types.codes.get(t, -1) for t in types}
+        seen = {start}
+        frontier = [start]
+        emitted = 0
+        for depth in range(1, hops + 1):
+            next_frontier = []
+            for current in frontier:
+                for e, other in self._adjacent(current, direction):
+                    if codes is not None and self._type[e] not in codes:
+                        continue
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    next_frontier.append(other)
+                    yield {"node": self._node_dict(other), "depth": depth, "edge": self._edge_dict(e)}
+                    emitted += 1
+                    if limit is not None and emitted >= limit:
+                        return
+            frontier = next_frontier
+    
+    def _compile_step(self, step: Dict, is_edge: bool) -> Dict[str, Any]:
+        """Resolve a step's ids, labels and types to int codes (-1: matches nothing)."""
+        compiled: Dict[str, Any] = {"edge": is_edge, "where": step.get("where")}
+        if is_edge:
+            types = step.get("type")
+            if types is not None:
+                types = types if isinstance(types, list) else [types]
+                compiled["types"] = [self._types.codes[t] for t in types if t in self._types.codes]
+            compiled["direction"] = step.get("direction", "out")
+        else:
+            if "id" in step:
+                compiled["id"] = self._node_lookup.get(step["id"], -1)
+            if "label" in step:
+                compiled["label"] = self._labels.codes.get(step["label"], -1)
+        return compiled
+    
+    def _estimate(self, step: Dict) -> int:
+        if step["edge"]:
+            if "types" not in step:
+                return self._edge_count
+            return sum(self._type_index[c].live for c in step["types"])
+        if "id" in step:
+            return 1 if step["id"] >= 0 else 0
+        if "label" in step:
+            return self._label_index[step["label"]].live if step["label"] >= 0 else 0
+        return self._node_count
+    
+    def _plan(self, steps: List[Dict]) -> int:
+        """Index of the step with the smallest candidate set (nodes win ties)."""
+        return min(range(len(steps)), key=lambda i: (self._estimate(steps[i]), i % 2))
+    
+    @staticmethod
+    def _where(item: Dict, where: Optional[Dict]) -> bool:
+        if not where:
+            return True
+        properties = item.get("properties", {})
+        for key, expected in where.items():
+            if key in properties:
+                actual = properties[key]
+            elif key in item:
+                actual = item[key]
+            else:
+                return False
+            if callable(expected):
+                if not expected(actual):
+                    return False
+            elif isinstance(expected, list):
+                if actual not in expected:
+                    return False
+            elif actual != expected:
+                return False
+        return True
+    
+    def _node_ok(self, i: int, step: Dict) -> bool:
+        if self._node_ids[i] is None:
+            return False
+        if "id" in step and i != step["id"]:
+            return False
+        if "label" in step and self._node_label[i] != step["label"]:
+            return False
+        return not step["where"] or self._where(self._node_dict(i), step["where"])
+    
+    def _edge_ok(self, e: int, step: Dict) -> bool:
+        if "types" in step and self._type[e] not in step["types"]:
+            return False
+        return not step["where"] or self._where(self._edge_dict(e), step["where"])
+    
+    def _adjacent(self, i: int, direction: str):
+        """(edge, other node) int pairs leaving node `i` in `direction`."""
+        if direction in ("out", "both"):
+            for e in self._out[i] or ():
+                yield e, self._dst[e]
+        if direction in ("in", "both"):
+            for e in self._in[i] or ():
+                if direction == "both" and self._src[e] == self._dst[e]:
+                    continue  # Self-loop already yielded as outgoing
+                yield e, self._src[e]
+    
+    def _match_anchor(self, path: List[Dict], steps: List[Dict], anchor: int) -> Iterator[Dict]:
+        last = len(steps) // 2
+        nodes: List[int] = [-1] * (last + 1)
+        edges: List[int] = [-1] * last
+        step = steps[anchor]
+        
+        if not step["edge"]:
+            if "id" in step:
+                candidates = [step["id"]] if step["id"] >= 0 else []
+            elif "label" in step:
+                candidates = list(self._label_index[step["label"]].items) if step["label"] >= 0 else []
+            else:
+                candidates = [i for i, node_id in enumerate(self._node_ids) if node_id is not None]
+            k = anchor // 2
+            for i in candidates:
+                if self._node_ok(i, step):
+                    nodes[k] = i
+                    yield from self._extend(path, steps, nodes, edges, k, k)
+            return
+        
+        j = anchor // 2
+        if "types" in step:
+            candidates = [e for c in step["types"] for e in self._type_index[c].items]
+        else:
+            candidates = range(len(self._flags))
+        direction = step["direction"]
+        for e in candidates:
+            if self._flags[e] & _DEAD or not self._edge_ok(e, step):
+                continue
+            orientations = []
+            if direction in ("out", "both"):
+                orientations.append((self._src[e], self._dst[e]))
+            if direction in ("in", "both") and not (direction == "both" and self._src[e] == self._dst[e]):
+                orientations.append((self._dst[e], self._src[e]))
+            for left, right in orientations:
+                if self._node_ok(left, steps[2 * j]) and self._node_ok(right, steps[2 * j + 2]):
+                    nodes[j], nodes[j + 1] = left, right
+                    edges[j] = e
+                    yield from self._extend(path, steps, nodes, edges, j, j + 1)
+            edges[j] = -1
+    
+    def _extend(self, path: List[Dict], steps: List[Dict], nodes: List[int],
+                edges: List[int], lo: int, hi: int) -> Iterator[Dict]:
+        """Bind the remaining steps, rightwards first, then leftwards."""
+        last = len(edges)
+        if hi < last:
+            step = steps[2 * hi + 1]
+            for e, other in self._adjacent(nodes[hi], step["direction"]):
+                if e in edges:
+                    continue
+                if self._edge_ok(e, step) and self._node_ok(other, steps[2 * hi + 2]):
+                    edges[hi], nodes[hi + 1] = e, other
+                    yield from self._extend(path, steps, nodes, edges, lo, hi + 1)
+            edges[hi] = nodes[hi + 1] = -1
+            return
+        if lo > 0:
+            step = steps[2 * lo - 1]
+            # Walking the edge backwards flips its direction
+            direction = {"out": "in", "in": "out", "both": "both"}[step["direction"]]
+            for e, other in self._adjacent(nodes[lo], direction):
+                if e in edges:
+                    continue
+                if self._edge_ok(e, step) and self._node_ok(other, steps[2 * lo - 2]):
+                    edges[lo - 1], nodes[lo - 1] = e, other
+                    yield from self._extend(path, steps, nodes, edges, lo - 1, hi)
+            edges[lo - 1] = nodes[lo - 1] = -1
+            return
+        
+        result = {
+            "nodes": [self._node_dict(n) for n in nodes],
+            "edges": [self._edge_dict(e) for e in edges]
+        }
+        for i, step in enumerate(path):
+            if "as" in step:
+                result[step["as"]] = result["edges" if i % 2 else "nodes"][i // 2]
+        yield result
+
+
+# Temporal Indexing
+
+class IntervalIndex:
+    """Interval index over integer [start, end] ranges keyed by non-negative int ids.
+    
+    A centered interval tree whose nodes hold NumPy arrays sorted by start and
+    by end answers stabbing and overlap queries in O(log n + k) at ~32 bytes
+    per interval. Inserts land in a small buffer and replaced or removed keys
+    are masked out until the buffer outgrows ~sqrt(n) and the tree is rebuilt.
+    """
+    
+    def __init__(self):
+        self._tree: Optional[Tuple] = None
+        self._tree_size = 0
+        self._in_tree = np.zeros(0, dtype=bool)
+        self._pending: Dict[int, Tuple[int, int]] = {}
+        self._stale: set = set()  # Keys whose tree entry is outdated
+        self._count = 0
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def add(self, key: int, start: int, end: int):
+        """Insert or replace the interval for `key`."""
+        if self._contains(key):
+            self._drop(key)
+        self._pending[key] = (start, end)
+        self._count += 1
+        self._maybe_rebuild()
+    
+    def remove(self, key: int):
+        if self._contains(key):
+            self._drop(key)
+            self._maybe_rebuild()
+    
+    def stab(self, t: int) -> List[int]:
+        """Keys whose interval satisfies start <= t < end."""
+        parts = []
+        node = self._tree
+        while node is not None:
+            center, left, right, start_keys, starts, end_keys, ends = node
+            if t < center:
+                parts.append(start_keys[:np.searchsorted(starts, t, side="right")])
+                node = left
+            else:
+                parts.append(end_keys[np.searchsorted(ends, t, side="right"):])
+                node = right
+        return self._collect(parts, [k for k, (s, e) in self._pending.items() if s <= t < e])
+    
+    def overlap(self, lo: int, hi: int) -> List[int]:
+        """Keys whose interval satisfies start <= hi and end >= lo."""
+        parts = []
+        stack = [self._tree] if self._tree is not None else []
+        while stack:
+            center, left, right, start_keys, starts, end_keys, ends = stack.pop()
+            if hi < center:
+                parts.append(start_keys[:np.searchsorted(starts, hi, side="right")])
+                if left is not None:
+                    stack.append(left)
+            elif lo > center:
+                parts.append(end_keys[np.searchsorted(ends, lo, side="left"):])
+                if right is not None:
+                    stack.append(right)
+            else:
+                parts.append(end_keys[np.searchsorted(ends, lo, side="left"):])
+                stack.extend(n for n in (left, right) if n is not None)
+        return self._collect(parts, [k for k, (s, e) in self._pending.items() if s <= hi and e >= lo])
+    
+    def _contains(self, key: int) -> bool:
+        if key in self._pending:
+            return True
+        return key < len(self._in_tree) and self._in_tree[key] and key not in self._stale
+    
+    def _drop(self, key: int):
+        if self._pending.pop(key, None) is None:
+            self._stale.add(key)
+        self._count -= 1
+    
+    def _collect(self, parts: List[np.ndarray], pending: List[int]) -> List[int]:
+        keys = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        if self._stale and len(keys):
+            keys = keys[~np.isin(keys, np.fromiter(self._stale, dtype=np.int64))]
+        return keys.tolist() + pending
+    
+    def _maybe_rebuild(self):
+        if len(self._pending) + len(self._stale) > max(256, int(self._tree_size ** 0.5)):
+            self._rebuild()
+    
+    def _rebuild(self):
+        keys, starts, ends = self._tree_entries()
+        if self._stale:
+            keep = ~np.isin(keys, np.fromiter(self._stale, dtype=np.int64))
+            keys, starts, ends = keys[keep], starts[keep], ends[keep]
+        if self._pending:
+            keys = np.concatenate([keys, np.fromiter(self._pending, dtype=np.int64)])
+            pending = np.array(list(self._pending.values()), dtype=np.int64).reshape(-1, 2)
+            starts = np.concatenate([starts, pending[:, 0]])
+            ends = np.concatenate([ends, pending[:, 1]])
+        self._tree = self._build(keys, starts, ends)
+        self._tree_size = len(keys)
+        self._in_tree = np.zeros(int(keys.max()) + 1 if len(keys) else 0, dtype=bool)
+        self._in_tree[keys] = True
+        self._pending = {}
+        self._stale = set()
+    
+    def _tree_entries(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(keys, starts, ends) of every interval currently in the tree."""
+        keys, starts, ends = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        stack = [self._tree] if self._tree is not None else []
+        while stack:
+            _, left, right, start_keys, node_starts, end_keys, node_ends = stack.pop()
+            # Align the end-sorted arrays with the start-sorted ones by key
+            by_key_s = np.argsort(start_keys, kind="stable")
+            by_key_e = np.argsort(end_keys, kind="stable")
+            keys.append(start_keys[by_key_s])
+            starts.append(node_starts[by_key_s])
+            ends.append(node_ends[by_key_e])
+            stack.extend(n for n in (left, right) if n is not None)
+        return np.concatenate(keys), np.concatenate(starts), np.concatenate(ends)
+    
+    @classmethod
+    def _build(cls, keys: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Optional[Tuple]:
+        if not len(keys):
+            return None
+        center = int(np.partition(starts, len(starts) // 2)[len(starts) // 2])
+        # Inverted intervals (end < start) must not send the median left forever
+        left = (ends < center) & (starts < center)
+        right = starts > center
+        here = ~(left | right)
+        by_start = np.argsort(starts[here], kind="stable")
+        by_end = np.argsort(ends[here], kind="stable")
+        here_keys, here_starts, here_ends = keys[here], starts[here], ends[here]
+        return (
+            center,
+            cls._build(keys[left], starts[left], ends[left]),
+            cls._build(keys[right], starts[right], ends[right]),
+            here_keys[by_start], here_starts[by_start],
+            here_keys[by_end], here_ends[by_end],
+        )
 
 
 class TemporalKnowledgeGraph(PropertyGraph):
-    """Property graph with temporal validity for facts."""
+    """Property graph with temporal validity for facts.
+    
+    Validity is kept pre-parsed in the edge columns (epoch microseconds) and
+    indexed per edge type in an IntervalIndex, so point-in-time and range
+    queries are O(log n + k).
+    """
+    
+    def _reset(self):
+        super()._reset()
+        self.interval_index: Dict[str, IntervalIndex] = {}  # type -> validity intervals
+    
+    def _insert_edge(self, edge: Dict) -> int:
+        i = super()._insert_edge(edge)
+        self._index_validity(i)
+        return i
+    
+    def _discard_edge(self, i: int):
+        self.interval_index[self._types.names[self._type[i]]].remove(i)
+        super()._discard_edge(i)
+    
+    def _apply_edge_fields(self, i: int, fields: Dict):
+        super()._apply_edge_fields(i, fields)
+        if "valid_from" in fields or "valid_until" in fields:
+            self._index_validity(i)
+    
+    def _index_validity(self, i: int):
+        # Edges without validity are treated as valid from the epoch onwards
+        rel_type = self._types.names[self._type[i]]
+        self.interval_index.setdefault(rel_type, IntervalIndex()).add(
+            i, self._valid_from[i], self._valid_until[i]
+        )
+    
+    def _temporal_candidates(self, query: Dict, edge_ints: Optional[List[int]],
+                             keep: Any) -> List[Dict]:
+        """Base query results restricted to edges from the interval index.
+        
+        `edge_ints` is None when the query has no single edge type to index on;
+        the base results are then filtered by `keep(edge)` on the parsed stamps.
+        """
+        if "path" in query:
+            matches = (r for r in self.match(query["path"])
+                       if all(keep(self._edge_int(e["id"])) for e in r["edges"]))
+            return list(itertools.islice(matches, query.get("limit")))
+        if edge_ints is None:
+            return [self._with_validity(r) for r in self.query(query)
+                    if keep(self._edge_int(r["edge"]["id"]))]
+        source_label = self._labels.codes.get(query["source_label"], -1) if "source_label" in query else None
+        target_label = self._labels.codes.get(query["target_label"], -1) if "target_label" in query else None
+        results = []
+        for e in sorted(edge_ints):
+            if source_label is not None and self._node_label[self._src[e]] != source_label:
+                continue
+            if target_label is not None and self._node_label[self._dst[e]] != target_label:
+                continue
+            results.append(self._with_validity({
+                "source": self._node_dict(self._src[e]),
+                "edge": self._edge_dict(e),
+                "target": self._node_dict(self._dst[e])
+            }))
+        return results
+    
+    def _indexable(self, query: Dict) -> bool:
+        return "path" not in query and isinstance(query.get("type"), str)
+    
+    @staticmethod
+    def _with_validity(result: Dict) -> Dict:
+        edge = result["edge"]
+        return {
+            **result,
+            "valid_from": datetime.fromisoformat(edge.get("valid_from") or "1970-01-01"),
+            "valid_until": edge.get("valid_until")
+        }
+    
+    def close_superseded(self, node_id: str,
+                         functional_types: Any = ()) -> Tuple[int, List[Tuple[str, str]]]:
+        """Tidy a node's open outgoing facts; returns (closed, re-assertions).
+        
+        For `functional_types` (one current target per source), each open
+        edge is closed when a later one begins. Re-assertions of an open edge
+        (same type, target and properties) are left in place and returned as
+        (edge id, id of the earliest edge it repeats) pairs, for the caller
+        to archive and remove.
+        """
+        i = self._node_lookup.get(node_id)
+        if i is None:
+            return 0, []
+        groups: Dict[int, List[int]] = {}
+        for e in self._out[i] or ():
+            flags = self._flags[e]
+            if flags & _TEMPORAL and not flags & _HAS_UNTIL:
+                groups.setdefault(self._type[e], []).append(e)
+        functional = {self._types.codes[t] for t in functional_types if t in self._types.codes}
+        
+        closed = 0
+        repeats = []
+        for code, edges in groups.items():
+            if len(edges) < 2:
+                continue
+            edges.sort(key=lambda e: (self._valid_from[e], e))
+            by_target: Dict[int, List[int]] = {}
+            current = []
+            for e in edges:
+                fields = (self._edge_props[e] or {}, self._edge_extra.get(e, {}))
+                kept = by_target.setdefault(self._dst[e], [])
+                original = next(
+                    (k for k in kept
+                     if (self._edge_props[k] or {}, self._edge_extra.get(k, {})) == fields),
+                    None
+                )
+                if original is not None:
+                    repeats.append((self._edge_name(e), self._edge_name(original)))
+                else:
+                    kept.append(e)
+                    current.append(e)
+            if code in functional:
+                for older, newer in zip(current, current[1:]):
+                    until = _iso_from_us(self._valid_from[newer], bool(self._flags[newer] & _FROM_AWARE))
+                    self._set_edge_fields(self._edge_name(older), valid_until=until)
+                    closed += 1
+        return closed, repeats
+    
+    def expired_edges(self, before: datetime, cursor: int = 0,
+                      limit: int = 1024) -> Tuple[List[str], Optional[int]]:
+        """Ids of edges whose validity ended by `before`, scanning `limit` slots from `cursor`.
+        
+        Returns the ids and the next cursor (None once every slot was scanned).
+        """
+        cutoff = _epoch_us(before)
+        stop = min(cursor + limit, len(self._flags))
+        expired = [
+            self._edge_name(e) for e in range(cursor, stop)
+            if self._flags[e] & _HAS_UNTIL and not self._flags[e] & _DEAD
+            and self._valid_until[e] <= cutoff
+        ]
+        return expired, (stop if stop < len(self._flags) else None)
     
     def create_temporal_relationship(
-        self, 
-        source_id: str, 
-        rel_type: str, 
+        self,
+        source_id: str,
+        rel_type: str,
         target_id: str,
         valid_from: datetime,
         valid_until: Optional[datetime] = None,
@@ -253,71 +2301,86 @@ class TemporalKnowledgeGraph(PropertyGraph):
         )
         
         # Add temporal properties
-        self.edges[edge_id]["valid_from"] = valid_from.isoformat()
-        self.edges[edge_id]["valid_until"] = (
-            valid_until.isoformat() if valid_until else None
+        self._set_edge_fields(
+            edge_id,
+            valid_from=valid_from.isoformat(),
+            valid_until=valid_until.isoformat() if valid_until else None
         )
         
         return edge_id
     
     def query_at_time(self, query: Dict, query_time: datetime) -> List[Dict]:
         """Query graph state at specific time."""
-        results = []
-        
-        # Get base query results
-        base_results = self.query(query)
+        t = _epoch_us(query_time)
+        edge_ints = None
+        if self._indexable(query):
+            index = self.interval_index.get(query["type"])
+            edge_ints = index.stab(t) if index is not None else []
         
-        for result in base_results:
-            edge = result["edge"]
-            valid_from = datetime.fromisoformat(edge.get("valid_from", "1970-01-01"))
-            valid_until = edge.get("valid_until")
-            
-            # Check temporal validity
-            if valid_from <= query_time:
-                if valid_until is None or datetime.fromisoformat(valid_until) > query_time:
-                    results.append({
-                        **result,
-                        "valid_from": valid_from,
-                        "valid_until": valid_until
-                    })
+        def valid(e: int) -> bool:
+            return self._valid_from[e] <= t < self._valid_until[e]
         
-        return results
+        return self._temporal_candidates(query, edge_ints, valid)
     
-    def query_time_range(self, query: Dict, 
-                         start_time: datetime, 
+    def query_time_range(self, query: Dict,
+                         start_time: datetime,
                          end_time: datetime) -> List[Dict]:
         """Query facts valid during time range."""
-        results = []
+        lo, hi = _epoch_us(start_time), _epoch_us(end_time)
+        edge_ints = None
+        if self._indexable(query):
+            index = self.interval_index.get(query["type"])
+            edge_ints = index.overlap(lo, hi) if index is not None else []
         
-        base_results = self.query(query)
+        def overlaps(e: int) -> bool:
+            return self._valid_until[e] >= lo and self._valid_from[e] <= hi
         
-        for result in base_results:
-            edge = result["edge"]
-            valid_from = datetime.fromisoformat(edge.get("valid_from", "1970-01-01"))
-            valid_until = edge.get("valid_until")
-            
-            # Check if overlaps with query range
-            until_dt = datetime.fromisoformat(valid_until) if valid_until else datetime.max
-            
-            if until_dt >= start_time and valid_from <= end_time:
-                results.append({
-                    **result,
-                    "valid_from": valid_from,
-                    "valid_until": valid_until
-                })
-        
-        return results
+        return self._temporal_candidates(query, edge_ints, overlaps)
 
 
 # Memory System Integration
 
 class IntegratedMemorySystem:
-    """Integrated memory system combining vector store and graph."""
+    """Integrated memory system combining vector store and graph.
     
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.graph = TemporalKnowledgeGraph()
+    With `path`, vectors live in `path/vectors/`, the graph log in
+    `path/graph.jsonl` and the embedding cache in `path/embeddings.sqlite`,
+    so a restart reopens memory without re-embedding. Reopen (read-only
+    included) with the embedder the store was written with; any other
+    model_id raises ValueError.
+    """
+    
+    def __init__(self, path: Optional[str] = None, read_only: bool = False,
+                 dimension: int = 768, index: Any = None, embedder: Any = None):
+        self.path = path
+        if path is None:
+            self.vector_store = VectorStore(dimension, index=index, embedder=embedder)
+            self.graph = TemporalKnowledgeGraph()
+        else:
+            vector_path = os.path.join(path, "vectors")
+            if os.path.exists(os.path.join(vector_path, "vectors.f32")):
+                with open(os.path.join(vector_path, "vectors.f32"), "rb") as f:
+                    dimension = int(np.frombuffer(f.read(_HEADER_BYTES), dtype=np.uint64)[2])
+            elif not read_only:
+                os.makedirs(path, exist_ok=True)
+            if embedder is None and not read_only:
+                cache = EmbeddingCache(os.path.join(path, "embeddings.sqlite"))
+                embedder = CachedEmbedder(HashingEmbedder(dimension), cache)
+            self.vector_store = VectorStore(dimension, index=index, path=vector_path,
+                                            read_only=read_only, embedder=embedder)
+            self.graph = TemporalKnowledgeGraph(os.path.join(path, "graph.jsonl"), read_only=read_only)
         self.session_id: str = ""
+        self.archive: List[Dict] = []  # Cold storage when not persistent
+        self._consolidation: Dict[str, Any] = {"phase": "dedupe", "work": None, "cursor": 0,
+                                               "chunk": None}
+    
+    def refresh(self):
+        """Pick up writes from another process (readers only need this)."""
+        self.vector_store.refresh()
+        self.graph.refresh()
+    
+    def flush(self):
+        self.vector_store.flush()
     
     def start_session(self, session_id: str):
         """Start a new memory session."""
@@ -325,30 +2388,79 @@ class IntegratedMemorySystem:
     
     def store_fact(self, fact: str, entity: str, 
                    timestamp: datetime = None, 
-                   relationships: List[Dict] = None):
+                   relationships: List[Dict] = None,
+                   valid_until: datetime = None):
         """Store a fact with entity and relationships."""
         # Store in vector store
-        self.vector_store.add(fact, {
+        metadata = self._fact_metadata(fact, entity, timestamp, valid_until)
+        self.vector_store.add(fact, metadata)
+        
+        with self.graph.batch():
+            self._link_entity(entity, relationships, metadata)
+    
+    def store_facts(self, facts: List[Dict]) -> Dict[str, Any]:
+        """Store many facts in one batch.
+        
+        Each fact is a dict with "fact" and "entity", plus optional
+        "timestamp", "valid_until" and "relationships" (as for store_fact).
+        Returns ingestion stats including throughput in facts/sec.
+        """
+        start = time.perf_counter()
+        texts = [f["fact"] for f in facts]
+        metadatas = [
+            self._fact_metadata(f["fact"], f["entity"], f.get("timestamp"), f.get("valid_until"))
+            for f in facts
+        ]
+        indices = self.vector_store.add_batch(texts, metadatas)
+        
+        with self.graph.batch():
+            for f, metadata in zip(facts, metadatas):
+                self._link_entity(f["entity"], f.get("relationships"), metadata)
+        
+        seconds = time.perf_counter() - start
+        return {
+            "facts": len(facts),
+            "indices": indices,
+            "seconds": seconds,
+            "facts_per_sec": len(facts) / seconds if seconds > 0 else float("inf")
+        }
+    
+    def _fact_metadata(self, fact: str, entity: str, timestamp: Optional[datetime],
+                       valid_until: Optional[datetime] = None) -> Dict[str, Any]:
+        metadata = {
             "text": fact,
             "entity": entity,
             "valid_from": (timestamp or datetime.now()).isoformat(),
             "session_id": self.session_id
-        })
+        }
+        if valid_until is not None:
+            metadata["valid_until"] = valid_until.isoformat()
+        return metadata
+    
+    def _ensure_entity(self, entity: str):
+        # Entity nodes use the entity name as their id so lookups stay O(1)
+        if self.graph.get_node(entity) is None:
+            self.graph.create_node("Entity", {"id": entity, "name": entity}, node_id=entity)
+    
+    def _link_entity(self, entity: str, relationships: Optional[List[Dict]],
+                     metadata: Dict[str, Any]):
+        """Create the entity node (and relationship targets) if needed, then relationships.
         
-        # Create entity node if not exists
-        entity_node = self.graph.get_node(entity)
-        if not entity_node:
-            self.graph.create_node("Entity", {"id": entity, "name": entity})
-        
-        # Create relationships
-        if relationships:
-            for rel in relationships:
-                self.graph.create_relationship(
-                    entity,
-                    rel["type"],
-                    rel["target"],
-                    properties=rel.get("properties", {})
-                )
+        Relationships share the fact's validity period.
+        """
+        self._ensure_entity(entity)
+        valid_from = datetime.fromisoformat(metadata["valid_from"])
+        valid_until = metadata.get("valid_until")
+        for rel in relationships or []:
+            self._ensure_entity(rel["target"])
+            self.graph.create_temporal_relationship(
+                entity,
+                rel["type"],
+                rel["target"],
+                valid_from,
+                datetime.fromisoformat(valid_until) if valid_until else None,
+                properties=rel.get("properties", {})
+            )
     
     def retrieve_memories(self, query: str, 
                           entity_filter: str = None,
@@ -370,8 +2482,11 @@ class IntegratedMemorySystem:
         
         return results
     
-    def retrieve_entity_context(self, entity: str) -> Dict:
-        """Retrieve complete context for an entity."""
+    def retrieve_entity_context(self, entity: str, hops: int = 1) -> Dict:
+        """Retrieve complete context for an entity.
+        
+        With hops > 1, also includes the entity's multi-hop neighbourhood.
+        """
         # Get entity node
         entity_node = self.graph.get_node(entity)
         
@@ -381,16 +2496,352 @@ class IntegratedMemorySystem:
         # Get vector memories
         memories = self.vector_store.search_by_entity(entity, limit=10)
         
-        return {
+        context = {
             "entity": entity_node,
             "relationships": relationships,
             "memories": memories
         }
+        if hops > 1:
+            context["neighbourhood"] = list(self.graph.neighbourhood(entity, hops))
+        return context
+    
+    # Consolidation
+    #
+    # consolidate() runs one bounded slice of an incremental cycle and resumes
+    # where the previous call stopped. Phases, in order:
+    #   dedupe          merge near-duplicate facts of the same entity, session and
+    #                   validity period (earliest kept), one 512x512 block per step
+    #   supersede       archive re-asserted open edges; close superseded functional edges
+    #   archive_facts   move facts whose valid_until passed to cold storage
+    #   archive_edges   move edges whose validity ended to cold storage
+    #   compact         drop removed rows from the vector matrix and removal records
+    #                   from the graph log
+    # Removed facts and edges go to cold storage (`path/archive.jsonl`, or the
+    # in-memory `archive` list), so nothing is lost.
+    
+    _CONSOLIDATION_PHASES = ("dedupe", "supersede", "archive_facts", "archive_edges", "compact")
+    
+    def consolidate(self, max_seconds: float = 0.05, similarity_threshold: float = 0.98,
+                    now: Optional[datetime] = None, archive_after: timedelta = timedelta(0),
+                    functional_types: Any = (), compact_ratio: float = 0.1) -> Dict[str, Any]:
+        """Consolidate memories and remove outdated information, within `max_seconds`.
+        
+        Returns this slice's counts, the phase it stopped in, and whether a
+        full cycle completed.
+        """
+        started = time.perf_counter()
+        deadline = started + max_seconds
+        cutoff = (now or datetime.now()) - archive_after
+        state = self._consolidation
+        stats = {"merged": 0, "closed": 0, "removed_edges": 0, "archived_facts": 0,
+                 "archived_edges": 0, "compacted_rows": 0, "compacted_log_records": 0,
+                 "cycle_complete": False}
+        
+        # Always make progress, even with a tiny budget
+        while True:
+            phase = state["phase"]
+            if state["work"] is None:
+                state["work"] = self._consolidation_work(phase)
+                state["cursor"] = 0
+            
+            if phase == "dedupe":
+                done = self._dedupe_step(state, similarity_threshold, stats)
+            elif phase == "supersede":
+                done = self._supersede_step(state, functional_types, stats)
+            elif phase == "archive_facts":
+                done = self._archive_facts_step(state, cutoff, stats)
+            elif phase == "archive_edges":
+                done = self._archive_edges_step(state, cutoff, stats)
+            else:
+                store = self.vector_store
+                if store.deleted_count and store.deleted_count >= compact_ratio * len(store):
+                    stats["compacted_rows"] += store.deleted_count
+                    store.compact()
+                graph = self.graph
+                live = len(graph.nodes) + len(graph.edges)
+                if graph.path is not None and graph.log_garbage and graph.log_garbage >= compact_ratio * live:
+                    stats["compacted_log_records"] += graph.log_garbage
+                    graph.compact_log()
+                done = True
+            
+            if done:
+                position = self._CONSOLIDATION_PHASES.index(phase) + 1
+                state["phase"] = self._CONSOLIDATION_PHASES[position % len(self._CONSOLIDATION_PHASES)]
+                state["work"] = None
+                if position == len(self._CONSOLIDATION_PHASES):
+                    stats["cycle_complete"] = True
+                    break
+            if time.perf_counter() >= deadline:
+                break
+        
+        stats["phase"] = state["phase"]
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+    
+    def _consolidation_work(self, phase: str) -> Any:
+        """Snapshot of the items a phase walks (new items wait for the next cycle)."""
+        if phase == "dedupe":
+            return list(self.vector_store.entity_index)
+        if phase == "supersede":
+            return list(self.graph.nodes)
+        return None
+    
+    def _dedupe_step(self, state: Dict, threshold: float, stats: Dict) -> bool:
+        store = self.vector_store
+        chunk = state["chunk"]
+        if chunk is None or not chunk["groups"]:
+            entities = state["work"]
+            if state["cursor"] >= len(entities):
+                return True
+            entity = entities[state["cursor"]]
+            state["cursor"] += 1
+            # Only facts from the same session with the same validity may merge
+            groups: Dict[Tuple, List[int]] = {}
+            for r in store.entity_index.get(entity, []):
+                if not store.is_deleted(r):
+                    metadata = store.metadata[r]
+                    key = (metadata.get("session_id"), metadata.get("valid_from"),
+                           metadata.get("valid_until"))
+                    groups.setdefault(key, []).append(r)
+            state["chunk"] = {
+                "groups": [np.asarray(rows, dtype=np.int64) for rows in groups.values() if len(rows) > 1],
+                "row": 1, "col": 0, "survivors": None
+            }
+            return False
+        
+        # Compare one block of rows with one block of the facts stored before them
+        rows = chunk["groups"][-1]
+        start, col = chunk["row"], chunk["col"]
+        block = rows[start:start + 512]
+        last = start + len(block) - 1
+        stop = min(col + 512, last)
+        sims = store.vectors[block] @ store.vectors[rows[col:stop]].T
+        earlier = np.arange(col, stop)[None, :] < (start + np.arange(len(block)))[:, None]
+        hits = (sims >= threshold) & earlier
+        if chunk["survivors"] is None:
+            chunk["survivors"] = np.full(len(block), -1, dtype=np.int64)
+        survivors = chunk["survivors"]
+        fresh = (survivors < 0) & hits.any(axis=1)
+        survivors[fresh] = rows[col + np.argmax(hits[fresh], axis=1)]
+        if stop < last:
+            chunk["col"] = stop
+            return False
+        
+        duplicates = []
+        for offset in np.flatnonzero(survivors >= 0):
+            duplicate = int(block[offset])
+            duplicates.append(duplicate)
+            self._archive({"kind": "fact", "reason": "merged",
+                           "merged_into": store.metadata[survivors[offset]].get("text", ""),
+                           "metadata": store.metadata[duplicate]})
+        store.remove(duplicates)
+        stats["merged"] += len(duplicates)
+        chunk["row"], chunk["col"], chunk["survivors"] = start + 512, 0, None
+        if chunk["row"] >= len(rows):
+            chunk["groups"].pop()
+            chunk["row"] = 1
+        return False
+    
+    def _supersede_step(self, state: Dict, functional_types: Any, stats: Dict) -> bool:
+        nodes = state["work"]
+        stop = min(state["cursor"] + 64, len(nodes))
+        with self.graph.batch():
+            for node_id in nodes[state["cursor"]:stop]:
+                closed, repeats = self.graph.close_superseded(node_id, functional_types)
+                stats["closed"] += closed
+                for edge_id, original in repeats:
+                    self._archive({"kind": "edge", "reason": "reasserted", "reasserts": original,
+                                   "edge": self.graph.edges[edge_id]})
+                    self.graph.remove_edge(edge_id)
+                stats["removed_edges"] += len(repeats)
+        state["cursor"] = stop
+        return stop >= len(nodes)
+    
+    def _archive_facts_step(self, state: Dict, cutoff: datetime, stats: Dict) -> bool:
+        store = self.vector_store
+        stop = min(state["cursor"] + 1024, len(store))
+        expired = []
+        for i in range(state["cursor"], stop):
+            if store.is_deleted(i):
+                continue
+            metadata = store.metadata[i]
+            until = metadata.get("valid_until")
+            if until and _epoch_us(until) <= _epoch_us(cutoff):
+                expired.append(i)
+                self._archive({"kind": "fact", "reason": "expired", "metadata": metadata})
+        store.remove(expired)
+        stats["archived_facts"] += len(expired)
+        state["cursor"] = stop
+        return stop >= len(store)
+    
+    def _archive_edges_step(self, state: Dict, cutoff: datetime, stats: Dict) -> bool:
+        expired, cursor = self.graph.expired_edges(cutoff, state["cursor"])
+        with self.graph.batch():
+            for edge_id in expired:
+                self._archive({"kind": "edge", "reason": "expired", "edge": self.graph.edges[edge_id]})
+                self.graph.remove_edge(edge_id)
+        stats["archived_edges"] += len(expired)
+        state["cursor"] = cursor
+        return cursor is None
+    
+    def _archive(self, record: Dict):
+        """Append a removed fact or edge to cold storage."""
+        record["archived_at"] = datetime.now().isoformat()
+        if self.path is None:
+            self.archive.append(record)
+            return
+        with open(os.path.join(self.path, "archive.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=_json_default) + "\n")
+
+
+# Benchmarks
+
+def _synthetic_unit_vectors(n: int, dimension: int, rng: np.random.Generator,
+                            clusters: int = 64) -> np.ndarray:
+    """Clustered unit vectors (uniform noise is a pathological ANN workload)."""
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    points = centers[rng.integers(0, clusters, n)]
+    points += 0.6 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+
+def benchmark_ann(n: int = 20000, dimension: int = 128, k: int = 10,
+                  queries: int = 100, nprobes: Tuple[int, ...] = (1, 4, 16, 64),
+                  kinds: Tuple[str, ...] = ("ivf", "hnswlib", "faiss"),
+                  seed: int = 0) -> List[Dict]:
+    """Measure recall@k and mean query latency of ANN indexes against exact search.
+    
+    Optional backends that are not installed are skipped. Returns one row per
+    configuration, starting with the exact baseline.
+    """
+    rng = np.random.default_rng(seed)
+    data = _synthetic_unit_vectors(n, dimension, rng)
+    probes = _synthetic_unit_vectors(queries, dimension, rng)
+    
+    start = time.perf_counter()
+    truth = [set(VectorStore._top_k(data @ q, k).tolist()) for q in probes]
+    rows = [{"index": "exact", "params": {}, "recall_at_k": 1.0,
+             "latency_ms": (time.perf_counter() - start) * 1000 / queries}]
+    
+    def measure(index, label: str, params: Dict):
+        start = time.perf_counter()
+        found = [index.search(q, k)[0] for q in probes]
+        latency = (time.perf_counter() - start) * 1000 / queries
+        recall = np.mean([len(truth[i] & set(ids.tolist())) / k for i, ids in enumerate(found)])
+        rows.append({"index": label, "params": params,
+                     "recall_at_k": float(recall), "latency_ms": latency})
+    
+    for kind in kinds:
+        try:
+            index = make_index(kind, dimension)
+        except ImportError:
+            continue
+        build_start = time.perf_counter()
+        index.add(data)
+        if kind == "ivf" and not index.is_trained:
+            index.train()
+        build_s = time.perf_counter() - build_start
+        if kind == "ivf":
+            for nprobe in nprobes:
+                index.nprobe = nprobe
+                measure(index, kind, {"nprobe": nprobe, "build_s": build_s})
+        else:
+            measure(index, kind, {"build_s": build_s})
+    
+    return rows
+
+
+def benchmark_ingest(n: int = 5000, dimension: int = 256, entities: int = 200,
+                     seed: int = 0) -> Dict[str, float]:
+    """Compare per-fact store_fact with batched store_facts, in facts/sec."""
+    rng = np.random.default_rng(seed)
+    facts = [
+        {
+            "fact": f"note {i} about entity {int(e)}",
+            "entity": f"entity-{int(e)}",
+            "relationships": [{"type": "MENTIONS", "target": f"entity-{int(t)}"}]
+        }
+        for i, (e, t) in enumerate(rng.integers(0, entities, size=(n, 2)))
+    ]
+    
+    single = IntegratedMemorySystem(dimension=dimension)
+    start = time.perf_counter()
+    for f in facts:
+        single.store_fact(f["fact"], f["entity"], relationships=f["relationships"])
+    single_rate = n / (time.perf_counter() - start)
+    
+    batched = IntegratedMemorySystem(dimension=dimension)
+    stats = batched.store_facts(facts)
+    
+    return {
+        "store_fact_per_sec": single_rate,
+        "store_facts_per_sec": stats["facts_per_sec"],
+        "speedup": stats["facts_per_sec"] / single_rate
+    }
+
+
+def benchmark_graph_memory(n_nodes: int = 10000, n_edges: int = 100000,
+                           seed: int = 0) -> Dict[str, float]:
+    """Bytes per edge: columnar graphs vs the original dict-per-edge layout.
+    
+    Nodes are created before measuring, so figures cover edges and their
+    indexes only (traced with tracemalloc).
+    """
+    import tracemalloc
+    
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, n_nodes, size=(n_edges, 2)).tolist()
+    types = ["KNOWS", "WORKS_AT", "MENTIONS", "RELATED_TO"]
+    valid_from = datetime(2024, 1, 1)
+    
+    def measure(graph: Any, add_edges: Any) -> float:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        add_edges(graph)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return (after - before) / n_edges
+    
+    def populate(graph: PropertyGraph) -> List[str]:
+        return [graph.create_node("Entity", node_id=f"entity-{i}") for i in range(n_nodes)]
+    
+    # Original layout: md5 ids, one dict (plus a properties dict) per edge
+    node_ids = [f"entity-{i}" for i in range(n_nodes)]
+    
+    def dict_edges(store: Dict):
+        edges: Dict[str, Dict] = {}
+        edge_index: Dict[str, List[str]] = {}
+        for k, (s, t) in enumerate(pairs):
+            edge_id = hashlib.md5(f"{s}{t}{k}".encode()).hexdigest()[:16]
+            edges[edge_id] = {
+                "id": edge_id, "source": node_ids[s], "target": node_ids[t],
+                "type": types[k % 4], "properties": {}, "created_at": time.time(),
+                "valid_from": valid_from.isoformat(), "valid_until": None
+            }
+            edge_index.setdefault(types[k % 4], []).append(edge_id)
+        store["edges"], store["edge_index"] = edges, edge_index
+    
+    def graph_edges(graph: PropertyGraph):
+        ids = graph._node_ids
+        for k, (s, t) in enumerate(pairs):
+            graph.create_relationship(ids[s], types[k % 4], ids[t])
+    
+    def temporal_edges(graph: TemporalKnowledgeGraph):
+        ids = graph._node_ids
+        for k, (s, t) in enumerate(pairs):
+            graph.create_temporal_relationship(ids[s], types[k % 4], ids[t], valid_from)
+    
+    property_graph = PropertyGraph()
+    populate(property_graph)
+    temporal_graph = TemporalKnowledgeGraph()
+    populate(temporal_graph)
     
-    def consolidate(self):
-        """Consolidate memories and remove outdated information."""
-        # In production, implement actual consolidation logic
-        # - Merge related facts
-        # - Update validity periods
-        # - Archive obsolete facts
-        pass
+    dict_bytes = measure({}, dict_edges)
+    property_bytes = measure(property_graph, graph_edges)
+    temporal_bytes = measure(temporal_graph, temporal_edges)
+    return {
+        "dict_bytes_per_edge": dict_bytes,
+        "property_graph_bytes_per_edge": property_bytes,
+        "temporal_graph_bytes_per_edge": temporal_bytes,
+        "reduction": dict_bytes / temporal_bytes
+    }
@@ -0,0 +1,475 @@
+import json
+import os
+import random
+import unittest
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from memory_store import (
+    CachedEmbedder,
+    CallableEmbedder,
+    EmbeddingCache,
+    IntegratedMemorySystem,
+    IntervalIndex,
+    IVFIndex,
+    PropertyGraph,
+    TemporalKnowledgeGraph,
+    VectorStore,
+    _synthetic_unit_vectors,
+    make_index,
+)
+
+
+T0 = datetime(2024, 1, 1)
+
+
+def _facts(count, entities=5, seed=0):
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "kappa", "sigma", "omega", "theta"]
+    return [
+        {
+            "fact": " ".join(rng.choice(words) for _ in range(6)) + f" #{n}",
+            "entity": f"ent{n % entities}",
+            "timestamp": T0 + timedelta(days=n),
+            "relationships": [{"type": "KNOWS", "target": f"ent{(n + 1) % entities}"}]
+        }
+        for n in range(count)
+    ]
+
+
+class TestMemoryStore(unittest.TestCase):
+    def test_persistent_memory_round_trips(self) -> None:
+        with TemporaryDirectory() as td:
+            memory = IntegratedMemorySystem(path=td, dimension=64)
+            memory.store_facts(_facts(40))
+            removed = next(iter(memory.graph.edges))
+            memory.graph.remove_edge(removed)
+            memory.flush()
+            metadata = [dict(m) for m in memory.vector_store.metadata]
+            vectors = memory.vector_store.vectors.copy()
+            edges = {k: dict(v) for k, v in memory.graph.edges.items()}
+            nodes = {k: dict(v) for k, v in memory.graph.nodes.items()}
+            results = memory.vector_store.search("alpha beta gamma", limit=5, exact=True)
+            memory.graph.close()
+            
+            reopened = IntegratedMemorySystem(path=td)
+            self.assertEqual(reopened.vector_store.dimension, 64)
+            self.assertEqual([dict(m) for m in reopened.vector_store.metadata], metadata)
+            np.testing.assert_array_equal(reopened.vector_store.vectors, vectors)
+            self.assertEqual({k: dict(v) for k, v in reopened.graph.edges.items()}, edges)
+            self.assertEqual({k: dict(v) for k, v in reopened.graph.nodes.items()}, nodes)
+            self.assertNotIn(removed, reopened.graph.edges)
+            self.assertEqual(
+                reopened.vector_store.search("alpha beta gamma", limit=5, exact=True), results
+            )
+            reopened.graph.close()
+    
+    def test_ivf_recall_against_exact_search(self) -> None:
+        rng = np.random.default_rng(0)
+        data = _synthetic_unit_vectors(4000, 32, rng)
+        queries = _synthetic_unit_vectors(50, 32, rng)
+        exact = [set(np.argsort(-(data @ q))[:10]) for q in queries]
+        
+        def recall(index):
+            found = [set(index.search(q, 10)[0]) for q in queries]
+            return np.mean([len(f & e) / 10 for f, e in zip(found, exact)])
+        
+        index = IVFIndex(32, nlist=32, nprobe=8)
+        index.add(data[:100])
+        self.assertFalse(index.is_trained)
+        self.assertEqual(set(index.search(data[7], 1)[0]), {7})
+        index.add(data[100:])
+        self.assertTrue(index.is_trained)
+        self.assertEqual(len(index), 4000)
+        self.assertGreaterEqual(recall(index), 0.9)
+        index.nprobe = 32
+        self.assertEqual(recall(index), 1.0)
+        
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "ivf.npz")
+            index.save(path)
+            loaded = IVFIndex.load(path)
+            for q in queries[:5]:
+                np.testing.assert_array_equal(loaded.search(q, 10)[0], index.search(q, 10)[0])
+        
+        self.assertIsNotNone(make_index("auto", 32))
+        with self.assertRaises(ValueError):
+            make_index("annoy", 32)
+    
+    def test_vector_store_ann_search_agrees_with_exact(self) -> None:
+        store = VectorStore(dimension=64, index=IVFIndex(64, nlist=8, nprobe=8, train_size=64))
+        facts = _facts(400, entities=4)
+        store.add_batch([f["fact"] for f in facts],
+                        [{"text": f["fact"], "entity": f["entity"]} for f in facts])
+        for query in ("alpha omega", "kappa sigma theta"):
+            for filters in (None, {"entity": "ent1"}):
+                ann = store.search(query, limit=5, filters=filters)
+                exact = store.search(query, limit=5, filters=filters, exact=True)
+                # Probing every list makes the ANN index exact
+                np.testing.assert_allclose([r["score"] for r in ann], [r["score"] for r in exact], rtol=1e-6)
+    
+    def test_persistent_store_defers_ann_build_to_first_search(self) -> None:
+        with TemporaryDirectory() as td:
+            store = VectorStore(dimension=64, path=td)
+            facts = _facts(300, entities=3)
+            store.add_batch([f["fact"] for f in facts], [{"text": f["fact"]} for f in facts])
+            store.flush()
+            
+            reopened = VectorStore.open(td, index=IVFIndex(64, nlist=8, nprobe=8, train_size=64))
+            self.assertEqual(len(reopened.index), 0)
+            ann = reopened.search("alpha omega", limit=5)
+            self.assertEqual(len(reopened.index), 300)
+            exact = reopened.search("alpha omega", limit=5, exact=True)
+            np.testing.assert_allclose([r["score"] for r in ann], [r["score"] for r in exact], rtol=1e-6)
+    
+    def test_store_refuses_a_different_embedder(self) -> None:
+        def embedder(model_id):
+            return CallableEmbedder(lambda texts: np.ones((len(texts), 8)), model_id, 8)
+        
+        with TemporaryDirectory() as td:
+            memory = IntegratedMemorySystem(path=td, dimension=8, embedder=embedder("model-a"))
+            memory.store_fact("alpha", "ent0")
+            memory.flush()
+            memory.graph.close()
+            
+            with self.assertRaises(ValueError):
+                IntegratedMemorySystem(path=td, embedder=embedder("model-b"))
+            with self.assertRaises(ValueError):
+                IntegratedMemorySystem(path=td, read_only=True)  # Would embed with hashing
+            reader = IntegratedMemorySystem(path=td, read_only=True, embedder=embedder("model-a"))
+            self.assertEqual(len(reader.vector_store), 1)
+    
+    def test_cached_embedder_runs_the_model_once_per_text(self) -> None:
+        calls = []
+        
+        def model(texts):
+            calls.append(list(texts))
+            return [[len(t), 1.0, 0.0, 0.0] for t in texts]
+        
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "embeddings.sqlite")
+            embedder = CachedEmbedder(CallableEmbedder(model, "count-v1", 4), EmbeddingCache(path))
+            embedder.embed(["a", "bb", "a"])
+            embedder.embed(["bb", "a"])
+            self.assertEqual(calls, [["a", "bb"]])
+            embedder.cache.close()
+            
+            # Known text survives a reopen; a new model id is a different key
+            cache = EmbeddingCache(path)
+            vectors = CachedEmbedder(CallableEmbedder(model, "count-v1", 4), cache).embed(["bb", "ccc"])
+            np.testing.assert_array_equal(vectors[0], [2, 1, 0, 0])
+            self.assertEqual(calls[1:], [["ccc"]])
+            CachedEmbedder(CallableEmbedder(model, "count-v2", 4), cache).embed(["bb"])
+            self.assertEqual(calls[2:], [["bb"]])
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+            cache.close()
+    
+    def test_embedding_cache_evicts_least_recently_used(self) -> None:
+        keys = [EmbeddingCache.key("m", str(i)) for i in range(5)]
+        vector = np.ones((1, 4), dtype=np.float32)
+        
+        memory = EmbeddingCache(memory_capacity=2)
+        for key in keys[:3]:
+            memory.put_many([key], vector)
+        self.assertEqual([v is not None for v in memory.get_many(keys[:3])], [False, True, True])
+        
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "embeddings.sqlite")
+            cache = EmbeddingCache(path, capacity=4, memory_capacity=1, evict_batch=1)
+            for key in keys[:4]:
+                cache.put_many([key], vector)
+            cache.get_many([keys[0]])  # from disk: now more recent than 1 and 2
+            cache.put_many([keys[4]], vector)
+            self.assertEqual(len(cache), 3)
+            cache.close()
+            
+            reopened = EmbeddingCache(path, capacity=4)
+            self.assertEqual(len(reopened), 3)
+            present = [v is not None for v in reopened.get_many(keys)]
+            self.assertEqual(present, [True, False, False, True, True])
+            reopened.close()
+    
+    def test_filtered_search_matches_brute_force(self) -> None:
+        store = VectorStore(dimension=64)
+        facts = _facts(300, entities=7)
+        store.add_batch([f["fact"] for f in facts],
+                        [{"text": f["fact"], "entity": f["entity"]} for f in facts])
+        store.remove(list(range(0, 300, 11)))
+        live = np.array([not store.is_deleted(i) for i in range(300)])
+        entities = np.array([f["entity"] for f in facts])
+        
+        for query in ("alpha omega", "kappa sigma theta", "delta"):
+            embedding = store.embedder.embed([query])[0]
+            embedding = embedding / np.linalg.norm(embedding)
+            scores = store.vectors @ embedding
+            for entity in (None, "ent3"):
+                keep = live & (entities == entity if entity else True)
+                expected = np.sort(scores[keep & (scores > 0)])[::-1][:8]
+                filters = {"entity": entity} if entity else None
+                results = store.search(query, limit=8, filters=filters, exact=True)
+                # Ties may come back in either order, so compare scores
+                self.assertTrue(all(keep[r["index"]] for r in results), (query, entity))
+                np.testing.assert_allclose([r["score"] for r in results], expected, rtol=1e-6)
+    
+    def test_match_agrees_with_edge_scan(self) -> None:
+        rng = random.Random(1)
+        graph = PropertyGraph()
+        nodes = [graph.create_node(rng.choice("AB"), {"rank": n % 3}) for n in range(60)]
+        for _ in range(400):
+            graph.create_relationship(rng.choice(nodes), rng.choice(["R", "S"]), rng.choice(nodes),
+                                      {"w": rng.randint(0, 2)})
+        for edge_id in rng.sample(list(graph.edges), 40):
+            graph.remove_edge(edge_id)
+        edges = list(graph.edges.values())
+        label = {n: graph.get_node(n)["label"] for n in nodes}
+        
+        got = {m["edges"][0]["id"] for m in graph.match([{"label": "A"}, {"type": "R"}, {}])}
+        expected = {e["id"] for e in edges if e["type"] == "R" and label[e["source"]] == "A"}
+        self.assertEqual(got, expected)
+        
+        got = {tuple(e["id"] for e in m["edges"])
+               for m in graph.match([{"label": "B"}, {"type": "S", "where": {"w": 1}},
+                                     {}, {"type": "R", "direction": "in"}, {"label": "A"}])}
+        expected = {
+            (first["id"], second["id"])
+            for first in edges if first["type"] == "S" and first["properties"]["w"] == 1
+            and label[first["source"]] == "B"
+            for second in edges if second["type"] == "R" and second["target"] == first["target"]
+            and label[second["source"]] == "A" and second["id"] != first["id"]
+        }
+        self.assertEqual(got, expected)
+    
+    def test_graph_views_reject_mutation_and_setters_persist(self) -> None:
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "graph.jsonl")
+            graph = PropertyGraph(path)
+            a = graph.create_node("A", {"rank": 1})
+            b = graph.create_node("B")
+            edge_id = graph.create_relationship(a, "R", b)
+            with self.assertRaises(TypeError):
+                graph.edges[edge_id]["properties"]["w"] = 1
+            with self.assertRaises(TypeError):
+                graph.nodes[a]["label"] = "C"
+            graph.get_node(a)["properties"]["rank"] = 9  # A copy; the store is untouched
+            self.assertEqual(graph.nodes[a]["properties"]["rank"], 1)
+            
+            graph.set_edge_properties(edge_id, {"w": 1})
+            graph.set_node_properties(a, {"rank": 2})
+            self.assertEqual(graph.node_index, {"A": [a], "B": [b]})
+            self.assertEqual(graph.edge_index, {"R": [edge_id]})
+            graph.close()
+            
+            reopened = PropertyGraph(path, read_only=True)
+            self.assertEqual(dict(reopened.edges[edge_id]["properties"]), {"w": 1})
+            self.assertEqual(dict(reopened.nodes[a]["properties"]), {"rank": 2})
+    
+    def test_compact_log_replays_to_the_same_graph(self) -> None:
+        rng = random.Random(2)
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "graph.jsonl")
+            graph = TemporalKnowledgeGraph(path)
+            nodes = [graph.create_node("E", {"n": n}) for n in range(30)]
+            for n in range(300):
+                start = T0 + timedelta(days=rng.randint(0, 50))
+                end = start + timedelta(days=rng.randint(1, 20)) if n % 2 else None
+                graph.create_temporal_relationship(rng.choice(nodes), rng.choice(["R", "S"]),
+                                                   rng.choice(nodes), start, end, {"n": n})
+            for edge_id in rng.sample(list(graph.edges), 120) + ["e12b"]:
+                if edge_id in graph.edges:
+                    graph.remove_edge(edge_id)
+            graph.remove_node(nodes[0])
+            graph.set_edge_properties(next(iter(graph.edges)), {"w": 1})
+            reader = TemporalKnowledgeGraph(path, read_only=True)
+            
+            def snapshot(g):
+                return ({k: dict(v) for k, v in g.edges.items()},
+                        {k: dict(v) for k, v in g.nodes.items()})
+            
+            before = snapshot(graph)
+            size = os.path.getsize(path)
+            graph.compact_log()
+            self.assertLess(os.path.getsize(path), size)
+            with open(path, encoding="utf-8") as f:
+                self.assertNotIn("remove", f.read())
+            graph.create_temporal_relationship(nodes[1], "R", nodes[2], T0)
+            self.assertEqual(graph.create_relationship(nodes[1], "R", nodes[2]), "e12d")
+            after = snapshot(graph)
+            graph.close()
+            
+            reader.refresh()
+            self.assertEqual(snapshot(reader), after)
+            reopened = TemporalKnowledgeGraph(path, read_only=True)
+            self.assertEqual(snapshot(reopened), after)
+            self.assertEqual({k: v for k, v in after[0].items() if k in before[0]}, before[0])
+            at = T0 + timedelta(days=30)
+            self.assertEqual(reopened.query_at_time({"type": "R"}, at), graph.query_at_time({"type": "R"}, at))
+    
+    def test_only_canonical_edge_ids_resolve(self) -> None:
+        graph = PropertyGraph()
+        a = graph.create_node("A")
+        for _ in range(3):
+            graph.create_relationship(a, "R", a)
+        self.assertEqual(list(graph.edges), ["e0", "e1", "e2"])
+        for alias in ("e-1", "e-2", "e01", "eA", "e_1", "e 1", "e3", "e"):
+            self.assertNotIn(alias, graph.edges)
+            with self.assertRaises(ValueError):
+                graph.remove_edge(alias)
+        self.assertEqual(len(graph.edges), 3)
+    
+    def test_query_at_time_matches_interval_scan(self) -> None:
+        rng = random.Random(2)
+        graph = TemporalKnowledgeGraph()
+        nodes = [graph.create_node("Entity", node_id=f"n{n}") for n in range(20)]
+        for _ in range(200):
+            start = T0 + timedelta(days=rng.randint(0, 100))
+            end = start + timedelta(days=rng.randint(1, 30)) if rng.random() < 0.7 else None
+            graph.create_temporal_relationship(rng.choice(nodes), "AT", rng.choice(nodes), start, end)
+        
+        for day in (0, 15, 50, 99, 140):
+            moment = T0 + timedelta(days=day)
+            got = {r["edge"]["id"] for r in graph.query_at_time({"type": "AT"}, moment)}
+            expected = {
+                e["id"] for e in graph.edges.values()
+                if datetime.fromisoformat(e["valid_from"]) <= moment
+                and (e["valid_until"] is None or moment < datetime.fromisoformat(e["valid_until"]))
+            }
+            self.assertEqual(got, expected, day)
+    
+    def test_interval_index_matches_brute_force_across_rebuilds(self) -> None:
+        rng = random.Random(3)
+        index = IntervalIndex()
+        intervals = {}
+        for step in range(3000):
+            key = rng.randrange(2000)
+            if rng.random() < 0.15:
+                index.remove(key)
+                intervals.pop(key, None)
+            else:
+                start = rng.randrange(10_000)
+                intervals[key] = (start, start + rng.randrange(1, 500))
+                index.add(key, *intervals[key])
+            if step % 500 == 499:
+                self.assertIsNotNone(index._tree)
+                self.assertEqual(len(index), len(intervals))
+                for _ in range(20):
+                    t = rng.randrange(-100, 10_600)
+                    self.assertEqual(sorted(index.stab(t)),
+                                     sorted(k for k, (s, e) in intervals.items() if s <= t < e))
+                    lo = rng.randrange(10_000)
+                    hi = lo + rng.randrange(300)
+                    self.assertEqual(sorted(index.overlap(lo, hi)),
+                                     sorted(k for k, (s, e) in intervals.items() if s <= hi and e >= lo))
+    
+    def test_query_time_range_matches_interval_scan(self) -> None:
+        rng = random.Random(4)
+        graph = TemporalKnowledgeGraph()
+        nodes = [graph.create_node("Entity", node_id=f"n{n}") for n in range(30)]
+        for _ in range(1500):
+            start = T0 + timedelta(days=rng.randint(0, 365))
+            end = start + timedelta(days=rng.randint(1, 60)) if rng.random() < 0.8 else None
+            graph.create_temporal_relationship(rng.choice(nodes), rng.choice(["AT", "OF"]),
+                                               rng.choice(nodes), start, end)
+        for edge_id in rng.sample(list(graph.edges), 200):
+            graph.remove_edge(edge_id)
+        self.assertIsNotNone(graph.interval_index["AT"]._tree)
+        
+        def until(edge):
+            return datetime.fromisoformat(edge["valid_until"]) if edge["valid_until"] else datetime.max
+        
+        edges = [e for e in graph.edges.values() if e["type"] == "AT"]
+        for day in (0, 40, 180, 364, 500):
+            lo = T0 + timedelta(days=day)
+            hi = lo + timedelta(days=rng.randint(0, 30))
+            got = {r["edge"]["id"] for r in graph.query_time_range({"type": "AT"}, lo, hi)}
+            expected = {e["id"] for e in edges
+                        if datetime.fromisoformat(e["valid_from"]) <= hi and until(e) >= lo}
+            self.assertEqual(got, expected, day)
+            got = {r["edge"]["id"] for r in graph.query_at_time({"type": "AT"}, lo)}
+            expected = {e["id"] for e in edges
+                        if datetime.fromisoformat(e["valid_from"]) <= lo < until(e)}
+            self.assertEqual(got, expected, day)
+    
+    def test_dedupe_resumes_block_by_block_within_session_and_validity(self) -> None:
+        centers = np.random.default_rng(3).standard_normal((400, 16))
+        
+        def embed(texts):
+            return centers[[int(t.split()[0][1:]) for t in texts]]
+        
+        memory = IntegratedMemorySystem(dimension=16, embedder=CallableEmbedder(embed, "clusters", 16))
+        for session in ("s1", "s2"):
+            memory.start_session(session)
+            memory.store_facts([
+                {"fact": f"c{n % 400} #{session}{n}", "entity": "ent0",
+                 "timestamp": T0 + timedelta(days=int(n % 3 == 0)),
+                 "valid_until": T0 + timedelta(days=90) if n % 7 == 0 else None}
+                for n in range(1500)
+            ])
+        store = memory.vector_store
+        
+        groups = {}
+        for i in range(len(store)):
+            m = store.metadata[i]
+            groups.setdefault((m["session_id"], m["valid_from"], m.get("valid_until")), []).append(i)
+        expected = {}
+        for rows in groups.values():
+            sims = store.vectors[rows] @ store.vectors[rows].T
+            for k in range(1, len(rows)):
+                earlier = np.flatnonzero(sims[k, :k] >= 0.98)
+                if len(earlier):
+                    expected[store.metadata[rows[k]]["text"]] = store.metadata[rows[earlier[0]]]["text"]
+        
+        calls = 0
+        stats = {"phase": "dedupe"}
+        while stats["phase"] == "dedupe":
+            stats = memory.consolidate(max_seconds=0)
+            calls += 1
+        merged = {r["metadata"]["text"]: r["merged_into"] for r in memory.archive}
+        self.assertEqual(merged, expected)
+        self.assertEqual(store.deleted_count, len(expected))
+        # One entity load, then at least one 512x512 block per group (three for the largest)
+        self.assertGreater(calls, len(groups) + 2)
+    
+    def test_consolidate_archives_everything_it_removes(self) -> None:
+        with TemporaryDirectory() as td:
+            memory = IntegratedMemorySystem(path=td, dimension=64)
+            facts = _facts(30)
+            facts += [dict(f, timestamp=f["timestamp"] + timedelta(hours=1)) for f in facts[:10]]
+            for f in facts[20:25]:
+                f["valid_until"] = T0 + timedelta(days=2)
+            memory.store_facts(facts)
+            memory.flush()
+            texts = [m["text"] for m in memory.vector_store.metadata]
+            edge_ids = set(memory.graph.edges)
+            
+            stats = {"cycle_complete": False}
+            while not stats["cycle_complete"]:
+                stats = memory.consolidate(max_seconds=0.001, now=T0 + timedelta(days=60))
+            
+            with open(os.path.join(td, "archive.jsonl"), encoding="utf-8") as f:
+                archive = [json.loads(line) for line in f]
+            live_texts = [memory.vector_store.metadata[i]["text"]
+                          for i in range(len(memory.vector_store)) if not memory.vector_store.is_deleted(i)]
+            archived_texts = [r["metadata"]["text"] for r in archive if r["kind"] == "fact"]
+            self.assertTrue(archived_texts)
+            self.assertEqual(sorted(live_texts + archived_texts), sorted(texts))
+            
+            archived_edges = [r["edge"]["id"] for r in archive if r["kind"] == "edge"]
+            self.assertTrue(any(r.get("reason") == "reasserted" for r in archive))
+            self.assertEqual(set(memory.graph.edges) | set(archived_edges), edge_ids)
+            self.assertFalse(set(memory.graph.edges) & set(archived_edges))
+            self.assertEqual(len(archived_edges), len(set(archived_edges)))
+            
+            # Removed edges were compacted out of the graph log
+            self.assertGreater(stats["compacted_log_records"], 0)
+            with open(os.path.join(td, "graph.jsonl"), encoding="utf-8") as f:
+                self.assertNotIn("remove_edge", f.read())
+            edges = {k: dict(v) for k, v in memory.graph.edges.items()}
+            memory.graph.close()
+            reopened = TemporalKnowledgeGraph(os.path.join(td, "graph.jsonl"), read_only=True)
+            self.assertEqual({k: dict(v) for k, v in reopened.edges.items()}, edges)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,17 +8,23 @@ Supports:
 - whole-file inclusion via `file` only
 - multi-section recipes via YAML document separators (`---`) inside the YAML block
 - structured output formats: `agent`, `skill`, `power`
+- per-source token accounting with optional `max_tokens` budgets (agent/project)
+- cross-output shared-prefix analysis for provider prompt caching (`--prefix-report`)
+- optional per-recipe `normalize` pass that strips Obsidian-isms from outputs
+- skill body splitting: oversized SKILL.md sections move to `references/` behind an index
 
 Outputs assembled artifacts to `.context/workshop/staging/` and updates
 `.context/workshop/manifest-recipes.md` with run logs.
 
-Usage: python assemble.py [--dry-run] [--verbose]
+Usage: python assemble.py [--dry-run] [--verbose] [--prefix-report]
 """
 
 import re
 import yaml
 import frontmatter
-from dataclasses import dataclass
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime
 import sys
@@ -26,6 +32,12 @@ import json
 import os
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+try:
+    # Optional: exact BPE counts when tiktoken is installed; otherwise we estimate.
+    import tiktoken
+except ImportError:  # pragma: no cover - depends on local environment
+    tiktoken = None
+
 
 def find_recipe_files(workshop_dir: Path) -> List[Path]:
     """Find all recipe .md files in workshop directory."""
@@ -50,6 +62,46 @@ class OutputArtifact:
     abspath: Path
     targets: List[str]
     is_dir: bool
+    token_report: Optional["TokenReport"] = None
+    # Rendered text for single-file agent/project outputs (used by prefix analysis).
+    content: Optional[str] = None
+    normalize_report: Optional["NormalizeReport"] = None
+
+
+@dataclass(frozen=True)
+class SourcePart:
+    label: str
+    text: str
+    priority: int = 0
+    cache_stable: bool = False
+    cache_rank: int = 0
+
+
+@dataclass(frozen=True)
+class SourceTokens:
+    label: str
+    tokens: int
+    priority: int
+    dropped: bool = False
+    cache_stable: bool = False
+
+
+@dataclass
+class TokenReport:
+    sources: List[SourceTokens] = field(default_factory=list)
+    total_tokens: int = 0
+    max_tokens: Optional[int] = None
+
+    @property
+    def over_budget(self) -> bool:
+        return self.max_tokens is not None and self.total_tokens > self.max_tokens
+
+    def dominant(self, limit: int = 3) -> List[Tuple[SourceTokens, float]]:
+        """Return the largest kept sources with their share of the kept source tokens."""
+        kept = [s for s in self.sources if not s.dropped]
+        kept_total = sum(s.tokens for s in kept) or 1
+        ranked = sorted(kept, key=lambda s: s.tokens, reverse=True)[:limit]
+        return [(s, s.tokens / kept_total) for s in ranked]
 
 
 def _configure_stdio_utf8() -> None:
@@ -189,46 +241,51 @@ def parse_recipe(recipe_path: Path) -> Optional[Tuple[Dict[str, Any], List[Recip
         return None
 
 
+def _find_slice(content: str, slice_id: str) -> Optional[str]:
+    """Return content between slice markers, or None when the marker is absent."""
+    # Look for slice markers
+    start_pattern = f"<!-- slice:{slice_id} -->"
+
+    start_idx = content.find(start_pattern)
+    if start_idx == -1:
+        return None
+
+    start_idx += len(start_pattern)
+
+    # Find end: either explicit end marker or next slice marker
+    end_slice_pattern = "<!-- /slice -->"
+    next_slice_pattern = "<!-- slice:"
+
+    end_idx = content.find(end_slice_pattern, start_idx)
+    next_slice_idx = content.find(next_slice_pattern, start_idx)
+
+    # Use whichever comes first (or only one if the other doesn't exist)
+    if end_idx == -1 and next_slice_idx == -1:
+        # No end marker found, take until end of file
+        return content[start_idx:].strip()
+    if end_idx == -1:
+        # Only next slice found
+        return content[start_idx:next_slice_idx].strip()
+    if next_slice_idx == -1:
+        # Only explicit end found
+        return content[start_idx:end_idx].strip()
+    # Both found, use whichever comes first
+    return content[start_idx:min(end_idx, next_slice_idx)].strip()
+
+
 def extract_slice(file_path: Path, slice_id: str) -> Optional[str]:
     """Extract content between slice markers from source file."""
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
-        
-        # Look for slice markers
-        start_pattern = f"<!-- slice:{slice_id} -->"
-        
-        start_idx = content.find(start_pattern)
-        if start_idx == -1:
+
+        slice_content = _find_slice(content, slice_id)
+        if slice_content is None:
             print(f"☠☠☠ >>> SLICE·COMMUNION·FAILED ☠☠☠")
             print(f"Sacred slice-marker '{slice_id}' absent from flesh-relic: {file_path}")
             print(f"|001101|—|000000|—|111000|— data-spirit unbound")
             return None
-            
-        start_idx += len(start_pattern)
-        
-        # Find end: either explicit end marker or next slice marker
-        end_slice_pattern = "<!-- /slice -->"
-        next_slice_pattern = "<!-- slice:"
-        
-        end_idx = content.find(end_slice_pattern, start_idx)
-        next_slice_idx = content.find(next_slice_pattern, start_idx)
-        
-        # Use whichever comes first (or only one if the other doesn't exist)
-        if end_idx == -1 and next_slice_idx == -1:
-            # No end marker found, take until end of file
-            slice_content = content[start_idx:].strip()
-        elif end_idx == -1:
-            # Only next slice found
-            slice_content = content[start_idx:next_slice_idx].strip()
-        elif next_slice_idx == -1:
-            # Only explicit end found
-            slice_content = content[start_idx:end_idx].strip()
-        else:
-            # Both found, use whichever comes first
-            end_idx = min(end_idx, next_slice_idx)
-            slice_content = content[start_idx:end_idx].strip()
-        
+
         return slice_content
         
     except Exception as e:
@@ -239,6 +296,44 @@ def extract_slice(file_path: Path, slice_id: str) -> Optional[str]:
         return None
 
 
+_TOKEN_WORD_RE = re.compile(r"[^\W\d_]+|\d{1,3}|\S")
+_TOKEN_CACHE: Dict[str, int] = {}
+_TOKEN_CACHE_MAX = 8192
+_TIKTOKEN_ENCODING = None
+
+
+def _estimate_tokens(text: str) -> int:
+    # Approximates cl100k-style BPE: common words are one token, long words split
+    # every ~5 chars, digits group in threes, punctuation counts individually.
+    total = 0
+    for m in _TOKEN_WORD_RE.finditer(text):
+        n = m.end() - m.start()
+        total += 1 if n <= 6 else (n + 4) // 5
+    return total
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens for text, cached by content hash."""
+    global _TIKTOKEN_ENCODING
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    cached = _TOKEN_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    if tiktoken is not None:
+        if _TIKTOKEN_ENCODING is None:
+            _TIKTOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+        n = len(_TIKTOKEN_ENCODING.encode(text, disallowed_special=()))
+    else:
+        n = _estimate_tokens(text)
+
+    if len(_TOKEN_CACHE) >= _TOKEN_CACHE_MAX:
+        # Dicts keep insertion order: evict the oldest entry.
+        del _TOKEN_CACHE[next(iter(_TOKEN_CACHE))]
+    _TOKEN_CACHE[key] = n
+    return n
+
+
 def include_file(file_path: Path) -> Optional[str]:
     """Include entire file content, stripping any YAML frontmatter."""
     try:
@@ -251,8 +346,15 @@ def include_file(file_path: Path) -> Optional[str]:
         return None
 
 
-def _assemble_source_list(sources: Iterable[Dict[str, Any]], base_path: Path) -> List[str]:
-    assembled_parts: List[str] = []
+def _source_priority(source: Dict[str, Any]) -> int:
+    try:
+        return int(source.get("priority", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _assemble_source_parts(sources: Iterable[Dict[str, Any]], base_path: Path) -> List[SourcePart]:
+    assembled_parts: List[SourcePart] = []
 
     for source in sources:
         if not isinstance(source, dict):
@@ -261,9 +363,14 @@ def _assemble_source_list(sources: Iterable[Dict[str, Any]], base_path: Path) ->
             print(f"|001101|—|000000|—|111000|— skipping corrupted entry")
             continue
 
+        priority = _source_priority(source)
+        cache_stable = bool(source.get("cache_stable", False))
+        # `cache_stable: <n>` pins the source's position within the shared prefix.
+        raw_rank = source.get("cache_stable")
+        cache_rank = raw_rank if isinstance(raw_rank, int) and not isinstance(raw_rank, bool) else 0
         inline = source.get("inline")
         if isinstance(inline, str):
-            assembled_parts.append(inline.strip())
+            assembled_parts.append(SourcePart(label="inline", text=inline.strip(), priority=priority, cache_stable=cache_stable, cache_rank=cache_rank))
             continue
 
         slice_id = source.get("slice")
@@ -280,7 +387,8 @@ def _assemble_source_list(sources: Iterable[Dict[str, Any]], base_path: Path) ->
 
             slice_content = extract_slice(full_path, str(slice_id))
             if slice_content is not None:
-                assembled_parts.append(slice_content)
+                label = f"slice:{slice_id}@{slice_file}"
+                assembled_parts.append(SourcePart(label=label, text=slice_content, priority=priority, cache_stable=cache_stable, cache_rank=cache_rank))
             continue
 
         if file_only and not slice_id:
@@ -293,7 +401,7 @@ def _assemble_source_list(sources: Iterable[Dict[str, Any]], base_path: Path) ->
 
             file_content = include_file(full_path)
             if file_content is not None:
-                assembled_parts.append(file_content)
+                assembled_parts.append(SourcePart(label=str(file_only), text=file_content, priority=priority, cache_stable=cache_stable, cache_rank=cache_rank))
             continue
 
         print(f"☠☠☠ >>> SOURCE·CONFIGURATION·HERESY ☠☠☠")
@@ -303,22 +411,409 @@ def _assemble_source_list(sources: Iterable[Dict[str, Any]], base_path: Path) ->
     return assembled_parts
 
 
-def assemble_content(sources: Iterable[Dict[str, Any]], base_path: Path, template: Optional[str] = None) -> Optional[str]:
-    """Assemble content from sources; apply optional `{content}` template."""
-    assembled_parts = _assemble_source_list(sources, base_path)
-
-    if not assembled_parts:
-        return None
-
-    content = "\n\n".join(assembled_parts)
+def _apply_template(content: str, template: Optional[str]) -> str:
     if not template:
         return content
-
     if "{content}" not in template:
         return template + "\n\n" + content
     return template.replace("{content}", content)
 
 
+def assemble_content(
+    sources: Iterable[Dict[str, Any]],
+    base_path: Path,
+    template: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    cache_stable_first: bool = False,
+) -> Optional[str]:
+    """Assemble content from sources; apply optional `{content}` template."""
+    content, _report = assemble_content_with_report(
+        sources, base_path, template=template, max_tokens=max_tokens, cache_stable_first=cache_stable_first
+    )
+    return content
+
+
+def _order_cache_stable_first(parts: List[SourcePart]) -> List[SourcePart]:
+    # Stable sources use a canonical (rank, label) order so every output that shares
+    # them renders a byte-identical prefix; the remaining sources keep recipe order.
+    stable = sorted((p for p in parts if p.cache_stable), key=lambda p: (p.cache_rank, p.label))
+    return stable + [p for p in parts if not p.cache_stable]
+
+
+def assemble_content_with_report(
+    sources: Iterable[Dict[str, Any]],
+    base_path: Path,
+    template: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    cache_stable_first: bool = False,
+    normalize_rules: Optional[Dict[str, Any]] = None,
+) -> Tuple[Optional[str], TokenReport]:
+    """Assemble content and account tokens per source.
+
+    With `max_tokens`, the lowest-priority sources (later sources first on ties)
+    are dropped until the output fits. The last remaining source is never dropped.
+    With `cache_stable_first`, sources marked `cache_stable` are moved to the front.
+    With `normalize_rules`, the total is measured on the normalized output (the one
+    that gets written), while the returned content is left unnormalized.
+    """
+    parts = _assemble_source_parts(sources, base_path)
+    if cache_stable_first:
+        parts = _order_cache_stable_first(parts)
+    report = TokenReport(max_tokens=max_tokens)
+
+    if not parts:
+        return None, report
+
+    part_tokens = [count_tokens(p.text) for p in parts]
+    kept = [True] * len(parts)
+
+    def _render() -> str:
+        return _apply_template("\n\n".join(p.text for p, k in zip(parts, kept) if k), template)
+
+    def _measure(text: str) -> int:
+        return count_tokens(normalize_content(text, normalize_rules) if normalize_rules else text)
+
+    content = _render()
+    total = _measure(content)
+
+    if max_tokens is not None and total > max_tokens:
+        drop_order = sorted(range(len(parts)), key=lambda i: (parts[i].priority, -i))
+        for i in drop_order:
+            if total <= max_tokens or sum(kept) <= 1:
+                break
+            kept[i] = False
+            content = _render()
+            total = _measure(content)
+
+    report.sources = [
+        SourceTokens(label=p.label, tokens=n, priority=p.priority, dropped=not k, cache_stable=p.cache_stable)
+        for p, n, k in zip(parts, part_tokens, kept)
+    ]
+    report.total_tokens = total
+    return content, report
+
+
+@dataclass(frozen=True)
+class PrefixStats:
+    output: str
+    total_tokens: int
+    shared_prefix_tokens: int
+    cacheable_tokens: int
+    shares_with: Optional[str]
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def analyze_shared_prefixes(outputs: Dict[str, str], min_cacheable_tokens: int = 1024) -> List[PrefixStats]:
+    """Longest prefix each output shares with any other output.
+
+    After sorting, an output's longest common prefix with the rest of the set is
+    with one of its sorted neighbours, so this is O(n log n) comparisons.
+    The shared prefix is cut back to a line boundary so token counts line up.
+    Providers only cache prefixes past a minimum size, hence `min_cacheable_tokens`.
+    """
+    names = sorted(outputs, key=lambda k: outputs[k])
+    stats: List[PrefixStats] = []
+    for pos, name in enumerate(names):
+        text = outputs[name]
+        best_len, best_name = 0, None
+        for npos in (pos - 1, pos + 1):
+            if 0 <= npos < len(names):
+                other = names[npos]
+                n = _common_prefix_len(text, outputs[other])
+                if n > best_len:
+                    best_len, best_name = n, other
+        if best_len < len(text):
+            best_len = text.rfind("\n", 0, best_len) + 1
+        shared = count_tokens(text[:best_len]) if best_len else 0
+        stats.append(
+            PrefixStats(
+                output=name,
+                total_tokens=count_tokens(text),
+                shared_prefix_tokens=shared,
+                cacheable_tokens=shared if shared >= min_cacheable_tokens else 0,
+                shares_with=best_name if best_len else None,
+            )
+        )
+    stats.sort(key=lambda st: st.output)
+    return stats
+
+
+NORMALIZE_RULES = ("strip_comments", "collapse_whitespace", "resolve_links", "dedupe_paragraphs")
+
+_HTML_COMMENT_RE = re.compile(r"<!--.*?-->")
+_WIKI_LINK_RE = re.compile(r"!?\[\[([^\]|]+)(?:\|([^\]]*))?\]\]")
+_FENCE_PREFIXES = ("```", "~~~")
+
+
+@dataclass(frozen=True)
+class NormalizeReport:
+    bytes_before: int
+    bytes_after: int
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _normalize_rules(cfg_value: Any) -> Dict[str, Any]:
+    """Resolve a recipe `normalize` value (`true` or a mapping of rules) to rule settings."""
+    if cfg_value is True:
+        return {rule: True for rule in NORMALIZE_RULES}
+    if not isinstance(cfg_value, dict):
+        return {}
+    return {k: v for k, v in cfg_value.items() if v is not None and v is not False}
+
+
+def _tag_code_lines(lines: Iterable[str]) -> Iterable[Tuple[str, bool]]:
+    # Tag each line with whether it belongs to a fenced code block (fences included).
+    # Fences inside HTML comments do not open or close code blocks.
+    in_code = False
+    in_comment = False
+    for line in lines:
+        if in_comment:
+            end = line.find("-->")
+            if end != -1:
+                in_comment = "<!--" in _HTML_COMMENT_RE.sub("", line[end + 3 :])
+            yield line, False
+            continue
+        if line.lstrip().startswith(_FENCE_PREFIXES):
+            in_code = not in_code
+            yield line, True
+            continue
+        if not in_code:
+            in_comment = "<!--" in _HTML_COMMENT_RE.sub("", line)
+        yield line, in_code
+
+
+def _strip_comment_lines(tagged: Iterable[Tuple[str, bool]]) -> Iterable[Tuple[str, bool]]:
+    in_comment = False
+    for line, in_code in tagged:
+        if in_code and not in_comment:
+            yield line, in_code
+            continue
+        original = line
+        if in_comment:
+            end = line.find("-->")
+            if end == -1:
+                continue
+            line = line[end + 3 :]
+            in_comment = False
+        line = _HTML_COMMENT_RE.sub("", line)
+        start = line.find("<!--")
+        if start != -1:
+            line = line[:start]
+            in_comment = True
+        if original.strip() and not line.strip():
+            continue  # line held only comment text (e.g. slice markers)
+        yield line, in_code
+
+
+def _resolve_link_lines(tagged: Iterable[Tuple[str, bool]]) -> Iterable[Tuple[str, bool]]:
+    for line, in_code in tagged:
+        if not in_code and "[[" in line:
+            line = _WIKI_LINK_RE.sub(lambda m: m.group(2) or m.group(1), line)
+        yield line, in_code
+
+
+def _rstrip_lines(tagged: Iterable[Tuple[str, bool]]) -> Iterable[Tuple[str, bool]]:
+    for line, in_code in tagged:
+        yield (line if in_code else line.rstrip()), in_code
+
+
+Paragraph = List[Tuple[str, bool]]
+
+
+def _paragraph_text(para: Paragraph) -> str:
+    return "\n".join(line for line, _in_code in para)
+
+
+def _paragraphs(tagged: Iterable[Tuple[str, bool]]) -> Iterable[Paragraph]:
+    # Group lines into paragraphs and blank runs; code blocks never split on blanks.
+    block: Paragraph = []
+    block_blank = False
+    for line, in_code in tagged:
+        blank = not line.strip() and not in_code
+        if block and blank != block_blank:
+            yield block
+            block = []
+        block_blank = blank
+        block.append((line, in_code))
+    if block:
+        yield block
+
+
+def _dedupe_paragraphs(paragraphs: Iterable[Paragraph], min_chars: int) -> Iterable[Paragraph]:
+    seen: set = set()
+    last_heading: Optional[str] = None
+    for para in paragraphs:
+        if not _paragraph_text(para).strip():
+            yield para
+            continue
+        if any(in_code for _line, in_code in para):
+            last_heading = None
+            yield para  # fenced code is never rewritten
+            continue
+
+        # Drop headings that repeat the previous heading with nothing in between.
+        kept: Paragraph = []
+        for line, in_code in para:
+            if _heading_level(line):
+                if line.strip() == last_heading:
+                    continue
+                last_heading = line.strip()
+            else:
+                last_heading = None
+            kept.append((line, in_code))
+        if not kept:
+            continue
+
+        key = _paragraph_text(kept).strip()
+        if len(key) >= min_chars:
+            digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+        yield kept
+
+
+def _collapse_blank_runs(paragraphs: Iterable[Paragraph]) -> Iterable[Paragraph]:
+    pending_blank = False
+    started = False
+    for para in paragraphs:
+        if not _paragraph_text(para).strip():
+            pending_blank = started
+            continue
+        if pending_blank:
+            yield [("", False)]
+        pending_blank = False
+        started = True
+        yield para
+
+
+def normalize_content(text: str, rules: Dict[str, Any]) -> str:
+    """Stream text through the enabled normalization rules.
+
+    Rules: `strip_comments` (HTML comments, incl. slice markers), `resolve_links`
+    (`[[target|alias]]` to plain text), `collapse_whitespace` (trailing spaces,
+    repeated blank lines), `dedupe_paragraphs` (identical paragraphs of at least
+    `dedupe_min_chars` characters, default 40, and back-to-back repeated headings).
+    Fenced code blocks are left untouched.
+    """
+    tagged = _tag_code_lines(text.split("\n"))
+    if rules.get("strip_comments"):
+        tagged = _strip_comment_lines(tagged)
+    if rules.get("resolve_links"):
+        tagged = _resolve_link_lines(tagged)
+    if rules.get("collapse_whitespace"):
+        tagged = _rstrip_lines(tagged)
+
+    paragraphs = _paragraphs(tagged)
+    if rules.get("dedupe_paragraphs"):
+        paragraphs = _dedupe_paragraphs(paragraphs, int(rules.get("dedupe_min_chars", 40)))
+    if rules.get("collapse_whitespace"):
+        paragraphs = _collapse_blank_runs(paragraphs)
+
+    return "\n".join(line for para in paragraphs for line, _in_code in para)
+
+
+def _normalize_output(cfg: Dict[str, Any], text: str) -> Tuple[str, Optional[NormalizeReport]]:
+    rules = _normalize_rules(cfg.get("normalize"))
+    if not rules:
+        return text, None
+    normalized = normalize_content(text, rules)
+    report = NormalizeReport(
+        bytes_before=len(text.encode("utf-8")),
+        bytes_after=len(normalized.encode("utf-8")),
+        tokens_before=count_tokens(text),
+        tokens_after=count_tokens(normalized),
+    )
+    return normalized, report
+
+
+@dataclass(frozen=True)
+class SplitSection:
+    title: str
+    filename: str
+    text: str
+    tokens: int
+
+
+def _heading_level(line: str) -> int:
+    m = re.match(r"(#{1,6})\s", line)
+    return len(m.group(1)) if m else 0
+
+
+def _slugify(title: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")
+    return slug or "section"
+
+
+def split_oversized_sections(
+    body: str,
+    max_section_tokens: int,
+    heading_level: int = 2,
+    reserved_names: Iterable[str] = (),
+) -> Tuple[str, List[SplitSection]]:
+    """Move sections at `heading_level` larger than `max_section_tokens` out of body.
+
+    Returns the remaining body and the split sections (with unique `.md` filenames
+    that avoid `reserved_names`). Headings inside fenced code are ignored.
+    """
+    chunks: List[Tuple[int, List[str]]] = [(0, [])]
+    for line, in_code in _tag_code_lines(body.split("\n")):
+        level = 0 if in_code else _heading_level(line)
+        if level and level <= heading_level:
+            chunks.append((level, [line]))
+        else:
+            chunks[-1][1].append(line)
+
+    used = set(reserved_names)
+    kept: List[str] = []
+    split: List[SplitSection] = []
+    for level, lines in chunks:
+        text = "\n".join(lines).strip()
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if level != heading_level or tokens <= max_section_tokens:
+            kept.append(text)
+            continue
+
+        title = lines[0].lstrip("#").strip()
+        stem = _slugify(title)
+        filename, n = f"{stem}.md", 2
+        while filename in used:
+            filename, n = f"{stem}-{n}.md", n + 1
+        used.add(filename)
+        split.append(SplitSection(title=title, filename=filename, text=text, tokens=tokens))
+
+    return "\n\n".join(kept), split
+
+
+def _render_reference_index(entries: List[Tuple[str, str, int]]) -> str:
+    # entries: (title, references/ filename, tokens)
+    lines = ["## Reference Index", "", "Load on demand:", ""]
+    for title, filename, tokens in entries:
+        target = f"references/{filename}"
+        if " " in target:
+            target = f"<{target}>"
+        lines.append(f"- [{title}]({target}) — {tokens} tokens")
+    return "\n".join(lines)
+
+
 def _agentskills_validate(name: str, description: str) -> Optional[str]:
     if not re.fullmatch(r"[a-z0-9-]{1,64}", name):
         return "Skill name must match ^[a-z0-9-]{1,64}$"
@@ -352,17 +847,11 @@ def _write_text(path: Path, text: str, dry_run: bool) -> None:
     path.write_text(text, encoding="utf-8")
 
 
-def _write_bytes(path: Path, data: bytes, dry_run: bool) -> None:
-    if dry_run:
-        return
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_bytes(data)
-
-
-def _read_source_bytes(source: Dict[str, Any], base_path: Path) -> Optional[bytes]:
+def _read_source_bytes(source: Dict[str, Any], base_path: Path) -> Tuple[Optional[bytes], Optional[str]]:
+    """Read a role item as bytes. Returns (data, error); never prints, so it is safe off-thread."""
     inline = source.get("inline")
     if isinstance(inline, str):
-        return (inline + "\n").encode("utf-8")
+        return (inline + "\n").encode("utf-8"), None
 
     slice_id = source.get("slice")
     slice_file = source.get("slice-file") or source.get("slice_file")
@@ -371,19 +860,40 @@ def _read_source_bytes(source: Dict[str, Any], base_path: Path) -> Optional[byte
     if slice_id and slice_file:
         full_path = _resolve_context_path(base_path, str(slice_file))
         if not full_path.exists():
-            return None
-        txt = extract_slice(full_path, str(slice_id))
+            return None, f"Source-file communion failed: {full_path}"
+        try:
+            txt = _find_slice(full_path.read_text(encoding="utf-8"), str(slice_id))
+        except (OSError, UnicodeDecodeError) as e:
+            return None, f"Slice extraction failed, heretek: {full_path}\nError-hymn: {e}"
         if txt is None:
-            return None
-        return (txt + "\n").encode("utf-8")
+            return None, f"Sacred slice-marker '{slice_id}' absent from flesh-relic: {full_path}"
+        return (txt + "\n").encode("utf-8"), None
 
     if file_only and not slice_id:
         full_path = _resolve_context_path(base_path, str(file_only))
         if not full_path.exists():
-            return None
-        return full_path.read_bytes()
+            return None, f"Source-file communion failed: {full_path}"
+        try:
+            return full_path.read_bytes(), None
+        except OSError as e:
+            return None, f"Whole-file inclusion failed, heretek: {full_path}\nError-hymn: {e}"
 
-    return None
+    return None, f"Invalid source-relic parameters, flesh-thing: {source}"
+
+
+# Small-file staging is latency bound, so a few threads overlap the syscalls.
+_SKILL_IO_WORKERS = 8
+
+
+def _stage_item(source: Dict[str, Any], base_path: Path, dest: Path, dry_run: bool) -> Tuple[Optional[bytes], Optional[str]]:
+    # Read then write in one task so each item pipelines independently.
+    data, error = _read_source_bytes(source, base_path)
+    if data is not None and not dry_run:
+        try:
+            dest.write_bytes(data)
+        except OSError as e:
+            return None, f"Relic inscription failed, heretek: {dest}\nError-hymn: {e}"
+    return data, error
 
 
 def _agent_output_filename(recipe_name: str, section: RecipeSection, total_sections: int) -> str:
@@ -444,10 +954,38 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
             return []
 
         template = cfg.get("template")
-        content = assemble_content(sources, base_path, template=template)
+        max_tokens = cfg.get("max_tokens")
+        if max_tokens is not None:
+            try:
+                max_tokens = int(max_tokens)
+            except (TypeError, ValueError):
+                print(f"☠☠☠ >>> SOURCE·CONFIGURATION·HERESY ☠☠☠")
+                print(f"max_tokens must be an integer, got {max_tokens!r}: {section.recipe_file}")
+                print(f"|001101|—|000000|—|111000|— void communion")
+                return []
+        content, token_report = assemble_content_with_report(
+            sources,
+            base_path,
+            template=template,
+            max_tokens=max_tokens,
+            cache_stable_first=bool(cfg.get("cache_stable_first", False)),
+            normalize_rules=_normalize_rules(cfg.get("normalize")),
+        )
         if not content:
             return []
 
+        dropped = [s.label for s in token_report.sources if s.dropped]
+        if dropped:
+            print(f"☠☠☠ >>> TOKEN·BUDGET·EXCEEDED ☠☠☠")
+            print(f"Dropped low-priority sources to fit {max_tokens} tokens: {', '.join(dropped)}")
+            print(f"|001101|—|000000|—|111000|— {section.recipe_file}")
+        if token_report.over_budget:
+            print(f"☠☠☠ >>> TOKEN·BUDGET·VIOLATION ☠☠☠")
+            print(f"Output still {token_report.total_tokens} tokens (budget {max_tokens}): {section.recipe_file}")
+            print(f"|001101|—|000000|—|111000|— boot context overweight")
+
+        content, normalize_report = _normalize_output(cfg, content)
+
         # Determine filename with optional disambiguation.
         total_sections = int(cfg.get("_total_sections", 1))
         filename = _agent_output_filename(recipe_name, section, total_sections)
@@ -476,6 +1014,9 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
                 abspath=out_path,
                 targets=resolved_targets,
                 is_dir=False,
+                token_report=token_report,
+                content=content,
+                normalize_report=normalize_report,
             )
         ]
 
@@ -516,10 +1057,30 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
             body_sources = []
         body = assemble_content(body_sources, base_path, template=None) or ""
         body = _strip_frontmatter(body)
-        skill_md_text = _format_yaml_frontmatter(fm) + "\n\n" + body.strip() + "\n"
-        _write_text(out_root / "SKILL.md", skill_md_text, dry_run)
+        body, normalize_report = _normalize_output(cfg, body)
+
+        # Optional progressive packaging: oversized sections become lazy references.
+        split_cfg = skill_md_cfg.get("split")
+        reference_index: List[Tuple[str, str, int]] = []
+        split_enabled = isinstance(split_cfg, dict) and split_cfg.get("max_section_tokens")
+        if split_enabled:
+            reserved = [
+                str(item.get("output_name") or Path(str(item.get("file") or item.get("slice-file") or "")).name)
+                for item in (sources_cfg.get("references") or [])
+                if isinstance(item, dict)
+            ]
+            body, split_sections = split_oversized_sections(
+                body,
+                int(split_cfg["max_section_tokens"]),
+                heading_level=int(split_cfg.get("heading_level", 2)),
+                reserved_names=reserved,
+            )
+            for sec in split_sections:
+                _write_text(out_root / "references" / sec.filename, sec.text + "\n", dry_run)
+                reference_index.append((sec.title, sec.filename, sec.tokens))
 
         # Role folders: references/, assets/, scripts/
+        jobs: List[Tuple[str, str, Dict[str, Any], Path]] = []
         for role, subdir in (("references", "references"), ("assets", "assets"), ("scripts", "scripts")):
             items = sources_cfg.get(role) or []
             if not isinstance(items, list):
@@ -531,13 +1092,46 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
                 if not out_name:
                     file_path = item.get("file") or item.get("slice-file")
                     out_name = Path(str(file_path or "artifact")).name
-                data = _read_source_bytes(item, base_path)
-                if data is None:
+                jobs.append((role, str(out_name), item, out_root / subdir / str(out_name)))
+
+        if not dry_run:
+            for parent in sorted({dest.parent for _role, _name, _item, dest in jobs}):
+                parent.mkdir(parents=True, exist_ok=True)
+
+        # Items stage concurrently; results are consumed in recipe order so
+        # error reporting and the reference index stay deterministic.
+        results: List[Tuple[Optional[bytes], Optional[str]]] = []
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(_SKILL_IO_WORKERS, len(jobs))) as pool:
+                futures = [pool.submit(_stage_item, item, base_path, dest, dry_run) for _role, _name, item, dest in jobs]
+                results = [f.result() for f in futures]
+
+        for (role, out_name, _item, _dest), (data, error) in zip(jobs, results):
+            if data is None:
+                print(f"☠☠☠ >>> FLESH·RELIC·ABSENT ☠☠☠")
+                print(error)
+                print(f"|001101|—|000000|—|111000|— skipping {role}/{out_name}")
+                continue
+            if split_enabled and role == "references":
+                try:
+                    ref_text = data.decode("utf-8")
+                except UnicodeDecodeError:
                     continue
-                _write_bytes(out_root / subdir / str(out_name), data, dry_run)
+                reference_index.append((Path(out_name).stem, out_name, count_tokens(ref_text)))
+
+        if reference_index:
+            body = body.strip() + "\n\n" + _render_reference_index(reference_index)
+        skill_md_text = _format_yaml_frontmatter(fm) + "\n\n" + body.strip() + "\n"
+        _write_text(out_root / "SKILL.md", skill_md_text, dry_run)
 
         artifacts: List[OutputArtifact] = [
-            OutputArtifact(relpath=(Path("skill") / skill_name).as_posix(), abspath=out_root, targets=targets, is_dir=True)
+            OutputArtifact(
+                relpath=(Path("skill") / skill_name).as_posix(),
+                abspath=out_root,
+                targets=targets,
+                is_dir=True,
+                normalize_report=normalize_report,
+            )
         ]
 
         return artifacts
@@ -568,6 +1162,7 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
             md_content = assemble_content(md_sources, base_path, template=md_template)
             if md_content is None:
                 md_content = ""
+            md_content, md_normalize_report = _normalize_output(cfg, md_content)
             md_filename = f"{recipe_name}.md"
             md_path = out_root / md_filename
             _write_text(md_path, md_content.strip() + "\n", dry_run)
@@ -577,6 +1172,7 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
                     abspath=md_path,
                     targets=md_targets,
                     is_dir=False,
+                    normalize_report=md_normalize_report,
                 )
             )
 
@@ -586,6 +1182,7 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
             if not isinstance(hook_sources, list):
                 hook_sources = []
             prompt_text = assemble_content(hook_sources, base_path, template=None) or ""
+            prompt_text, hook_normalize_report = _normalize_output(cfg, prompt_text)
 
             hook_cfg = cfg.get("kiro_hook_config") or {}
             if not isinstance(hook_cfg, dict):
@@ -612,6 +1209,7 @@ def build_output_artifacts(section: RecipeSection, base_path: Path, staging_dir:
                     abspath=hook_path,
                     targets=hook_targets,
                     is_dir=False,
+                    normalize_report=hook_normalize_report,
                 )
             )
 
@@ -673,9 +1271,15 @@ def update_manifest(manifest_path: Path, entries: List[Dict[str, Any]]) -> None:
             out = str(e.get("output") or "")
             targets = e.get("targets") or []
             status = str(e.get("status") or "")
+            tokens = e.get("tokens")
             lines = [f"- **{entry_id}**: Last run {timestamp}"]
             if out:
                 lines.append(f"  - Output: `{_display_path(out)}`")
+            if tokens is not None:
+                lines.append(f"  - Tokens: {tokens}")
+            normalized = e.get("normalized")
+            if normalized is not None:
+                lines.append(f"  - Normalized: -{normalized.bytes_saved} bytes, -{normalized.tokens_saved} tokens")
             if isinstance(targets, list):
                 for t in targets:
                     sanitized = _sanitize_path_for_public(str(t))
@@ -722,6 +1326,48 @@ def update_manifest(manifest_path: Path, entries: List[Dict[str, Any]]) -> None:
         print(f"|001101|—|000000|—|111000|— record keeping compromised")
 
 
+def _print_token_report(artifact: OutputArtifact) -> None:
+    report = artifact.token_report
+    budget = f" / {report.max_tokens}" if report.max_tokens is not None else ""
+    print(f"☠☠☠ >>> TOKEN·ACCOUNTING ☠☠☠")
+    print(f"{artifact.relpath}: {report.total_tokens}{budget} tokens")
+    for src, share in report.dominant():
+        print(f"  {src.tokens:>7}  {share:6.1%}  {src.label}")
+    for src in report.sources:
+        if src.dropped:
+            print(f"  {src.tokens:>7}  dropped  {src.label}")
+    print(f"|001101|—|001101|—|111000|— tokens weighed")
+
+
+def _print_prefix_report(artifacts: List[OutputArtifact]) -> None:
+    outputs = {a.relpath: a.content for a in artifacts if a.content is not None}
+    if len(outputs) < 2:
+        return
+
+    print(f"☠☠☠ >>> PREFIX·CACHE·ANALYSIS ☠☠☠")
+    for st in analyze_shared_prefixes(outputs):
+        partner = f" (with {st.shares_with})" if st.shares_with else ""
+        print(
+            f"{st.output}: {st.shared_prefix_tokens}/{st.total_tokens} tokens shared, "
+            f"{st.cacheable_tokens} cacheable{partner}"
+        )
+
+    # Sources reused across outputs but not marked stable are reorder candidates.
+    usage: Dict[str, int] = {}
+    stable: set = set()
+    for a in artifacts:
+        if a.token_report is None:
+            continue
+        for src in a.token_report.sources:
+            usage[src.label] = usage.get(src.label, 0) + 1
+            if src.cache_stable:
+                stable.add(src.label)
+    candidates = sorted(label for label, n in usage.items() if n > 1 and label not in stable)
+    for label in candidates:
+        print(f"  shared in {usage[label]} outputs, not cache_stable: {label}")
+    print(f"|001101|—|001101|—|111000|— prefixes weighed")
+
+
 def main():
     """Main assembly process."""
     import argparse
@@ -731,6 +1377,7 @@ def main():
     parser = argparse.ArgumentParser(description='Assemble context content from recipes')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be done without writing files')
     parser.add_argument('--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('--prefix-report', action='store_true', help='Report prompt-cache prefixes shared across agent outputs')
     args = parser.parse_args()
     
     # Set up absolute paths
@@ -770,6 +1417,7 @@ def main():
     
     # Accumulate all manifest entries across all recipes
     all_manifest_entries: List[Dict[str, Any]] = []
+    all_artifacts: List[OutputArtifact] = []
     
     for recipe_path in recipe_files:
         if args.verbose:
@@ -821,6 +1469,7 @@ def main():
             print(f"|001101|—|000000|—|111000|— void communion")
             continue
 
+        all_artifacts.extend(artifacts)
         for a in artifacts:
             if args.dry_run:
                 print(f"☠☠☠ >>> DRY·RUN·PROTOCOL·ACTIVE ☠☠☠")
@@ -831,6 +1480,14 @@ def main():
                 print(f"Output manifest: {a.abspath}")
                 print(f"|001101|—|001101|—|111000|— data-spirit bound")
 
+            if args.verbose and a.token_report is not None:
+                _print_token_report(a)
+            if args.verbose and a.normalize_report is not None:
+                nr = a.normalize_report
+                print(f"☠☠☠ >>> NORMALIZATION·RITE ☠☠☠")
+                print(f"{a.relpath}: -{nr.bytes_saved} bytes, -{nr.tokens_saved} tokens ({nr.tokens_after} remain)")
+                print(f"|001101|—|001101|—|111000|— flesh trimmed")
+
         if not args.dry_run:
             for a in artifacts:
                 rel = a.relpath
@@ -840,8 +1497,19 @@ def main():
                 else:
                     entry_id = Path(rel).with_suffix("").as_posix()
                     out = rel
-                all_manifest_entries.append({"id": entry_id, "output": out, "targets": a.targets, "status": "✓ assembled"})
+                entry = {"id": entry_id, "output": out, "targets": a.targets, "status": "✓ assembled"}
+                if a.token_report is not None:
+                    # Agent/project budgets are already measured after normalization.
+                    entry["tokens"] = a.token_report.total_tokens
+                elif a.normalize_report is not None:
+                    entry["tokens"] = a.normalize_report.tokens_after
+                if a.normalize_report is not None:
+                    entry["normalized"] = a.normalize_report
+                all_manifest_entries.append(entry)
     
+    if args.prefix_report:
+        _print_prefix_report(all_artifacts)
+
     # Update manifest once with all entries
     if not args.dry_run and all_manifest_entries:
         update_manifest(manifest_path, all_manifest_entries)
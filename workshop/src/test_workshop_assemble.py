@@ -252,6 +252,299 @@ class TestWorkshopAssemble(unittest.TestCase):
             hook_obj = json.loads(hook_art.abspath.read_text(encoding="utf-8"))
             self.assertIn("INLINE HOOK PROMPT", hook_obj["then"]["prompt"])
 
+    def test_agent_token_budget_drops_lowest_priority_source(self) -> None:
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td) / "base"
+            out = Path(td) / "out"
+            base.mkdir(parents=True, exist_ok=True)
+            (base / "core.md").write_text("CORE " * 20 + "\n", encoding="utf-8")
+            (base / "extra.md").write_text("EXTRA " * 200 + "\n", encoding="utf-8")
+
+            section = assemble.RecipeSection(
+                recipe_file=Path(td) / "recipe.md",
+                index=0,
+                config={
+                    "name": "Demo",
+                    "output_format": "agent",
+                    "max_tokens": 50,
+                    "target_locations": [{"path": "~/Demo/AGENTS.md"}],
+                    "sources": [
+                        {"file": "core.md", "priority": 10},
+                        {"file": "extra.md"},
+                    ],
+                },
+            )
+
+            artifacts = assemble.build_output_artifacts(section, base, out, dry_run=False)
+            text = artifacts[0].abspath.read_text(encoding="utf-8")
+            self.assertIn("CORE", text)
+            self.assertNotIn("EXTRA", text)
+
+            report = artifacts[0].token_report
+            self.assertFalse(report.over_budget)
+            self.assertEqual([s.label for s in report.sources if s.dropped], ["extra.md"])
+            self.assertLessEqual(report.total_tokens, 50)
+
+    def test_agent_token_budget_is_measured_after_normalization(self) -> None:
+        import contextlib
+        import io
+
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td) / "base"
+            out = Path(td) / "out"
+            base.mkdir(parents=True, exist_ok=True)
+            (base / "core.md").write_text("CORE " * 20 + "\n", encoding="utf-8")
+            (base / "extra.md").write_text("<!-- " + "note " * 200 + "-->\nEXTRA\n", encoding="utf-8")
+
+            config = {
+                "name": "Demo",
+                "output_format": "agent",
+                "max_tokens": 50,
+                "normalize": {"strip_comments": True},
+                "target_locations": [{"path": "~/Demo/AGENTS.md"}],
+                "sources": [{"file": "core.md", "priority": 10}, {"file": "extra.md"}],
+            }
+            section = assemble.RecipeSection(recipe_file=Path(td) / "recipe.md", index=0, config=config)
+            artifacts = assemble.build_output_artifacts(section, base, out, dry_run=False)
+            text = artifacts[0].abspath.read_text(encoding="utf-8")
+            self.assertIn("EXTRA", text)
+            report = artifacts[0].token_report
+            self.assertFalse(any(s.dropped for s in report.sources))
+            self.assertEqual(report.total_tokens, artifacts[0].normalize_report.tokens_after)
+
+            section = assemble.RecipeSection(
+                recipe_file=Path(td) / "recipe.md", index=0, config={**config, "max_tokens": "4k"}
+            )
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                self.assertEqual(assemble.build_output_artifacts(section, base, out, dry_run=False), [])
+            self.assertIn("max_tokens must be an integer, got '4k'", log.getvalue())
+
+    def test_token_cache_is_bounded(self) -> None:
+        import workshop.src.assemble as assemble
+
+        for i in range(assemble._TOKEN_CACHE_MAX + 10):
+            assemble.count_tokens(f"text {i}")
+        self.assertEqual(len(assemble._TOKEN_CACHE), assemble._TOKEN_CACHE_MAX)
+
+    def test_token_report_ranks_dominant_sources(self) -> None:
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td)
+            (base / "small.md").write_text("tiny\n", encoding="utf-8")
+            (base / "big.md").write_text("word " * 100 + "\n", encoding="utf-8")
+
+            content, report = assemble.assemble_content_with_report(
+                [{"file": "small.md"}, {"file": "big.md"}, {"inline": "note"}], base
+            )
+            self.assertIsNotNone(content)
+            self.assertEqual(report.total_tokens, assemble.count_tokens(content))
+            top, share = report.dominant(limit=1)[0]
+            self.assertEqual(top.label, "big.md")
+            self.assertGreater(share, 0.9)
+
+    def test_cache_stable_sources_share_a_prefix_across_outputs(self) -> None:
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td)
+            (base / "operator.md").write_text("OPERATOR\n" * 5, encoding="utf-8")
+            (base / "mesh.md").write_text("MESH\n" * 5, encoding="utf-8")
+            (base / "a.md").write_text("AGENT A\n", encoding="utf-8")
+            (base / "b.md").write_text("AGENT B\n", encoding="utf-8")
+
+            a = assemble.assemble_content(
+                [{"file": "a.md"}, {"file": "operator.md", "cache_stable": True}, {"file": "mesh.md", "cache_stable": True}],
+                base,
+                cache_stable_first=True,
+            )
+            b = assemble.assemble_content(
+                [{"file": "mesh.md", "cache_stable": True}, {"file": "b.md"}, {"file": "operator.md", "cache_stable": True}],
+                base,
+                cache_stable_first=True,
+            )
+            self.assertTrue(a.startswith("MESH"))
+            self.assertTrue(a.endswith("AGENT A"))
+            self.assertTrue(b.endswith("AGENT B"))
+
+            stats = {st.output: st for st in assemble.analyze_shared_prefixes({"a": a, "b": b}, min_cacheable_tokens=1)}
+            shared = assemble.count_tokens(a[: a.index("AGENT A")])
+            self.assertEqual(stats["a"].shares_with, "b")
+            self.assertEqual(stats["a"].shared_prefix_tokens, shared)
+            self.assertEqual(stats["b"].cacheable_tokens, shared)
+
+            unordered = assemble.analyze_shared_prefixes({"a": "AGENT A\nx\n", "b": "AGENT B\nx\n"})
+            self.assertTrue(all(st.shared_prefix_tokens == 0 for st in unordered))
+
+    def test_normalize_pass_strips_obsidian_isms_and_reports_savings(self) -> None:
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td) / "base"
+            out = Path(td) / "out"
+            base.mkdir(parents=True, exist_ok=True)
+            repeated = "This paragraph appears in two source files verbatim."
+            (base / "a.md").write_text(
+                "# Guide\n\n<!-- slice:intro -->\nSee [[Other Note|the other note]] and [[Plain]].   \n\n\n\n"
+                + repeated
+                + "\n<!-- /slice -->\n\n```\n[[kept]]  \n```\n",
+                encoding="utf-8",
+            )
+            (base / "b.md").write_text("# Guide\n\n" + repeated + "\n", encoding="utf-8")
+
+            section = assemble.RecipeSection(
+                recipe_file=Path(td) / "recipe.md",
+                index=0,
+                config={
+                    "name": "Demo",
+                    "output_format": "agent",
+                    "normalize": True,
+                    "target_locations": [{"path": "~/Demo/AGENTS.md"}],
+                    "sources": [{"file": "a.md"}, {"file": "b.md"}],
+                },
+            )
+
+            artifacts = assemble.build_output_artifacts(section, base, out, dry_run=False)
+            text = artifacts[0].abspath.read_text(encoding="utf-8")
+            self.assertNotIn("<!--", text)
+            self.assertIn("See the other note and Plain.\n", text)
+            self.assertNotIn("\n\n\n", text)
+            self.assertEqual(text.count(repeated), 1)
+            self.assertIn("[[kept]]  \n", text)
+
+            report = artifacts[0].normalize_report
+            self.assertGreater(report.bytes_saved, 0)
+            self.assertGreater(report.tokens_saved, 0)
+
+            rules_only_links = assemble.normalize_content("a  \n[[x]]", {"resolve_links": True})
+            self.assertEqual(rules_only_links, "a  \nx")
+
+    def test_normalize_dedupe_leaves_code_tags_and_commented_fences_alone(self) -> None:
+        import workshop.src.assemble as assemble
+
+        rules = {"dedupe_paragraphs": True}
+        code = "```\nthe same fenced code block repeated in two places\n```"
+        text = code + "\n\nbetween\n\n" + code + "\n"
+        self.assertEqual(assemble.normalize_content(text, rules), text)
+
+        tags = "#project\n\n#project\n"
+        self.assertEqual(assemble.normalize_content(tags, rules), tags)
+        self.assertEqual(assemble.normalize_content("## H\n\n## H\n", rules), "## H\n\n")
+
+        tagged = list(assemble._tag_code_lines(["<!--", "```", "-->", "## Real"]))
+        self.assertEqual(tagged, [("<!--", False), ("```", False), ("-->", False), ("## Real", False)])
+
+    def test_normalize_dedupe_min_chars_zero_is_kept(self) -> None:
+        import workshop.src.assemble as assemble
+
+        rules = assemble._normalize_rules({"dedupe_paragraphs": True, "dedupe_min_chars": 0, "resolve_links": False})
+        self.assertEqual(rules, {"dedupe_paragraphs": True, "dedupe_min_chars": 0})
+        self.assertEqual(assemble.normalize_content("ok\n\nok\n", rules), "ok\n\n")
+        self.assertEqual(
+            assemble.normalize_content("ok\n\nok\n", assemble._normalize_rules({"dedupe_paragraphs": True})),
+            "ok\n\nok\n",
+        )
+
+    def test_skill_split_moves_oversized_sections_to_references(self) -> None:
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td) / "base"
+            out = Path(td) / "out"
+            base.mkdir(parents=True, exist_ok=True)
+            (base / "SKILL.md").write_text(
+                "# Demo\n\nIntro.\n\n## Quick Start\n\nShort.\n\n## Deep Dive\n\n"
+                + "detail " * 300
+                + "\n\n```bash\n## not a heading\n```\n",
+                encoding="utf-8",
+            )
+            (base / "guide.md").write_text("guide text\n", encoding="utf-8")
+
+            section = assemble.RecipeSection(
+                recipe_file=Path(td) / "recipe.md",
+                index=0,
+                config={
+                    "name": "demo",
+                    "output_format": "skill",
+                    "target_locations": [{"path": "~/.claude/skills/demo/"}],
+                    "sources": {
+                        "skill_md": {
+                            "frontmatter": {"name": "demo", "description": "Demo"},
+                            "body": [{"file": "SKILL.md"}],
+                            "split": {"max_section_tokens": 100},
+                        },
+                        "references": [{"file": "guide.md", "output_name": "deep-dive.md"}],
+                    },
+                },
+            )
+
+            artifacts = assemble.build_output_artifacts(section, base, out, dry_run=False)
+            root = artifacts[0].abspath
+            skill_md = (root / "SKILL.md").read_text(encoding="utf-8")
+            self.assertIn("## Quick Start", skill_md)
+            self.assertNotIn("detail detail", skill_md)
+            self.assertIn("## Reference Index", skill_md)
+            self.assertIn("[Deep Dive](references/deep-dive-2.md)", skill_md)
+            self.assertIn("[deep-dive](references/deep-dive.md)", skill_md)
+
+            split_text = (root / "references" / "deep-dive-2.md").read_text(encoding="utf-8")
+            self.assertTrue(split_text.startswith("## Deep Dive"))
+            self.assertIn("## not a heading", split_text)
+            self.assertEqual((root / "references" / "deep-dive.md").read_text(encoding="utf-8"), "guide text\n")
+
+    def test_skill_role_items_stage_in_parallel_with_ordered_errors(self) -> None:
+        import contextlib
+        import io
+        import workshop.src.assemble as assemble
+
+        with TemporaryDirectory() as td:
+            base = Path(td) / "base"
+            out = Path(td) / "out"
+            (base / "refs").mkdir(parents=True, exist_ok=True)
+            (base / "SKILL.md").write_text("Body\n", encoding="utf-8")
+            (base / "refs" / "sliced.md").write_text("<!-- slice:s -->\nSLICED\n<!-- /slice -->\n", encoding="utf-8")
+            refs = []
+            for i in range(20):
+                (base / "refs" / f"r{i}.md").write_text(f"ref {i}\n", encoding="utf-8")
+                refs.append({"file": f"refs/r{i}.md"})
+            refs.insert(5, {"file": "refs/missing-a.md"})
+            refs.insert(12, {"file": "refs/missing-b.md"})
+            (base / "refs" / "binary.md").write_bytes(b"<!-- slice:b -->\xff\xfe<!-- /slice -->")
+            refs.append({"slice": "b", "slice-file": "refs/binary.md", "output_name": "binary.md"})
+
+            section = assemble.RecipeSection(
+                recipe_file=Path(td) / "recipe.md",
+                index=0,
+                config={
+                    "name": "demo",
+                    "output_format": "skill",
+                    "target_locations": [{"path": "~/.claude/skills/demo/"}],
+                    "sources": {
+                        "skill_md": {"body": [{"file": "SKILL.md"}]},
+                        "references": refs,
+                        "scripts": [{"slice": "s", "slice-file": "refs/sliced.md", "output_name": "s.py"}],
+                    },
+                },
+            )
+
+            buf = io.StringIO()
+            with contextlib.redirect_stdout(buf):
+                artifacts = assemble.build_output_artifacts(section, base, out, dry_run=False)
+
+            root = artifacts[0].abspath
+            for i in range(20):
+                self.assertEqual((root / "references" / f"r{i}.md").read_text(encoding="utf-8"), f"ref {i}\n")
+            self.assertEqual((root / "scripts" / "s.py").read_text(encoding="utf-8"), "SLICED\n")
+            log = buf.getvalue()
+            self.assertLess(log.index("missing-a.md"), log.index("missing-b.md"))
+            self.assertIn("Slice extraction failed", log)
+            self.assertFalse((root / "references" / "binary.md").exists())
+
 
 if __name__ == "__main__":
     unittest.main()